@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import aiosmtplib
+from mail_handler import MailSender, QuotaExceededError, SendInterruptedError, SuppressedAddressError, error_result
+
+class AsyncMailSender:
+    """
+    asyncio SMTP sender keeping many transactions in flight on one event loop.
+
+    At most `max_concurrency` SMTP connections are opened; each one is reused
+    for the messages it pulls one at a time (see send_stream()). Every
+    connect and send is bounded by `timeout` seconds. Results use the same
+    (success, message) contract as MailSender.send_email.
+    """
+
+    def __init__(self, max_concurrency=20, timeout=30, start_tls=True, rate_limiter=None, suppression_list=None):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = rate_limiter
+        self.suppression_list = suppression_list
+        self.timeout = timeout
+        # start_tls=False is only meant for local stand-in servers
+        self.start_tls = start_tls
+        self.logger = logging.getLogger(__name__)
+        self._builder = MailSender()
+
+    async def _connect(self, smtp_server, smtp_port, username, password):
+        port = int(smtp_port)
+        if port == 465:
+            client = aiosmtplib.SMTP(hostname=smtp_server, port=port, use_tls=True, timeout=self.timeout)
+        else:
+            client = aiosmtplib.SMTP(hostname=smtp_server, port=port, start_tls=self.start_tls, timeout=self.timeout)
+        await asyncio.wait_for(client.connect(), self.timeout)
+        if password:
+            await asyncio.wait_for(client.login(username, password), self.timeout)
+        return client
+
+    async def _close(self, client):
+        if client is None:
+            return
+        try:
+            await asyncio.wait_for(client.quit(), self.timeout)
+        except Exception:
+            client.close()
+
+    async def _wait_for_quota(self, username, stop_event=None):
+        """Waits for the send budget of `username`; raises if the quota is spent or stop_event gets set."""
+        if self.rate_limiter is None:
+            return
+        while True:
+            ok, wait = self.rate_limiter.try_acquire(username)
+            if ok:
+                return
+            if wait is None:
+                raise QuotaExceededError(f"Daily quota reached for {username}", self.rate_limiter.next_reset())
+            # Slept in short slices so that a stop request is noticed quickly
+            while wait > 0:
+                if stop_event is not None and stop_event.is_set():
+                    raise SendInterruptedError(f"Stopped while waiting for the rate limit of {username}")
+                await asyncio.sleep(min(wait, 0.5))
+                wait -= 0.5
+
+    async def _send_on(self, client, smtp_server, smtp_port, username, password, msg, before_send=None):
+        """
+        Sends msg on client (connecting when None). Returns the client in use.
+
+        A reused client is probed with NOOP first and replaced if the server
+        dropped it. Once the transaction has started, only a 421 refusal of
+        MAIL FROM (nothing transmitted yet) is retried on a fresh connection:
+        any later failure may follow an accepted message, so it is raised.
+        """
+        if client is not None:
+            try:
+                await asyncio.wait_for(client.noop(), self.timeout)
+            except Exception:
+                await self._close(client)
+                client = None
+        for attempt in range(2):
+            if client is None:
+                client = await self._connect(smtp_server, smtp_port, username, password)
+            if before_send:
+                before_send()
+            try:
+                await asyncio.wait_for(client.send_message(msg), self.timeout)
+                return client
+            except aiosmtplib.SMTPSenderRefused as e:
+                await self._close(client)
+                client = None
+                if e.code != 421 or attempt == 1:
+                    raise
+
+    async def send_email(self, smtp_server, smtp_port, username, password, to_address, subject, content_html):
+        """Sends a single email on its own connection. Returns (success, message)."""
+        results = await self.send_many(smtp_server, smtp_port, username, password,
+                                       [(to_address, subject, content_html)])
+        return results[0]
+
+    async def send_stream(self, next_message, on_result=None, on_error=None, on_sending=None, workers=None,
+                          stop_event=None):
+        """
+        Sends messages pulled one at a time until `next_message` runs dry.
+
+        Each of the `workers` connections asks for its next message once the
+        previous one is done, and keeps its SMTP session open as long as the
+        messages are for the same account.
+
+        Args:
+            next_message (coroutine function): Awaited for the next message:
+                (key, (smtp_server, smtp_port, username, password),
+                (to_address, subject, content_html[, message_id])), or None
+                when there is nothing left to send.
+            on_result (callable): Called as on_result(key, success, message)
+                as soon as each message completes.
+            on_error (callable): Called as on_error(key, exception) before
+                on_result when a message failed.
+            on_sending (callable): Called as on_sending(key) right before
+                a message is transmitted (after any rate-limit wait).
+            workers (int): Number of concurrent connections (default
+                max_concurrency).
+            stop_event (threading.Event): When set, a rate-limit wait ends
+                with SendInterruptedError instead of sending.
+        """
+        async def worker():
+            client = connected_to = None
+            try:
+                while True:
+                    item = await next_message()
+                    if item is None:
+                        break
+                    key, endpoint, (to_address, subject, content_html, *message_id) = item
+                    smtp_server, smtp_port, username, password = endpoint
+                    if client is not None and connected_to != endpoint:
+                        await self._close(client)
+                        client = None
+                    connected_to = endpoint
+                    charged = started = False
+
+                    def before_send(key=key):
+                        nonlocal started
+                        started = True
+                        if on_sending:
+                            on_sending(key)
+
+                    try:
+                        if self.suppression_list is not None and to_address in self.suppression_list:
+                            raise SuppressedAddressError(f"{to_address} is on the suppression list")
+                        await self._wait_for_quota(username, stop_event)
+                        charged = self.rate_limiter is not None
+                        msg = self._builder.build_message(username, to_address, subject, content_html,
+                                                          message_id[0] if message_id else None)
+                        client = await self._send_on(client, smtp_server, smtp_port, username, password, msg,
+                                                     before_send)
+                        self.logger.info(f"Email sent successfully to {to_address} via {smtp_server}:{smtp_port}")
+                        result = (True, "Email envoyé avec succès")
+                    except Exception as e:
+                        if charged and not started:
+                            # Connection or login failed: the message never reached the server
+                            self.rate_limiter.refund(username)
+                        # The connection state is unknown after a failure
+                        if client is not None and not isinstance(e, (QuotaExceededError, SuppressedAddressError,
+                                                                     SendInterruptedError)):
+                            await self._close(client)
+                            client = None
+                        result = error_result(self.logger, to_address, e)
+                        if on_error:
+                            on_error(key, e)
+                    if on_result:
+                        on_result(key, *result)
+            finally:
+                await self._close(client)
+
+        count = self.max_concurrency if workers is None else workers
+        await asyncio.gather(*(worker() for _ in range(count)))
+
+    async def send_many(self, smtp_server, smtp_port, username, password, messages, on_result=None, on_error=None,
+                        on_sending=None):
+        """
+        Sends a batch of emails with bounded concurrency.
+
+        Args:
+            smtp_server (str): The SMTP server address.
+            smtp_port (str): The SMTP server port.
+            username (str): The user's email address.
+            password (str): The user's application password.
+            messages (list): (to_address, subject, content_html) tuples, with
+                an optional fourth Message-ID item.
+            on_result (callable): Called as on_result(index, success, message)
+                as soon as each message completes.
+            on_error (callable): Called as on_error(index, exception) before
+                on_result when a message failed.
+            on_sending (callable): Called as on_sending(index) right before
+                a message is transmitted (after any rate-limit wait).
+
+        Returns:
+            list: (success, message) tuples, in the order of `messages`.
+        """
+        results = [None] * len(messages)
+        endpoint = (smtp_server, smtp_port, username, password)
+        pending = iter(enumerate(messages))
+
+        async def next_message():
+            for index, message in pending:
+                return index, endpoint, message
+            return None
+
+        def record(index, success, message):
+            results[index] = (success, message)
+            if on_result:
+                on_result(index, success, message)
+
+        await self.send_stream(next_message, record, on_error, on_sending,
+                               workers=min(self.max_concurrency, len(messages)))
+        return results
+
+    def send_batch(self, smtp_server, smtp_port, username, password, messages, on_result=None, on_error=None,
+                   on_sending=None):
+        """Blocking wrapper around send_many() running its own event loop."""
+        return asyncio.run(self.send_many(smtp_server, smtp_port, username, password, messages, on_result, on_error,
+                                          on_sending))
@@ -0,0 +1,83 @@
+"""
+Applies replies and new entries to a 10k-entry history, one call at a time
+versus through the batch APIs (add_replies / add_entries), and compares with
+the former history.json load/modify/rewrite cycle.
+
+Run from the repository root: python benchmarks/bench_history_batch.py
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from history_manager import HistoryManager
+
+ENTRIES = 10_000
+REPLIES = 200
+LEGACY_REPLIES = 20  # the JSON rewrite is too slow to run for all of them
+NEW_ENTRIES = 1_000
+CONTENT = "<p>" + "Bonjour, ceci est un email de prospection. " * 20 + "</p>"
+
+
+def make_entries(n):
+    return [{"email": f"contact{i}@exemple.fr", "variable": "variable:Nom", "subject": "Votre invitation",
+             "uuid": str(uuid.uuid4()), "status": "Envoyé", "content": CONTENT} for i in range(n)]
+
+
+def make_replies(entries):
+    return [{"uuid": e["uuid"], "date": f"2026-01-01T10:{i // 60 % 60:02d}:{i % 60:02d}", "email": e["email"],
+             "subject": "Re: Votre invitation", "content": "Merci, avec plaisir."}
+            for i, e in enumerate(entries[-REPLIES:])]
+
+
+def legacy_json_add_reply(filepath, uuid_str, reply):
+    # The former HistoryManager.add_reply: full load, linear scan, full rewrite
+    with open(filepath, 'r') as f:
+        history = json.load(f)
+    for entry in history:
+        if entry.get("uuid") == uuid_str:
+            entry["replied"] = True
+            entry.setdefault("replies", []).append(reply)
+            break
+    with open(filepath, 'w') as f:
+        json.dump(history, f, indent=4)
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<36} {count:>5} ops {elapsed:8.3f}s  ({elapsed / count * 1000:.3f} ms/op)")
+    return elapsed
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        entries = make_entries(ENTRIES)
+        print(f"History of {ENTRIES} entries, {REPLIES} replies, {NEW_ENTRIES} new entries")
+
+        legacy_path = os.path.join(tmp, "legacy.json")
+        with open(legacy_path, 'w') as f:
+            json.dump([dict(e, replies=[], replied=False) for e in entries], f, indent=4)
+        replies = make_replies(entries)
+        timed("history.json add_reply (former)", LEGACY_REPLIES,
+              lambda: [legacy_json_add_reply(legacy_path, r["uuid"], dict(r)) for r in replies[:LEGACY_REPLIES]])
+
+        one = HistoryManager(os.path.join(tmp, "one.db"))
+        one.add_entries(entries)
+        timed("SQLite add_reply", REPLIES, lambda: [one.add_reply(r["uuid"], dict(r)) for r in replies])
+        timed("SQLite add_entry", NEW_ENTRIES, lambda: [one.add_entry(e["email"], e["variable"], e["subject"], e["uuid"], e["status"], e["content"])
+                                                            for e in make_entries(NEW_ENTRIES)])
+
+        batch = HistoryManager(os.path.join(tmp, "batch.db"))
+        batch.add_entries(entries)
+        timed("SQLite add_replies (1 transaction)", REPLIES, lambda: batch.add_replies([dict(r) for r in replies]))
+        timed("SQLite add_entries (1 transaction)", NEW_ENTRIES, lambda: batch.add_entries(make_entries(NEW_ENTRIES)))
+        timed("SQLite mark_replies_read", REPLIES, lambda: batch.mark_replies_read([(r["uuid"], r["date"]) for r in replies]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Extracts the results and the "next" form of saved DuckDuckGo result pages
+(benchmarks/fixtures/ddg_results_*.html) with every installed HTML backend,
+checks that they all find exactly what the former BeautifulSoup code found,
+and reports the parse time per page.
+
+Run from the repository root: python benchmarks/bench_html_parsing.py [rounds]
+"""
+import glob
+import os
+import sys
+import time
+import urllib.parse
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from html_backend import HtmlBackend
+from scraper import ScraperManager
+
+ROUNDS = 50
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ddg_results_*.html")
+
+
+def legacy_parse(html):
+    # The former ScraperManager.search_gigs / parse_next_page parsing
+    soup = BeautifulSoup(html, "html.parser")
+    results = []
+    for result_block in soup.find_all('div', class_='result'):
+        title_a = result_block.find('a', class_='result__url')
+        if title_a:
+            link = title_a.get('href')
+            if link and 'uddg=' in link:
+                params = urllib.parse.parse_qs(urllib.parse.urlparse(link).query)
+                if 'uddg' in params:
+                    link = params['uddg'][0]
+            title_h2 = result_block.find('h2', class_='result__title')
+            snippet_a = result_block.find('a', class_='result__snippet')
+            results.append({
+                "title": title_h2.get_text(strip=True) if title_h2 else "Titre non disponible",
+                "url": link,
+                "description": snippet_a.get_text(strip=True) if snippet_a else "Description non disponible."
+            })
+    forms = []
+    for form in soup.select("div.nav-link form"):
+        forms.append({field.get("name"): field.get("value", "") for field in form.find_all("input") if field.get("name")})
+    next_forms = [f for f in forms if f.get("s", "").isdigit() and int(f["s"]) > 0]
+    return results, min(next_forms, key=lambda f: int(f["s"])) if next_forms else None
+
+
+def extract(scraper, html):
+    document = scraper.html.parse(html)
+    return scraper.parse_results(document, 10_000), scraper.parse_next_page(document)
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS
+    pages = []
+    for path in sorted(glob.glob(FIXTURES)):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        pages.append((os.path.basename(path), html))
+    if not pages:
+        sys.exit(f"No fixture found in {FIXTURES}")
+
+    expected = {name: legacy_parse(html) for name, html in pages}
+    print(f"{len(pages)} pages, {sum(len(r) for r, _ in expected.values())} results, {rounds} rounds")
+
+    baseline = None
+    for backend in ["legacy"] + HtmlBackend.available():
+        scraper = ScraperManager(html_backend="html.parser" if backend == "legacy" else backend)
+        mismatches = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for name, html in pages:
+                got = legacy_parse(html) if backend == "legacy" else extract(scraper, html)
+                mismatches += got != expected[name]
+        elapsed = time.perf_counter() - start
+        per_page = elapsed / (rounds * len(pages)) * 1000
+        baseline = baseline or per_page
+        status = "identical" if not mismatches else f"{mismatches} MISMATCHES"
+        print(f"  {backend:<12} {per_page:8.2f} ms/page  (x{baseline / per_page:4.1f})  {status}")
+
+
+if __name__ == "__main__":
+    main()
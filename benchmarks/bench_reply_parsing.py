@@ -0,0 +1,101 @@
+"""
+Parses a synthetic corpus of a few thousand replies (.eml files: plain text,
+HTML with quoted history, base64 / quoted-printable parts, attachments) the
+way ReplyChecker.sync_folder() does, in-process versus through the parsing
+process pool, with and without a simulated FETCH round-trip per batch.
+
+Run from the repository root: python benchmarks/bench_reply_parsing.py [count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from reply_checker import FETCH_BATCH_SIZE, ReplyChecker, parse_reply
+
+MESSAGES = 3_000
+ROUND_TRIP = 0.05  # seconds per FETCH batch of FETCH_BATCH_SIZE messages
+QUOTE = "<p>Bonjour {nom},</p><p>" + "Suite à notre échange, voici notre proposition commerciale. " * 30 + "</p>"
+
+
+def make_eml(i, rng):
+    msg = EmailMessage()
+    msg["From"] = f"Contact {i} <contact{i}@exemple.fr>"
+    msg["To"] = "moi@exemple.fr"
+    msg["Subject"] = f"Re: Votre invitation n°{i} – réponse"
+    msg["Date"] = "Mon, 05 Jan 2026 10:00:00 +0100"
+    text = f"Bonjour,\n\nMerci pour votre message n°{i}, c'est noté.\n\nCordialement,\nContact {i}\n"
+    kind = rng.random()
+    if kind < 0.3:
+        msg.set_content(text, cte="quoted-printable")
+    else:
+        # Most clients send both parts and quote the whole thread in the HTML one
+        msg.set_content(text)
+        history = "".join(f"<blockquote>{QUOTE.format(nom=f'Contact {i}')}" for _ in range(rng.randint(1, 6)))
+        msg.add_alternative(f"<html><head><style>p {{ margin: 0 }}</style></head><body><div>{text}</div>"
+                            f"{history}{'</blockquote>' * history.count('<blockquote>')}</body></html>",
+                            subtype="html", cte="base64")
+    if kind > 0.85:
+        msg.add_attachment(os.urandom(rng.randint(10, 200) * 1024), maintype="application", subtype="pdf",
+                           filename=f"devis-{i}.pdf")
+    return msg.as_bytes()
+
+
+def write_corpus(directory, count):
+    rng = random.Random(42)
+    for i in range(count):
+        with open(os.path.join(directory, f"{i:05d}.eml"), 'wb') as f:
+            f.write(make_eml(i, rng))
+
+
+def fetched(corpus, round_trip):
+    # Stands in for ReplyChecker.fetch_raw(): one FETCH round-trip per batch
+    for i, (name, raw) in enumerate(corpus):
+        if round_trip and i % FETCH_BATCH_SIZE == 0:
+            time.sleep(round_trip)
+        yield name, raw
+
+
+def serial(corpus, spool, round_trip):
+    return {name: parse_reply(raw, os.path.join(spool, name)) for name, raw in fetched(corpus, round_trip)}
+
+
+def timed(label, count, func):
+    start = time.perf_counter()
+    results = func()
+    elapsed = time.perf_counter() - start
+    errors = sum(isinstance(r, Exception) for r in results.values())
+    print(f"  {label:<40} {count:>5} msgs {elapsed:8.3f}s  ({count / elapsed:8.0f} msgs/s)"
+          + (f"  {errors} errors" if errors else ""))
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES
+    with tempfile.TemporaryDirectory() as tmp:
+        eml_dir = os.path.join(tmp, "corpus")
+        os.makedirs(eml_dir)
+        write_corpus(eml_dir, count)
+        corpus = []
+        for name in sorted(os.listdir(eml_dir)):
+            with open(os.path.join(eml_dir, name), 'rb') as f:
+                corpus.append((name, f.read()))
+        size = sum(len(raw) for _, raw in corpus)
+        print(f"{count} replies, {size / (1024 * 1024):.1f} MB, {os.cpu_count()} CPUs")
+
+        checker = ReplyChecker("", "", "", spool_dir=os.path.join(tmp, "spool"))
+        # Start the workers outside of the measures, as a running application would have
+        checker.parse_replies(fetched(corpus[:100], 0), 100)
+
+        for round_trip in (0, ROUND_TRIP):
+            print(f"FETCH round-trip of {round_trip * 1000:.0f} ms per {FETCH_BATCH_SIZE} messages")
+            timed("in-process (former sync_folder)", count, lambda: serial(corpus, checker.spool_dir, round_trip))
+            timed("process pool (parse_replies)", count,
+                  lambda: checker.parse_replies(fetched(corpus, round_trip), count))
+
+
+if __name__ == "__main__":
+    main()
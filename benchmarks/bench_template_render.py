@@ -0,0 +1,58 @@
+"""
+Renders the "base" template for 100k recipient rows with the former chained
+str.replace loop and with the compiled single-pass renderer, then the same
+template extended with more variables (the replace loop rescans the whole
+HTML once per variable).
+
+Run from the repository root: python benchmarks/bench_template_render.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from template_manager import TemplateManager
+
+ROWS = 100_000
+
+
+def render_replace_loop(content, values):
+    final_content = content
+    for var_name, var_value in values.items():
+        final_content = final_content.replace(f"{{{var_name}}}", var_value)
+    return final_content
+
+
+def bench(manager, name, content, variables):
+    rows = [{var: f"Valeur {i} {{non remplacée}}" for var in variables} for i in range(ROWS)]
+
+    start = time.perf_counter()
+    expected = [render_replace_loop(content, values) for values in rows]
+    replace_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compiled = manager.compile_template(name, content)
+    rendered = [compiled.render(values) for values in rows]
+    compiled_time = time.perf_counter() - start
+
+    # Values containing "{...}" are never re-scanned, so both agree here
+    assert rendered == expected
+    print(f"{name}: {ROWS} rows, {len(variables)} variable(s), {len(content)} chars")
+    print(f"  str.replace loop : {replace_time:.3f}s ({ROWS / replace_time:,.0f} rows/s)")
+    print(f"  compiled render  : {compiled_time:.3f}s ({ROWS / compiled_time:,.0f} rows/s)")
+    print(f"  speedup          : x{replace_time / compiled_time:.2f}")
+
+
+def main():
+    manager = TemplateManager(os.path.join(os.path.dirname(__file__), "..", "templates.json"))
+    content = manager.get_template_content("base")
+    variables = manager.get_template_variables("base")
+    bench(manager, "base", content, variables)
+
+    extra = [f"champ_{i}" for i in range(8)]
+    extended = content.replace("</body>", "".join(f"<p>{{{v}}}</p>\n" for v in extra) + "</body>")
+    bench(manager, "base+8", extended, variables + extra)
+
+
+if __name__ == "__main__":
+    main()
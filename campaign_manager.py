@@ -0,0 +1,303 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from mail_handler import is_transient_error
+from outbox import Outbox
+
+class CampaignManager:
+    def __init__(self, mail_sender, history_manager, template_manager, async_sender=None, outbox=None):
+        self.mail_sender = mail_sender
+        self.async_sender = async_sender
+        self.outbox = outbox if outbox is not None else Outbox()
+        self.history_manager = history_manager
+        self.template_manager = template_manager
+        self.logger = logging.getLogger(__name__)
+        self._history_lock = threading.RLock()
+        self._history_buffer = []
+        self._last_flush = time.monotonic()
+
+    def load_recipients(self, filepath, variables):
+        """
+        Reads a recipient list from a CSV or JSONL file.
+
+        Each row must have an "email" column; the other columns are matched
+        against the template variables (missing ones are left empty).
+
+        Args:
+            filepath (str): Path to a .csv or .jsonl file.
+            variables (list): Variable names of the template to fill.
+
+        Returns:
+            list: dicts of the form {"email": str, "variables": {name: value}}.
+        """
+        ext = os.path.splitext(filepath)[1].lower()
+        rows = []
+        if ext in (".jsonl", ".ndjson"):
+            with open(filepath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        rows.append(json.loads(line))
+        else:
+            with open(filepath, 'r', encoding='utf-8-sig', newline='') as f:
+                sample = f.read(4096)
+                f.seek(0)
+                try:
+                    dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+                except csv.Error:
+                    dialect = csv.excel
+                rows = list(csv.DictReader(f, dialect=dialect))
+
+        recipients = []
+        for row in rows:
+            # Column names are matched case-insensitively
+            lowered = {str(k).strip().lower(): ("" if v is None else str(v).strip()) for k, v in row.items() if k is not None}
+            email = lowered.get("email", "")
+            if not email:
+                continue
+            recipients.append({
+                "email": email,
+                "variables": {var: lowered.get(var.lower(), "") for var in variables}
+            })
+        return recipients
+
+    def _prepare(self, recipient, template, subject):
+        variables_data = recipient["variables"]
+        variables_str = ", ".join([f"{k}:{v}" for k, v in variables_data.items()]) if variables_data else "Aucune"
+        return {
+            "email": recipient["email"],
+            "variable": variables_str,
+            "subject": subject,
+            "content": template.render(variables_data)
+        }
+
+    # Final outcomes are buffered and written to the history in batches
+    HISTORY_FLUSH_SIZE = 100
+    HISTORY_FLUSH_INTERVAL = 1.0
+
+    def _record(self, row, success, status=None):
+        status = status or ("Envoyé" if success else "Échec")
+        with self._history_lock:
+            self._history_buffer.append({
+                "email": row["email"],
+                "variable": row["variable"],
+                "subject": row["subject"],
+                "uuid": row["uuid"],
+                "status": status,
+                "content": row["content"],
+                "message_id": row.get("message_id")
+            })
+            if (len(self._history_buffer) >= self.HISTORY_FLUSH_SIZE
+                    or time.monotonic() - self._last_flush >= self.HISTORY_FLUSH_INTERVAL):
+                self._flush_history()
+
+    def _flush_history(self):
+        with self._history_lock:
+            if self._history_buffer:
+                self.history_manager.add_entries(self._history_buffer)
+                self._history_buffer = []
+            self._last_flush = time.monotonic()
+
+    def _drain(self, passwords, workers, on_result, stop_event=None, batch=None, engine="threads"):
+        """Sends the due outbox messages of the accounts listed in `passwords`."""
+        def settled(row, success, msg, final):
+            if final:
+                self._record(row, success)
+            if on_result:
+                on_result(row, success, msg, final)
+
+        def deliver(row):
+            self.mail_sender.deliver(row["smtp_server"], row["smtp_port"], row["username"],
+                                     passwords[row["username"]], row["email"], row["subject"], row["content"],
+                                     row.get("message_id"), before_send=lambda: self.outbox.mark_sending(row),
+                                     stop_event=stop_event)
+
+        try:
+            if engine == "async":
+                self._drain_async(passwords, workers, settled, stop_event, batch)
+            else:
+                self.outbox.drain(deliver, is_transient_error, workers=workers, on_result=settled,
+                                  stop_event=stop_event, usernames=list(passwords), batch=batch)
+        finally:
+            self._flush_history()
+
+    def _drain_async(self, passwords, workers, settled, stop_event, batch):
+        if self.async_sender is None:
+            from async_mail_handler import AsyncMailSender
+            self.async_sender = AsyncMailSender(rate_limiter=self.mail_sender.rate_limiter,
+                                                suppression_list=self.mail_sender.suppression_list)
+        self.async_sender.max_concurrency = max(1, int(workers))
+
+        # One event loop and one set of connections for the whole drain. Each
+        # worker claims a single row when it is ready for it, so a stop
+        # request is honoured between messages, and accounts are drained one
+        # after the other so that a worker keeps its session.
+        accounts = list(passwords)
+        errors = {}
+
+        async def next_message():
+            while accounts and (stop_event is None or not stop_event.is_set()):
+                username = accounts[0]
+                rows = await asyncio.to_thread(self.outbox.claim, 1, [username], batch)
+                if rows:
+                    row = rows[0]
+                    return (row, (row["smtp_server"], row["smtp_port"], username, passwords[username]),
+                            (row["email"], row["subject"], row["content"], row.get("message_id")))
+                if accounts and accounts[0] == username:
+                    accounts.pop(0)
+            return None
+
+        def on_error(row, error):
+            errors[row["id"]] = error
+
+        def on_result(row, success, msg):
+            error = None if success else errors.pop(row["id"], Exception(msg))
+            settled(row, success, msg, self.outbox.settle(row, error, is_transient_error))
+
+        asyncio.run(self.async_sender.send_stream(next_message, on_result, on_error,
+                                                  on_sending=self.outbox.mark_sending, stop_event=stop_event))
+
+    def run_campaign(self, recipients, template_name, subject, smtp_settings, workers=4, on_progress=None, stop_event=None, engine="threads"):
+        """
+        Sends the template to every recipient through `workers` concurrent senders.
+
+        The rendered messages are first written to the outbox, so a crash or
+        a network outage never loses them. Messages hitting a transient error
+        are left in the outbox for a later retry (see resume_outbox()).
+        Blocking: call it from a background thread when used from the UI.
+
+        Args:
+            recipients (list): Output of load_recipients().
+            template_name (str): Name of the template to render.
+            subject (str): Subject line.
+            smtp_settings (dict): smtp_server, smtp_port, username, password.
+            workers (int): Number of concurrent sending threads, or of
+                concurrent SMTP connections with the "async" engine.
+            on_progress (callable): Called with a stats dict after each attempt.
+            stop_event (threading.Event): Set it to cancel the remaining sends.
+            engine (str): "threads" (MailSender) or "async" (AsyncMailSender).
+
+        Returns:
+            dict: total, sent, failed, retrying, cancelled, elapsed (s) and
+            rate (msgs/s).
+        """
+        template_content = self.template_manager.get_template_content(template_name)
+        if not template_content:
+            raise ValueError("Modèle introuvable ou vide.")
+        template = self.template_manager.compile_template(template_name, template_content)
+
+        batch = str(uuid.uuid4())
+        stats = {"total": len(recipients), "sent": 0, "failed": 0, "retrying": 0, "cancelled": 0, "elapsed": 0.0,
+                 "rate": 0.0}
+        stats_lock = threading.Lock()
+        retrying = set()
+        start = time.monotonic()
+
+        def report(row, success, msg, final):
+            with stats_lock:
+                if success:
+                    stats["sent"] += 1
+                elif final:
+                    stats["failed"] += 1
+                if final:
+                    retrying.discard(row["uuid"])
+                else:
+                    retrying.add(row["uuid"])
+                stats["retrying"] = len(retrying)
+                stats["elapsed"] = time.monotonic() - start
+                done = stats["sent"] + stats["failed"] + stats["retrying"]
+                stats["rate"] = done / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+                snapshot = dict(stats, last_email=row["email"], last_success=success, last_message=msg, last_final=final)
+            if on_progress:
+                on_progress(snapshot)
+
+        # Held until the end: the periodic resume_outbox() must not send these
+        # messages behind the campaign's progress reporting and stop button
+        self.outbox.hold_batch(batch)
+        try:
+            self.outbox.enqueue_many([self._prepare(r, template, subject) for r in recipients],
+                                     smtp_settings, batch)
+            self._drain({smtp_settings["username"]: smtp_settings["password"]}, workers, report,
+                        stop_event=stop_event, batch=batch, engine=engine)
+        finally:
+            if stop_event is not None and stop_event.is_set():
+                # Also drops the messages waiting for a retry: keep a trace of every one
+                cancelled = self.outbox.cancel_batch(batch)
+                for row in cancelled:
+                    self._record(row, False, "Annulé")
+                self._flush_history()
+                stats["cancelled"] = len(cancelled)
+                stats["retrying"] = 0
+            self.outbox.release_batch(batch)
+
+        stats["elapsed"] = time.monotonic() - start
+        done = stats["sent"] + stats["failed"] + stats["retrying"]
+        stats["rate"] = done / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+        self.logger.info(f"Campaign finished: {stats['sent']} sent, {stats['failed']} failed, "
+                         f"{stats['retrying']} to retry, {stats['rate']:.2f} msgs/s")
+        return stats
+
+    def send_single(self, email, variable, subject, content, smtp_settings, uuid_str=None):
+        """
+        Queues one message in the outbox and sends it right away.
+
+        Returns:
+            tuple: (success, message, final) — final is False when a transient
+            error left the message in the outbox for a later retry.
+        """
+        batch = str(uuid.uuid4())
+        outcome = [(False, "Envoi non effectué", False)]
+
+        def on_result(row, success, msg, final):
+            outcome[0] = (success, msg, final)
+
+        self.outbox.hold_batch(batch)
+        try:
+            self.outbox.enqueue(email, variable, subject, content, smtp_settings, uuid_str, batch)
+            self._drain({smtp_settings["username"]: smtp_settings["password"]}, 1, on_result, batch=batch)
+        finally:
+            self.outbox.release_batch(batch)
+        return outcome[0]
+
+    def recover_outbox(self):
+        """
+        Records the messages a crash interrupted mid-send as failed.
+
+        Whether the server accepted them is unknown, so they are not sent
+        again. Only call this at startup, before any sending starts.
+
+        Returns:
+            int: Number of interrupted messages.
+        """
+        interrupted = self.outbox.recover_interrupted()
+        for row in interrupted:
+            self._record(row, False)
+        self._flush_history()
+        return len(interrupted)
+
+    def resume_outbox(self, get_password, workers=2, on_result=None):
+        """
+        Sends the due messages an earlier run or a transient error left queued.
+
+        Messages of a campaign or single send still in progress are left to
+        it (see Outbox.hold_batch()).
+
+        Args:
+            get_password (callable): get_password(username) returns the
+                account password, or None to leave its messages queued.
+            workers (int): Number of sending threads.
+            on_result (callable): on_result(row, success, message, final).
+        """
+        passwords = {}
+        for username in self.outbox.pending_accounts():
+            password = get_password(username)
+            if password:
+                passwords[username] = password
+        if passwords:
+            self._drain(passwords, workers, on_result)
+        self.outbox.purge_done()
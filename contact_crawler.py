@@ -0,0 +1,156 @@
+import csv
+import logging
+import re
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+MAX_PAGE_BYTES = 1024 * 1024
+PAGE_TIMEOUT = 8
+# Contact pages followed per site, on top of the result page itself
+MAX_CONTACT_PAGES = 3
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,24}")
+# "contact [at] bar (dot) fr", "contact(arobase)bar.fr"...
+OBFUSCATED_AT_RE = re.compile(r"\s*[\[({]\s*(?:at|arobase)\s*[\])}]\s*", re.IGNORECASE)
+OBFUSCATED_DOT_RE = re.compile(r"\s*[\[({]\s*(?:dot|point)\s*[\])}]\s*", re.IGNORECASE)
+CONTACT_LINK_RE = re.compile(r"contact|joindre|a-propos|about|qui-sommes-nous|mentions-legales|impressum|booking|programmation",
+                             re.IGNORECASE)
+# Image names like logo@2x.png and placeholder / tracking addresses
+IGNORED_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg", ".css", ".js")
+IGNORED_DOMAINS = ("example.com", "exemple.fr", "exemple.com", "domain.com", "sentry.io", "wixpress.com")
+
+def _host(url):
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+class ContactCrawler:
+    """
+    Turns scraped result URLs into recipients.
+
+    Each result page is downloaded, then the contact-like pages it links to
+    on the same site (contact, à propos, mentions légales...), all through
+    the ScraperManager session: pages are fetched concurrently, with its
+    per-host limit, a timeout and a size cap. The email addresses found are
+    deduplicated across all sites.
+    """
+
+    def __init__(self, scraper_manager, max_workers=8, max_page_bytes=MAX_PAGE_BYTES, timeout=PAGE_TIMEOUT,
+                 max_contact_pages=MAX_CONTACT_PAGES):
+        self.scraper_manager = scraper_manager
+        self.max_workers = max_workers
+        self.max_page_bytes = max_page_bytes
+        self.timeout = timeout
+        self.max_contact_pages = max_contact_pages
+        self.logger = logging.getLogger(__name__)
+
+    def clean_emails(self, emails):
+        """Lower-cases, filters out false positives and deduplicates, keeping the order."""
+        cleaned = []
+        for address in emails:
+            address = address.strip().strip(".").lower()
+            domain = address.rpartition("@")[2]
+            if not EMAIL_RE.fullmatch(address) or address.endswith(IGNORED_SUFFIXES):
+                continue
+            if any(domain == d or domain.endswith("." + d) for d in IGNORED_DOMAINS):
+                continue
+            if address not in cleaned:
+                cleaned.append(address)
+        return cleaned
+
+    def parse_page(self, html, page_url):
+        """
+        Returns (email addresses, contact page URLs on the same site) found
+        in a page.
+        """
+        document = self.scraper_manager.html.parse(html)
+        emails, links = [], []
+        for a in document.select("a[href]"):
+            href = a.get("href").strip()
+            if href.lower().startswith("mailto:"):
+                emails.append(urllib.parse.unquote(href[len("mailto:"):].split("?")[0]))
+            elif CONTACT_LINK_RE.search(href) or CONTACT_LINK_RE.search(a.text(" ", strip=True)):
+                link = urllib.parse.urljoin(page_url, href).split("#")[0]
+                if (link.startswith(("http://", "https://")) and _host(link) == _host(page_url)
+                        and link != page_url and link not in links):
+                    links.append(link)
+
+        text = OBFUSCATED_DOT_RE.sub(".", OBFUSCATED_AT_RE.sub("@", document.text(" ")))
+        emails.extend(EMAIL_RE.findall(text))
+        return self.clean_emails(emails), links[:self.max_contact_pages]
+
+    def crawl_page(self, url):
+        """Returns (final URL, emails, contact links) of one page."""
+        final_url, html = self.scraper_manager.fetch_page(url, self.max_page_bytes, timeout=self.timeout)
+        if html is None:
+            return final_url, [], []
+        emails, links = self.parse_page(html, final_url)
+        return final_url, emails, links
+
+    def crawl(self, results, on_site_done=None, cancel_event=None):
+        """
+        Extracts the contacts of scraped results.
+
+        Args:
+            results (list): {"title", "url", ...} dicts from the scraper.
+            on_site_done (callable): Called with (result, new contacts) once
+                a site and its contact pages are done (from the calling
+                thread).
+            cancel_event (threading.Event): Stops the crawl once set.
+
+        Returns:
+            list: {"email", "title", "url", "source"} dicts, one per address,
+            "url" being the scraped result and "source" the page the
+            address was found on.
+        """
+        contacts = {}
+        pending_pages = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+            for result in results:
+                url = result.get("url")
+                if url and url.startswith(("http://", "https://")) and url not in pending_pages:
+                    pending_pages[url] = 1
+                    futures[pool.submit(self.crawl_page, url)] = (result, True)
+            found = {url: [] for url in pending_pages}
+
+            while futures:
+                if cancel_event is not None and cancel_event.is_set():
+                    for future in futures:
+                        future.cancel()
+                    break
+                done, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result, is_home = futures.pop(future)
+                    try:
+                        page_url, emails, links = future.result()
+                    except Exception as e:
+                        self.logger.warning(f"Contact crawl: {result['url']}: {e}")
+                        page_url, emails, links = result["url"], [], []
+
+                    for address in emails:
+                        if address not in contacts:
+                            contacts[address] = {"email": address, "title": result.get("title", ""),
+                                                 "url": result["url"], "source": page_url}
+                            found[result["url"]].append(contacts[address])
+
+                    # Contact pages are only looked for on the result page itself
+                    if is_home:
+                        for link in links:
+                            pending_pages[result["url"]] += 1
+                            futures[pool.submit(self.crawl_page, link)] = (result, False)
+                    pending_pages[result["url"]] -= 1
+                    if pending_pages[result["url"]] == 0 and on_site_done:
+                        on_site_done(result, found[result["url"]])
+        return list(contacts.values())
+
+    def write_recipients(self, contacts, filepath):
+        """
+        Writes the contacts as a recipient CSV for bulk sending (email, nom,
+        site, source columns).
+        """
+        with open(filepath, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["email", "nom", "site", "source"])
+            for contact in contacts:
+                writer.writerow([contact["email"], contact["title"], contact["url"], contact["source"]])
+        return len(contacts)
@@ -1,18 +1,158 @@
 import json
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
+STATUS_FILTERS = {
+    "Envoyés": "status IN ('Envoyé', 'Sent')",
+    # Cancelled campaign messages were not sent either
+    "Échecs": "status IN ('Échec', 'Annulé')",
+    "Brouillons": "status = 'Brouillon'",
+}
+REPLY_FILTERS = {
+    "Consultées": "read = 1",
+    "Non consultées": "read = 0",
+}
+
+ENTRY_COLUMNS = ("uuid", "date", "email", "variable", "subject", "status", "replied", "content", "message_id")
+REPLY_COLUMNS = ("date", "email", "subject", "content", "read")
+
 class HistoryManager:
-    def __init__(self, filepath="history.json"):
+    """
+    Send / reply history stored in SQLite (WAL mode).
+
+    Entries and replies are returned as the same dicts the former
+    history.json held; fields without a dedicated column are kept in a JSON
+    "extra" column. An existing history.json is imported once on first use.
+    """
+
+    def __init__(self, filepath="history.db", legacy_filepath=None):
+        if filepath.endswith(".json"):
+            legacy_filepath = legacy_filepath or filepath
+            filepath = os.path.splitext(filepath)[0] + ".db"
         self.filepath = filepath
-        self._ensure_file_exists()
+        self.legacy_filepath = legacy_filepath or os.path.splitext(filepath)[0] + ".json"
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # Unicode-aware lower() for searches (SQLite's only folds ASCII)
+        self._conn.create_function("pylower", 1, lambda v: v.lower() if isinstance(v, str) else v, deterministic=True)
+        self._ensure_schema()
+        self._migrate_from_json()
+
+    def _ensure_schema(self):
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    uuid TEXT,
+                    date TEXT,
+                    email TEXT,
+                    variable TEXT,
+                    subject TEXT,
+                    status TEXT,
+                    replied INTEGER NOT NULL DEFAULT 0,
+                    content TEXT,
+                    message_id TEXT,
+                    extra TEXT
+                )
+            """)
+            columns = [r["name"] for r in self._conn.execute("PRAGMA table_info(entries)")]
+            if "message_id" not in columns:
+                self._conn.execute("ALTER TABLE entries ADD COLUMN message_id TEXT")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS replies (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    parent_uuid TEXT,
+                    date TEXT,
+                    email TEXT,
+                    subject TEXT,
+                    content TEXT,
+                    read INTEGER NOT NULL DEFAULT 0,
+                    extra TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_uuid ON entries (uuid)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_email ON entries (email)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_status ON entries (status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_date ON entries (date)")
+            # Replies are threaded in memory from get_sync_entries(): no lookup by Message-ID
+            self._conn.execute("DROP INDEX IF EXISTS idx_entries_message_id")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_replies_parent ON replies (parent_uuid, date)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_replies_read ON replies (read, date)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _migrate_from_json(self):
+        """One-shot import of the former history.json (renamed afterwards)."""
+        if not os.path.exists(self.legacy_filepath):
+            return
+        try:
+            with open(self.legacy_filepath, 'r') as f:
+                history = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            history = []
+
+        with self._transaction() as conn:
+            if conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0:
+                for entry in history:
+                    # Migration/Normalization for old entries
+                    entry.setdefault("replied", False)
+                    entry.setdefault("subject", "")
+                    entry.setdefault("content", "Contenu non disponible pour cet ancien email.")
+                    self._insert_entry(entry)
+                    for reply in entry.get("replies", []):
+                        self._insert_reply(entry.get("uuid"), reply)
+        os.replace(self.legacy_filepath, self.legacy_filepath + ".migrated")
+
+    def _split(self, data, columns):
+        values = [data.get(c) for c in columns]
+        extra = {k: v for k, v in data.items() if k not in columns and k != "replies"}
+        return values, json.dumps(extra) if extra else None
 
-    def _ensure_file_exists(self):
-        if not os.path.exists(self.filepath):
-            with open(self.filepath, 'w') as f:
-                json.dump([], f)
+    def _insert_entry(self, entry):
+        values, extra = self._split(entry, ENTRY_COLUMNS)
+        values[ENTRY_COLUMNS.index("replied")] = 1 if entry.get("replied") else 0
+        self._conn.execute(
+            f"INSERT INTO entries ({', '.join(ENTRY_COLUMNS)}, extra) VALUES ({', '.join('?' * (len(ENTRY_COLUMNS) + 1))})",
+            values + [extra])
 
-    def add_entry(self, email, variable, subject, uuid_str, status="Sent", content=""):
+    def _insert_reply(self, parent_uuid, reply):
+        values, extra = self._split(reply, REPLY_COLUMNS)
+        values[REPLY_COLUMNS.index("read")] = 1 if reply.get("read") else 0
+        self._conn.execute(
+            f"INSERT INTO replies (parent_uuid, {', '.join(REPLY_COLUMNS)}, extra) VALUES (?, {', '.join('?' * (len(REPLY_COLUMNS) + 1))})",
+            [parent_uuid] + values + [extra])
+
+    def _entry_from_row(self, row):
+        entry = {c: row[c] for c in ENTRY_COLUMNS}
+        entry["replied"] = bool(entry["replied"])
+        if row["extra"]:
+            entry.update(json.loads(row["extra"]))
+        entry["replies"] = []
+        return entry
+
+    def _reply_from_row(self, row):
+        reply = {c: row[c] for c in REPLY_COLUMNS}
+        reply["read"] = bool(reply["read"])
+        if row["extra"]:
+            reply.update(json.loads(row["extra"]))
+        return reply
+
+    def add_entry(self, email, variable, subject, uuid_str, status="Sent", content="", message_id=None):
         entry = {
             "date": datetime.now().isoformat(),
             "email": email,
@@ -22,142 +162,294 @@ class HistoryManager:
             "status": status,
             "replied": False,
             "content": content,
-            "replies": []
+            "message_id": message_id
         }
-        
-        try:
-            with open(self.filepath, 'r') as f:
-                history = json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            history = []
-            
-        history.append(entry)
-        
-        with open(self.filepath, 'w') as f:
-            json.dump(history, f, indent=4)
-            
+        with self._lock:
+            self._insert_entry(entry)
+
+    def add_entries(self, entries):
+        """
+        Adds many entries in a single transaction.
+
+        Args:
+            entries (list): dicts with email, variable, subject, uuid, status,
+                content and message_id (date defaults to now).
+        """
+        now = datetime.now().isoformat()
+        with self._transaction():
+            for e in entries:
+                entry = {
+                    "date": e.get("date") or now,
+                    "email": e.get("email"),
+                    "variable": e.get("variable", ""),
+                    "subject": e.get("subject", ""),
+                    "uuid": e.get("uuid"),
+                    "status": e.get("status", "Sent"),
+                    "replied": False,
+                    "content": e.get("content", ""),
+                    "message_id": e.get("message_id")
+                }
+                self._insert_entry(entry)
+        return len(entries)
+
     def get_history(self):
-        if not os.path.exists(self.filepath):
-            return []
-        try:
-            with open(self.filepath, 'r') as f:
-                history = json.load(f)
-            # Migration/Normalization for old entries
-            for entry in history:
-                if "replied" not in entry: entry["replied"] = False
-                if "subject" not in entry: entry["subject"] = ""
-                if "content" not in entry: entry["content"] = "Contenu non disponible pour cet ancien email."
-                if "replies" not in entry: entry["replies"] = []
-                for reply in entry["replies"]:
-                    if "read" not in reply:
-                        reply["read"] = False
-            return history
-        except json.JSONDecodeError:
-            return []
+        with self._lock:
+            entries = [self._entry_from_row(r) for r in self._conn.execute("SELECT * FROM entries ORDER BY id")]
+            by_uuid = {}
+            for entry in entries:
+                by_uuid.setdefault(entry["uuid"], entry)
+            for r in self._conn.execute("SELECT * FROM replies ORDER BY id"):
+                parent = by_uuid.get(r["parent_uuid"])
+                if parent is not None:
+                    parent["replies"].append(self._reply_from_row(r))
+        return entries
+
+    def get_sync_entries(self):
+        """
+        Returns the entries with only what reply matching needs: uuid, email,
+        date, status and message_id, and their replies reduced to their
+        date. Unlike get_history(), no email content is loaded.
+        """
+        with self._lock:
+            entries = [dict(r) for r in self._conn.execute("SELECT uuid, email, date, status, message_id FROM entries ORDER BY id")]
+            by_uuid = {}
+            for entry in entries:
+                entry["replies"] = []
+                by_uuid.setdefault(entry["uuid"], entry)
+            for r in self._conn.execute("SELECT parent_uuid, date FROM replies ORDER BY id"):
+                parent = by_uuid.get(r["parent_uuid"])
+                if parent is not None:
+                    parent["replies"].append({"date": r["date"]})
+        return entries
+
+    def query_history(self, active_filter="Tous", search="", offset=0, limit=10, newest_first=True):
+        """
+        Returns one page of the history view, computed by SQLite.
+
+        For the "Consultées" / "Non consultées" filters the page holds the
+        flattened replies (each with its parent uuid under "_parent_uuid"),
+        sorted by reply date; otherwise it holds entries in sending order.
+
+        Args:
+            active_filter (str): Tab name of the history view.
+            search (str): Case-insensitive substring of the email (or of the
+                reply subject for reply filters).
+            offset (int): Index of the first item.
+            limit (int): Maximum number of items.
+            newest_first (bool): Sort order.
+
+        Returns:
+            tuple: (items, total) where total counts every matching item.
+        """
+        order = "DESC" if newest_first else "ASC"
+        search = (search or "").strip().lower()
+
+        if active_filter in REPLY_FILTERS:
+            where = [REPLY_FILTERS[active_filter]]
+            params = []
+            if search:
+                where.append("(instr(pylower(email), ?) > 0 OR instr(pylower(subject), ?) > 0)")
+                params += [search, search]
+            clause = " AND ".join(where)
+            with self._lock:
+                total = self._conn.execute(f"SELECT COUNT(*) FROM replies WHERE {clause}", params).fetchone()[0]
+                rows = self._conn.execute(f"SELECT * FROM replies WHERE {clause} ORDER BY date {order}, id LIMIT ? OFFSET ?",
+                                          params + [limit, offset]).fetchall()
+            items = []
+            for r in rows:
+                reply = self._reply_from_row(r)
+                reply["_parent_uuid"] = r["parent_uuid"]
+                items.append(reply)
+            return items, total
+
+        where = []
+        params = []
+        if active_filter in STATUS_FILTERS:
+            where.append(STATUS_FILTERS[active_filter])
+        if search:
+            where.append("instr(pylower(email), ?) > 0")
+            params.append(search)
+        clause = ("WHERE " + " AND ".join(where)) if where else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM entries {clause}", params).fetchone()[0]
+            rows = self._conn.execute(f"SELECT * FROM entries {clause} ORDER BY id {order} LIMIT ? OFFSET ?",
+                                      params + [limit, offset]).fetchall()
+            items = [self._entry_from_row(r) for r in rows]
+            by_uuid = {e["uuid"]: e for e in items}
+            if by_uuid:
+                marks = ",".join("?" * len(by_uuid))
+                for r in self._conn.execute(f"SELECT * FROM replies WHERE parent_uuid IN ({marks}) ORDER BY id", list(by_uuid)):
+                    by_uuid[r["parent_uuid"]]["replies"].append(self._reply_from_row(r))
+        return items, total
+
+    def get_entry(self, uuid_str):
+        """Returns one entry (with its replies) through the uuid index, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM entries WHERE uuid = ? ORDER BY id LIMIT 1", (uuid_str,)).fetchone()
+            if row is None:
+                return None
+            entry = self._entry_from_row(row)
+            entry["replies"] = [self._reply_from_row(r) for r in
+                                self._conn.execute("SELECT * FROM replies WHERE parent_uuid = ? ORDER BY id", (uuid_str,))]
+        return entry
+
+    def get_sent_uuids_by_emails(self, emails):
+        """Returns {email: [uuid, ...]} of the sent entries for the given addresses."""
+        emails = [e for e in emails if e]
+        found = {}
+        with self._lock:
+            for i in range(0, len(emails), 500):
+                chunk = emails[i:i + 500]
+                for r in self._conn.execute(
+                        f"SELECT email, uuid FROM entries WHERE email IN ({','.join('?' * len(chunk))}) AND status = 'Envoyé' ORDER BY id",
+                        chunk):
+                    found.setdefault(r["email"], []).append(r["uuid"])
+        return found
 
     def add_reply(self, uuid_str, reply_dict):
-        history = self.get_history()
-        updated = False
         if "read" not in reply_dict:
             reply_dict["read"] = False
-            
-        for entry in history:
-            if entry.get("uuid") == uuid_str:
-                entry["replied"] = True
-                if "replies" not in entry:
-                    entry["replies"] = []
-                entry["replies"].append(reply_dict)
-                updated = True
-                break
-        
-        if updated:
-            with open(self.filepath, 'w') as f:
-                json.dump(history, f, indent=4)
+
+        with self._lock:
+            cur = self._conn.execute("UPDATE entries SET replied = 1 WHERE id = (SELECT id FROM entries WHERE uuid = ? ORDER BY id LIMIT 1)", (uuid_str,))
+            if cur.rowcount == 0:
+                return False
+            self._insert_reply(uuid_str, reply_dict)
+        return True
+
+    def add_replies(self, replies):
+        """
+        Attaches many replies in a single transaction.
+
+        Each reply dict carries its parent entry's uuid under "uuid", as the
+        dicts returned by ReplyChecker do. Replies whose parent no longer
+        exists, or that are already stored (same parent and date, e.g. found
+        by the IDLE watcher and a manual check at once), are skipped.
+
+        Returns:
+            int: Number of replies added.
+        """
+        added = 0
+        with self._transaction() as conn:
+            for reply in replies:
+                reply.setdefault("read", False)
+                uuid_str = reply.get("uuid")
+                if conn.execute("SELECT 1 FROM replies WHERE parent_uuid = ? AND date = ? LIMIT 1",
+                                (uuid_str, reply.get("date"))).fetchone():
+                    continue
+                cur = conn.execute("UPDATE entries SET replied = 1 WHERE id = (SELECT id FROM entries WHERE uuid = ? ORDER BY id LIMIT 1)", (uuid_str,))
+                if cur.rowcount:
+                    self._insert_reply(uuid_str, reply)
+                    added += 1
+        return added
+
+    def mark_replies_read(self, keys):
+        """Marks many replies as read in one transaction. keys: (parent_uuid, reply_date) pairs."""
+        updated = 0
+        with self._transaction() as conn:
+            for parent_uuid, reply_date in keys:
+                cur = conn.execute("""
+                    UPDATE replies SET read = 1 WHERE id = (
+                        SELECT id FROM replies WHERE parent_uuid = ? AND date = ? ORDER BY id LIMIT 1
+                    )
+                """, (parent_uuid, reply_date))
+                updated += cur.rowcount
         return updated
 
     def mark_reply_read(self, parent_uuid, reply_date):
-        history = self.get_history()
-        updated = False
-        for entry in history:
-            if entry.get("uuid") == parent_uuid:
-                for reply in entry.get("replies", []):
-                    if reply.get("date") == reply_date:
-                        reply["read"] = True
-                        updated = True
-                        break
-            if updated:
-                break
-        
-        if updated:
-            with open(self.filepath, 'w') as f:
-                json.dump(history, f, indent=4)
+        with self._lock:
+            cur = self._conn.execute("""
+                UPDATE replies SET read = 1 WHERE id = (
+                    SELECT id FROM replies WHERE parent_uuid = ? AND date = ? ORDER BY id LIMIT 1
+                )
+            """, (parent_uuid, reply_date))
+        return cur.rowcount > 0
+
+    def mark_bounces(self, bounces):
+        """
+        Marks the entries of hard-bounced emails as failed, in one transaction.
+
+        Args:
+            bounces (list): dicts with uuid, email, status, diagnostic and
+                date, as found by ReplyChecker. The bounce is kept on the
+                entry under "bounce".
+
+        Returns:
+            int: Number of entries updated.
+        """
+        updated = 0
+        with self._transaction() as conn:
+            for bounce in bounces:
+                row = conn.execute("SELECT id, extra FROM entries WHERE uuid = ? ORDER BY id LIMIT 1",
+                                   (bounce.get("uuid"),)).fetchone()
+                if row is None:
+                    continue
+                extra = json.loads(row["extra"]) if row["extra"] else {}
+                extra["bounce"] = {k: bounce.get(k) for k in ("status", "diagnostic", "date")}
+                conn.execute("UPDATE entries SET status = 'Échec', extra = ? WHERE id = ?",
+                             (json.dumps(extra), row["id"]))
+                updated += 1
         return updated
 
+    def _delete_replies(self, conn, where, params=()):
+        """Deletes the replies matching `where`; returns the paths of their spooled attachments."""
+        paths = []
+        for row in conn.execute(f"SELECT extra FROM replies WHERE extra IS NOT NULL AND ({where})", params):
+            paths.extend(a["path"] for a in json.loads(row["extra"]).get("attachments", ()) if a.get("path"))
+        conn.execute(f"DELETE FROM replies WHERE {where}", params)
+        return paths
+
+    def _remove_attachments(self, paths):
+        """Removes the spooled files of deleted replies, and their message directory once empty."""
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        for directory in {os.path.dirname(path) for path in paths}:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+
     def delete_entry(self, uuid_str):
-        history = self.get_history()
-        initial_len = len(history)
-        history = [entry for entry in history if entry.get("uuid") != uuid_str]
-        
-        if len(history) < initial_len:
-            with open(self.filepath, 'w') as f:
-                json.dump(history, f, indent=4)
-            return True
-        return False
+        with self._transaction() as conn:
+            cur = conn.execute("DELETE FROM entries WHERE uuid = ?", (uuid_str,))
+            paths = self._delete_replies(conn, "parent_uuid = ?", (uuid_str,))
+        self._remove_attachments(paths)
+        return cur.rowcount > 0
 
     def delete_by_email(self, email_target):
-        history = self.get_history()
-        initial_len = len(history)
-        history = [entry for entry in history if entry.get("email") != email_target]
-        
-        if len(history) < initial_len:
-            with open(self.filepath, 'w') as f:
-                json.dump(history, f, indent=4)
-            return True
-        return False
+        with self._transaction() as conn:
+            paths = self._delete_replies(conn, "parent_uuid IN (SELECT uuid FROM entries WHERE email = ?)", (email_target,))
+            cur = conn.execute("DELETE FROM entries WHERE email = ?", (email_target,))
+        self._remove_attachments(paths)
+        return cur.rowcount > 0
 
     def clear_all(self):
-        with open(self.filepath, 'w') as f:
-            json.dump([], f)
+        with self._transaction() as conn:
+            paths = self._delete_replies(conn, "1")
+            conn.execute("DELETE FROM entries")
+        self._remove_attachments(paths)
         return True
 
     def clear_by_filter(self, active_filter):
         if active_filter == "Tous":
             return self.clear_all()
-        
-        history = self.get_history()
-        initial_len = len(history)
-        updated = False
-        
-        if active_filter == "Envoyés":
-            history = [e for e in history if e.get("status") not in ("Envoyé", "Sent")]
-            updated = len(history) < initial_len
-            
-        elif active_filter == "Échecs":
-            history = [e for e in history if e.get("status") != "Échec"]
-            updated = len(history) < initial_len
-            
-        elif active_filter == "Brouillons":
-            history = [e for e in history if e.get("status") != "Brouillon"]
-            updated = len(history) < initial_len
-            
-        elif active_filter == "Consultées":
-            for entry in history:
-                initial_replies = len(entry.get("replies", []))
-                if initial_replies > 0:
-                    entry["replies"] = [r for r in entry.get("replies", []) if not r.get("read")]
-                    if len(entry["replies"]) < initial_replies:
-                        updated = True
-
-        elif active_filter == "Non consultées":
-            for entry in history:
-                initial_replies = len(entry.get("replies", []))
-                if initial_replies > 0:
-                    entry["replies"] = [r for r in entry.get("replies", []) if r.get("read")]
-                    if len(entry["replies"]) < initial_replies:
-                        updated = True
-        
-        if updated:
-            with open(self.filepath, 'w') as f:
-                json.dump(history, f, indent=4)
-        return updated
 
+        if active_filter in REPLY_FILTERS:
+            with self._transaction() as conn:
+                before = conn.total_changes
+                paths = self._delete_replies(conn, REPLY_FILTERS[active_filter])
+                deleted = conn.total_changes - before
+            self._remove_attachments(paths)
+            return deleted > 0
+        if active_filter not in STATUS_FILTERS:
+            return False
+        where = STATUS_FILTERS[active_filter]
+
+        with self._transaction() as conn:
+            paths = self._delete_replies(conn, f"parent_uuid IN (SELECT uuid FROM entries WHERE {where})")
+            cur = conn.execute(f"DELETE FROM entries WHERE {where}")
+        self._remove_attachments(paths)
+        return cur.rowcount > 0
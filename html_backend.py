@@ -0,0 +1,188 @@
+import logging
+import re
+from bs4 import BeautifulSoup
+
+# Fastest first; html.parser (BeautifulSoup) is always available
+BACKENDS = ("selectolax", "lxml", "html.parser")
+
+_CSS_STEP_RE = re.compile(r"([A-Za-z][\w-]*|\*)?((?:\.[\w-]+)*)((?:\[[\w-]+\])*)")
+
+class _SoupNode:
+    __slots__ = ("_tag",)
+
+    def __init__(self, tag):
+        self._tag = tag
+
+    def select(self, css):
+        return [_SoupNode(tag) for tag in self._tag.select(css)]
+
+    def select_one(self, css):
+        tag = self._tag.select_one(css)
+        return _SoupNode(tag) if tag is not None else None
+
+    def get(self, name, default=None):
+        value = self._tag.get(name, default)
+        # BeautifulSoup splits multi-valued attributes such as class
+        return " ".join(value) if isinstance(value, list) else value
+
+    def text(self, separator="", strip=False):
+        return self._tag.get_text(separator, strip=strip)
+
+
+class _LexborNode:
+    __slots__ = ("_node",)
+
+    def __init__(self, node):
+        self._node = node
+
+    def select(self, css):
+        return [_LexborNode(node) for node in self._node.css(css)]
+
+    def select_one(self, css):
+        node = self._node.css_first(css)
+        return _LexborNode(node) if node is not None else None
+
+    def get(self, name, default=None):
+        attributes = self._node.attributes
+        if name not in attributes:
+            return default
+        # Attributes without a value come back as None
+        return attributes[name] or ""
+
+    def text(self, separator="", strip=False):
+        if not strip:
+            return self._node.text(separator=separator)
+        # selectolax keeps the strings that are empty once stripped, BeautifulSoup drops them
+        strings = (node.text_content.strip() for node in self._node.traverse(include_text=True)
+                   if node.tag == "-text" and node.text_content)
+        return separator.join(s for s in strings if s)
+
+
+class _LxmlNode:
+    __slots__ = ("_element",)
+    _xpaths = {}
+
+    def __init__(self, element):
+        self._element = element
+
+    @classmethod
+    def _xpath(cls, css):
+        """
+        Compiles the CSS subset the scraper uses (tag, .class, [attribute],
+        descendant combinator) to XPath, without requiring cssselect.
+        """
+        if css not in cls._xpaths:
+            from lxml import etree
+
+            steps = []
+            for part in css.split():
+                match = _CSS_STEP_RE.fullmatch(part)
+                if not match:
+                    raise ValueError(f"Unsupported selector: {css}")
+                tag, classes, attributes = match.groups()
+                conditions = [f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+                              for name in classes.split(".")[1:]]
+                conditions += [f"@{name}" for name in re.findall(r"\[([\w-]+)\]", attributes)]
+                steps.append((tag or "*") + "".join(f"[{c}]" for c in conditions))
+            cls._xpaths[css] = etree.XPath("descendant::" + "/descendant::".join(steps))
+        return cls._xpaths[css]
+
+    def select(self, css):
+        return [_LxmlNode(element) for element in self._xpath(css)(self._element)]
+
+    def select_one(self, css):
+        found = self._xpath(css)(self._element)
+        return _LxmlNode(found[0]) if found else None
+
+    def get(self, name, default=None):
+        return self._element.get(name, default)
+
+    def text(self, separator="", strip=False):
+        strings = self._element.xpath(".//text()")
+        if strip:
+            strings = [s.strip() for s in strings]
+            strings = [s for s in strings if s]
+        return separator.join(strings)
+
+
+def _load_selectolax():
+    try:
+        from selectolax.lexbor import LexborHTMLParser
+    except ImportError:
+        # selectolax < 0.3.13 has no lexbor backend
+        from selectolax.parser import HTMLParser as LexborHTMLParser
+
+    def parse(html):
+        tree = LexborHTMLParser(html or "<html></html>")
+        # Like BeautifulSoup's get_text(), never return code as text
+        tree.strip_tags(["script", "style"])
+        return _LexborNode(tree.root)
+    return parse
+
+def _load_lxml():
+    import lxml.html
+    from lxml import etree
+
+    def parse(html):
+        try:
+            root = lxml.html.document_fromstring(html or "<html></html>")
+        except ValueError:
+            # Unicode strings with an XML encoding declaration
+            root = lxml.html.document_fromstring(html.encode("utf-8"))
+        except etree.ParserError:
+            root = lxml.html.document_fromstring("<html></html>")
+        etree.strip_elements(root, "script", "style", with_tail=False)
+        return _LxmlNode(root)
+    return parse
+
+def _load_soup():
+    return lambda html: _SoupNode(BeautifulSoup(html, "html.parser"))
+
+_LOADERS = {"selectolax": _load_selectolax, "lxml": _load_lxml, "html.parser": _load_soup}
+
+class HtmlBackend:
+    """
+    HTML parsing for the scraper and the contact crawler.
+
+    "auto" picks the fastest library installed: selectolax (lexbor), then
+    lxml, else BeautifulSoup's html.parser. Every backend exposes the same
+    small node API (select, select_one, get, text) with BeautifulSoup's
+    semantics, and ignores <script> / <style> content, so that they all
+    extract the same results.
+    """
+
+    def __init__(self, name="auto"):
+        self.logger = logging.getLogger(__name__)
+        if name in (None, "auto"):
+            candidates = BACKENDS
+        elif name in _LOADERS:
+            candidates = (name,)
+        else:
+            raise ValueError(f"Unknown HTML backend: {name}")
+
+        for candidate in candidates:
+            try:
+                self._parse = _LOADERS[candidate]()
+            except ImportError:
+                continue
+            self.name = candidate
+            break
+        else:
+            raise ImportError(f"HTML backend not installed: {name}")
+        self.logger.debug(f"HTML backend: {self.name}")
+
+    @staticmethod
+    def available():
+        """Names of the installed backends, fastest first."""
+        names = []
+        for name in BACKENDS:
+            try:
+                _LOADERS[name]()
+            except ImportError:
+                continue
+            names.append(name)
+        return names
+
+    def parse(self, html):
+        """Returns the document node of `html`."""
+        return self._parse(html)
@@ -0,0 +1,165 @@
+import logging
+import re
+import sqlite3
+import threading
+import urllib.parse
+from datetime import datetime
+
+# Query parameters that only track where a visit comes from
+TRACKING_PARAMS = {"gclid", "gclsrc", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+                   "_ga", "_gl", "ref", "ref_src", "rut", "srsltid"}
+TRACKING_PREFIXES = ("utm_", "pk_", "mtm_")
+
+def canonical_url(url):
+    """
+    Normalizes a scraped URL so that the same page always gives the same
+    key: DuckDuckGo redirect (uddg) unwrapped, http/https and "www."
+    merged, host lower-cased, default port, fragment, tracking parameters
+    and trailing slash dropped, remaining parameters sorted.
+    """
+    url = (url or "").strip()
+    if url.startswith("//"):
+        url = "https:" + url
+    parts = urllib.parse.urlsplit(url)
+    if (parts.hostname or "").endswith("duckduckgo.com") and parts.path.startswith("/l/"):
+        target = urllib.parse.parse_qs(parts.query).get("uddg")
+        if target:
+            return canonical_url(target[0])
+    if parts.scheme.lower() not in ("http", "https"):
+        return url
+
+    host = (parts.hostname or "").rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path)
+    path = urllib.parse.quote(urllib.parse.unquote(path), safe="/:@!$&'()*+,;=-._~")
+    path = re.sub(r"/index\.(?:html?|php)$", "/", path).rstrip("/") or "/"
+
+    query = sorted((key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES))
+    return urllib.parse.urlunsplit(("https", netloc, path, urllib.parse.urlencode(query), ""))
+
+class LeadStore:
+    """
+    Leads already found by the scraper, keyed by canonical URL.
+
+    Persisted in SQLite and mirrored in an in-memory set, so that filtering
+    already-seen results out of a new scrape costs one set lookup per
+    result. The addresses extracted from a lead and the history entries of
+    the emails sent to them are linked to it.
+    """
+
+    def __init__(self, filepath="leads.db"):
+        self.filepath = filepath
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leads (
+                url TEXT PRIMARY KEY,
+                original_url TEXT,
+                title TEXT,
+                query TEXT,
+                first_seen TEXT,
+                last_seen TEXT
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS lead_contacts (
+                url TEXT NOT NULL,
+                email TEXT NOT NULL,
+                PRIMARY KEY (url, email)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS lead_entries (
+                url TEXT NOT NULL,
+                uuid TEXT NOT NULL,
+                PRIMARY KEY (url, uuid)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_lead_contacts_email ON lead_contacts (email)")
+        self._urls = {row[0] for row in self._conn.execute("SELECT url FROM leads")}
+
+    def __contains__(self, url):
+        return canonical_url(url) in self._urls
+
+    def __len__(self):
+        return len(self._urls)
+
+    def filter_new(self, results):
+        """Returns the results whose page was never seen, each page once."""
+        new, keys = [], set()
+        for result in results:
+            key = canonical_url(result.get("url"))
+            if key not in self._urls and key not in keys:
+                keys.add(key)
+                new.append(result)
+        return new
+
+    def add_results(self, results, query=""):
+        """
+        Records scraped results as seen.
+
+        Returns:
+            int: Number of pages that were not known yet.
+        """
+        now = datetime.now().isoformat()
+        rows = {}
+        for result in results:
+            key = canonical_url(result.get("url"))
+            if key:
+                rows.setdefault(key, (key, result.get("url"), result.get("title", ""), query, now, now))
+        with self._lock:
+            new = [key for key in rows if key not in self._urls]
+            if rows:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("""
+                    INSERT INTO leads (url, original_url, title, query, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET last_seen = excluded.last_seen
+                """, list(rows.values()))
+                self._conn.execute("COMMIT")
+                self._urls.update(new)
+        return len(new)
+
+    def add_contacts(self, contacts):
+        """
+        Links the addresses found by the contact crawler ({"email", "url"}
+        dicts) to their lead. Returns the number of new links.
+        """
+        rows = {(canonical_url(c["url"]), c["email"]) for c in contacts if c.get("url") and c.get("email")}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO lead_contacts (url, email) VALUES (?, ?)", list(rows))
+            added = self._conn.total_changes - before
+            self._conn.execute("COMMIT")
+        return added
+
+    def link_history(self, history_manager):
+        """
+        Links each lead to the sent history entries of its addresses.
+
+        Returns:
+            int: Number of new (lead, entry) links.
+        """
+        with self._lock:
+            contacts = self._conn.execute("SELECT url, email FROM lead_contacts").fetchall()
+        if not contacts:
+            return 0
+        sent = history_manager.get_sent_uuids_by_emails(sorted({email for _, email in contacts}))
+        rows = [(url, uuid_str) for url, email in contacts for uuid_str in sent.get(email, ())]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO lead_entries (url, uuid) VALUES (?, ?)", rows)
+            added = self._conn.total_changes - before
+            self._conn.execute("COMMIT")
+        return added
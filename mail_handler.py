@@ -3,15 +3,316 @@ from email.message import EmailMessage
 from email.utils import make_msgid, formatdate
 import logging
 import ssl
+import threading
+import time
+
+class QuotaExceededError(Exception):
+    """
+    Raised when an account has no sending quota left for today.
+
+    `retry_at` (epoch seconds) is when the quota starts over: the message
+    is deferred until then, it did not fail.
+    """
+
+    def __init__(self, message, retry_at=None):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class SuppressedAddressError(Exception):
+    """Raised when the recipient is on the suppression list (hard bounce)."""
+
+
+class SendInterruptedError(Exception):
+    """Raised when a stop request ends the wait for the rate limit: nothing was sent."""
+
+
+def is_transient_error(error):
+    """
+    Tells whether a failed send is worth retrying later.
+
+    4xx replies, disconnects, timeouts and network errors are transient; 5xx
+    replies and authentication errors are permanent. A spent quota is
+    neither: the message is deferred to the quota reset (see
+    QuotaExceededError). Works with both smtplib and aiosmtplib exceptions.
+    """
+    if isinstance(error, QuotaExceededError):
+        return False
+    code = getattr(error, "smtp_code", None) or getattr(error, "code", None)
+    recipients = getattr(error, "recipients", None)
+    if isinstance(recipients, (dict, list)):
+        # smtplib: {address: (code, msg)}, aiosmtplib: [SMTPRecipientRefused]
+        if isinstance(recipients, dict):
+            codes = [c for c, _ in recipients.values()]
+        else:
+            codes = [getattr(r, "code", 0) for r in recipients]
+        return bool(codes) and all(400 <= c < 500 for c in codes)
+    if isinstance(code, int):
+        return 400 <= code < 500
+    name = type(error).__name__
+    if name in ("SMTPServerDisconnected", "SMTPConnectError", "SMTPConnectTimeoutError",
+                "SMTPTimeoutError", "SMTPReadTimeoutError"):
+        return True
+    if name.startswith("SMTP"):
+        # Other protocol errors (e.g. AUTH not supported) will not fix themselves
+        return False
+    return isinstance(error, (TimeoutError, ConnectionError, OSError))
+
+
+def make_message_id(username):
+    """Returns a new Message-ID on the sender's domain."""
+    return make_msgid(domain=username.split('@')[1] if '@' in username else "localhost")
+
+
+def error_result(logger, to_address, error):
+    """Maps a send exception to the (False, message) contract of send_email."""
+    if type(error).__name__ == "SMTPAuthenticationError":
+        logger.error("Authentication failed. Check your email and app password.")
+        return False, "Erreur d'authentification. Vérifiez le mot de passe d'application."
+    if isinstance(error, QuotaExceededError):
+        logger.warning(f"Daily quota reached, {to_address} not sent")
+        return False, "Quota journalier atteint pour ce compte."
+    if isinstance(error, SuppressedAddressError):
+        logger.warning(f"{to_address} is suppressed (hard bounce), not sent")
+        return False, "Adresse en liste de suppression (rejet définitif)."
+    if isinstance(error, TimeoutError):
+        error = "Délai dépassé"
+    logger.error(f"Failed to send email to {to_address}: {error}")
+    return False, str(error)
+
+
+class SMTPSessionPool:
+    """
+    Keeps authenticated SMTP connections alive between sends.
+
+    Sessions are keyed by (server, port, username). An idle session is probed
+    with NOOP before being reused and is closed once it has been idle for
+    longer than `idle_timeout` seconds.
+    """
+
+    def __init__(self, idle_timeout=60, max_sessions_per_key=4):
+        self.idle_timeout = idle_timeout
+        self.max_sessions_per_key = max_sessions_per_key
+        self.logger = logging.getLogger(__name__)
+        self._idle = {}  # key -> list of (server, last_used)
+        self._lock = threading.Lock()
+
+    def _connect(self, smtp_server, smtp_port, username, password):
+        context = ssl.create_default_context()
+        port = int(smtp_port)
+        if port == 465:
+            # SSL connections
+            server = smtplib.SMTP_SSL(smtp_server, port, context=context)
+        else:
+            # TLS connections (587, 25, etc.)
+            server = smtplib.SMTP(smtp_server, port)
+            server.starttls(context=context)
+        try:
+            server.login(username, password)
+        except Exception:
+            self._close(server)
+            raise
+        self.logger.info(f"Nouvelle session SMTP ouverte sur {smtp_server}:{smtp_port} ({username})")
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, server):
+        try:
+            code, _ = server.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    def acquire(self, smtp_server, smtp_port, username, password):
+        """Returns a live, authenticated session for the given account."""
+        key = (smtp_server, str(smtp_port), username)
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key, [])
+                if not sessions:
+                    break
+                server, last_used = sessions.pop()
+            if now - last_used > self.idle_timeout or not self._is_alive(server):
+                self._close(server)
+                continue
+            return server
+        return self._connect(smtp_server, smtp_port, username, password)
+
+    def release(self, smtp_server, smtp_port, username, server):
+        """Gives a healthy session back to the pool for reuse."""
+        key = (smtp_server, str(smtp_port), username)
+        with self._lock:
+            sessions = self._idle.setdefault(key, [])
+            if len(sessions) < self.max_sessions_per_key:
+                sessions.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    def discard(self, server):
+        """Drops a session that is broken or in an unknown state."""
+        self._close(server)
+
+    def close_idle(self):
+        """Closes every session that has exceeded the idle timeout."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, sessions in self._idle.items():
+                keep = []
+                for server, last_used in sessions:
+                    if now - last_used > self.idle_timeout:
+                        expired.append(server)
+                    else:
+                        keep.append((server, last_used))
+                self._idle[key] = keep
+        for server in expired:
+            self._close(server)
+        return len(expired)
+
+    def close_all(self):
+        with self._lock:
+            all_sessions = [server for sessions in self._idle.values() for server, _ in sessions]
+            self._idle.clear()
+        for server in all_sessions:
+            self._close(server)
+
 
 class MailSender:
-    def __init__(self):
+    def __init__(self, session_pool=None, rate_limiter=None, suppression_list=None):
         self.logger = logging.getLogger(__name__)
+        self.session_pool = session_pool
+        self.rate_limiter = rate_limiter
+        self.suppression_list = suppression_list
+
+    def build_message(self, username, to_address, subject, content_html, message_id=None):
+        msg = EmailMessage()
+        msg['Subject'] = subject
+        msg['From'] = username
+        msg['To'] = to_address
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-ID'] = message_id or make_message_id(username)
+
+        # Text fallback is crucial for anti-spam
+        # We strip HTML tags roughly for the text version
+        import re
+        text_content = re.sub('<[^<]+>', '', content_html).strip()
+        if not text_content:
+            text_content = "Veuillez activer l'affichage HTML pour voir cet email."
+
+        msg.set_content(text_content)
+        msg.add_alternative(content_html, subtype='html')
+        return msg
+
+    def _send_pooled(self, smtp_server, smtp_port, username, password, msg, before_send=None):
+        # acquire() probes a reused session with NOOP, yet the server may still
+        # have dropped it since. Only a 421 refusal of MAIL FROM proves that
+        # nothing was transmitted: that one is retried once on a fresh
+        # connection. Any other failure may follow an accepted message, so it
+        # is raised and left to the caller (e.g. the outbox retry policy).
+        for attempt in range(2):
+            server = self.session_pool.acquire(smtp_server, smtp_port, username, password)
+            try:
+                if before_send:
+                    before_send()
+                server.send_message(msg)
+            except smtplib.SMTPSenderRefused as e:
+                self.session_pool.discard(server)
+                if e.smtp_code == 421 and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                self.session_pool.discard(server)
+                raise
+            self.session_pool.release(smtp_server, smtp_port, username, server)
+            return
+
+    def _send_direct(self, smtp_server, smtp_port, username, password, msg, before_send=None):
+        context = ssl.create_default_context()
+
+        port = int(smtp_port)
+        if port == 465:
+            # SSL connections
+            with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
+                server.login(username, password)
+                if before_send:
+                    before_send()
+                server.send_message(msg)
+        else:
+            # TLS connections (587, 25, etc.)
+            with smtplib.SMTP(smtp_server, port) as server:
+                server.starttls(context=context)
+                server.login(username, password)
+                if before_send:
+                    before_send()
+                server.send_message(msg)
+
+    def deliver(self, smtp_server, smtp_port, username, password, to_address, subject, content_html, message_id=None,
+                before_send=None, stop_event=None):
+        """
+        Sends an email like send_email() but raises on failure.
+
+        `before_send` is called once connected and authenticated, right
+        before the message is transmitted (after any rate-limit wait). The
+        daily quota is given back when the send fails before that point.
+
+        Returns:
+            str: The Message-ID of the sent email.
+
+        Raises:
+            SuppressedAddressError: The recipient hard-bounced before.
+            QuotaExceededError: The account's daily quota is spent.
+            SendInterruptedError: `stop_event` was set during the rate-limit wait.
+            smtplib.SMTPException, OSError: Delivery failed.
+        """
+        # Checked before the quota and any SMTP work
+        if self.suppression_list is not None and to_address in self.suppression_list:
+            raise SuppressedAddressError(f"{to_address} is on the suppression list")
+
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(username, stop_event):
+            if stop_event is not None and stop_event.is_set():
+                raise SendInterruptedError(f"Stopped before sending to {to_address}")
+            raise QuotaExceededError(f"Daily quota reached for {username}", self.rate_limiter.next_reset())
+
+        msg = self.build_message(username, to_address, subject, content_html, message_id)
+
+        started = []
+
+        def start():
+            started.append(True)
+            if before_send:
+                before_send()
+
+        try:
+            if self.session_pool is not None:
+                self._send_pooled(smtp_server, smtp_port, username, password, msg, start)
+            else:
+                self._send_direct(smtp_server, smtp_port, username, password, msg, start)
+        except Exception:
+            if self.rate_limiter is not None and not started:
+                # Connection or login failed: the message never reached the server
+                self.rate_limiter.refund(username)
+            raise
+
+        self.logger.info(f"Email sent successfully to {to_address} via {smtp_server}:{smtp_port}")
+        return msg['Message-ID']
 
-    def send_email(self, smtp_server, smtp_port, username, password, to_address, subject, content_html):
+    def send_email(self, smtp_server, smtp_port, username, password, to_address, subject, content_html, message_id=None):
         """
         Sends an email using standard SMTP.
-        
+
+        When the sender was created with a session pool, the authenticated
+        connection is reused across calls instead of being reopened. With a
+        rate limiter, the call waits for the account's send budget first.
+
         Args:
             smtp_server (str): The SMTP server address.
             smtp_port (str): The SMTP server port.
@@ -20,46 +321,20 @@ class MailSender:
             to_address (str): Recipient email address.
             subject (str): Subject line.
             content_html (str): The HTML content of the email body.
+            message_id (str): Message-ID to use (see make_message_id), so
+                that replies can be threaded back to the history entry.
         """
         try:
-            msg = EmailMessage()
-            msg['Subject'] = subject
-            msg['From'] = username
-            msg['To'] = to_address
-            msg['Date'] = formatdate(localtime=True)
-            msg['Message-ID'] = make_msgid(domain=username.split('@')[1] if '@' in username else "localhost")
-            
-            # Text fallback is crucial for anti-spam
-            # We strip HTML tags roughly for the text version
-            import re
-            text_content = re.sub('<[^<]+>', '', content_html).strip()
-            if not text_content:
-                text_content = "Veuillez activer l'affichage HTML pour voir cet email."
-            
-            msg.set_content(text_content)
-            msg.add_alternative(content_html, subtype='html')
-
-            context = ssl.create_default_context()
-            
-            port = int(smtp_port)
-            if port == 465:
-                # SSL connections
-                with smtplib.SMTP_SSL(smtp_server, port, context=context) as server:
-                    server.login(username, password)
-                    server.send_message(msg)
-            else:
-                # TLS connections (587, 25, etc.)
-                with smtplib.SMTP(smtp_server, port) as server:
-                    server.starttls(context=context)
-                    server.login(username, password)
-                    server.send_message(msg)
-                    
-            self.logger.info(f"Email sent successfully to {to_address} via {smtp_server}:{smtp_port}")
+            self.deliver(smtp_server, smtp_port, username, password, to_address, subject, content_html, message_id)
             return True, "Email envoyé avec succès"
-            
-        except smtplib.SMTPAuthenticationError:
-            self.logger.error("Authentication failed. Check your email and app password.")
-            return False, "Erreur d'authentification. Vérifiez le mot de passe d'application."
         except Exception as e:
-            self.logger.error(f"Failed to send email to {to_address}: {e}")
-            return False, str(e)
+            return error_result(self.logger, to_address, e)
+
+    def close_idle_sessions(self):
+        if self.session_pool is not None:
+            return self.session_pool.close_idle()
+        return 0
+
+    def close(self):
+        if self.session_pool is not None:
+            self.session_pool.close_all()
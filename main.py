@@ -5,14 +5,23 @@ import threading
 import socket
 import re
 import tkinter.messagebox as messagebox
+import tkinter.filedialog as filedialog
 import webbrowser
 from datetime import datetime
-from mail_handler import MailSender
+from mail_handler import MailSender, SMTPSessionPool, make_message_id
 from history_manager import HistoryManager
-from reply_checker import ReplyChecker
+from reply_checker import ReplyChecker, ReplyWatcher
+from reply_scheduler import ReplyCheckScheduler
 from profile_manager import ProfileManager
 from template_manager import TemplateManager
-from scraper import ScraperManager
+from scraper import ScraperManager, DEFAULT_MAX_RESULTS
+from scraper_cache import ScraperCache
+from contact_crawler import ContactCrawler
+from lead_store import LeadStore, canonical_url
+from campaign_manager import CampaignManager
+from rate_limiter import RateLimiter
+from outbox import Outbox
+from suppression_list import SuppressionList
 # Configuration
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
@@ -22,11 +31,25 @@ class App(ctk.CTk):
         super().__init__()
 
         # Setup Managers
-        self.mail_sender = MailSender()
+        # SMTP sessions are kept alive between sends (bulk and quick replies)
+        self.rate_limiter = RateLimiter()
+        # Hard-bounced addresses, checked before every send
+        self.suppression_list = SuppressionList()
+        self.mail_sender = MailSender(session_pool=SMTPSessionPool(idle_timeout=60), rate_limiter=self.rate_limiter,
+                                      suppression_list=self.suppression_list)
         self.history_manager = HistoryManager()
+        self.reply_scheduler = ReplyCheckScheduler(self.history_manager, on_bounces=self.on_bounces)
         self.profile_manager = ProfileManager()
         self.template_manager = TemplateManager()
-        self.scraper_manager = ScraperManager()
+        self.scraper_manager = ScraperManager(cache=ScraperCache())
+        self.contact_crawler = ContactCrawler(self.scraper_manager)
+        self.lead_store = LeadStore()
+        self.campaign_manager = CampaignManager(self.mail_sender, self.history_manager, self.template_manager,
+                                                outbox=Outbox())
+        self.outbox_lock = threading.Lock()
+        self.reply_watcher = None
+        self.campaign_file = None
+        self.campaign_stop_event = None
 
         # Pagination State
         self.current_page = 1
@@ -67,6 +90,93 @@ class App(ctk.CTk):
         
         self.log("Application prête.")
 
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(30000, self.reap_idle_smtp_sessions)
+
+        # Queued mail of any profile can be resumed: every account gets its limits
+        self.apply_profile_rate_limits()
+        self.apply_rate_limits()
+
+        # Messages interrupted by a crash are recorded as failed (never sent twice),
+        # then what is still queued in the outbox is resumed in the background.
+        interrupted = self.campaign_manager.recover_outbox()
+        if interrupted:
+            self.log(f"Outbox: {interrupted} envoi(s) interrompu(s) enregistré(s) en échec.")
+        self.resume_outbox_thread()
+
+    def resume_outbox_thread(self):
+        threading.Thread(target=self.resume_outbox, daemon=True).start()
+        self.after(60000, self.resume_outbox_thread)
+
+    def resume_outbox(self):
+        # Only one resume at a time; the next tick will pick up what is left
+        if not self.outbox_lock.acquire(blocking=False):
+            return
+        try:
+            def on_result(row, success, msg, final):
+                if success:
+                    self.log(f"Outbox: email envoyé à {row['email']}.")
+                elif final:
+                    self.log(f"Outbox: échec définitif pour {row['email']}: {msg}")
+
+            self.campaign_manager.resume_outbox(self.get_account_password, on_result=on_result)
+        finally:
+            self.outbox_lock.release()
+
+    def get_account_password(self, username):
+        if username == self.entry_user.get().strip():
+            return self.entry_pass.get().strip()
+        for name in self.profile_manager.get_profile_names():
+            profile = self.profile_manager.get_profile(name)
+            if profile and profile.get("username") == username:
+                return profile.get("password")
+        return None
+
+    def reap_idle_smtp_sessions(self):
+        self.mail_sender.close_idle_sessions()
+        self.after(30000, self.reap_idle_smtp_sessions)
+
+    def restart_reply_watcher(self):
+        """(Re)starts the IMAP IDLE watcher for the account in the settings tab."""
+        if self.reply_watcher is not None:
+            self.reply_watcher.stop()
+            self.reply_watcher = None
+
+        host = self.entry_imap.get().strip()
+        user = self.entry_user.get().strip()
+        pwd = self.entry_pass.get().strip()
+        if not host or not user or not pwd:
+            return
+
+        checker = ReplyChecker(host, user, pwd, on_bounces=self.on_bounces)
+        # Called on every IDLE wake-up: only the fields matching needs, no email bodies
+        self.reply_watcher = ReplyWatcher(checker, self.history_manager.get_sync_entries, self.on_watched_replies)
+        self.reply_watcher.start()
+
+    def on_watched_replies(self, replies):
+        # Called from the watcher thread
+        count = self.history_manager.add_replies(replies)
+        if count:
+            self.after(0, self.show_new_replies, count)
+
+    def on_bounces(self, bounces):
+        # Called from IMAP threads: hard bounces fail their entry and are never mailed again
+        marked = self.history_manager.mark_bounces(bounces)
+        added = self.suppression_list.add_many((b["email"], f"{b['status']} {b['diagnostic']}".strip()) for b in bounces)
+        if added or marked:
+            self.log(f"Rejets définitifs : {added} adresse(s) ajoutée(s) à la liste de suppression, {marked} envoi(s) marqué(s) en échec.")
+            self.after(0, self.load_history_view)
+
+    def show_new_replies(self, count):
+        self.log(f"{count} nouvelle(s) réponse(s) reçue(s).")
+        self.load_history_view()
+
+    def on_close(self):
+        if self.reply_watcher is not None:
+            self.reply_watcher.stop()
+        self.mail_sender.close()
+        self.destroy()
+
     def setup_send_tab(self):
         self.tab_send.grid_columnconfigure(1, weight=1)
         
@@ -103,9 +213,34 @@ class App(ctk.CTk):
         self.btn_send = ctk.CTkButton(self.tab_send, text="Générer & Envoyer", command=self.process_mail)
         self.btn_send.grid(row=6, column=0, columnspan=2, padx=20, pady=10, sticky="ew")
 
+        # Bulk Campaign Frame
+        frame_campaign = ctk.CTkFrame(self.tab_send)
+        frame_campaign.grid(row=7, column=0, columnspan=2, padx=20, pady=(10, 0), sticky="ew")
+        frame_campaign.grid_columnconfigure(1, weight=1)
+
+        self.btn_campaign_file = ctk.CTkButton(frame_campaign, text="📂 Destinataires (CSV/JSONL)", width=180, command=self.choose_campaign_file)
+        self.btn_campaign_file.grid(row=0, column=0, padx=10, pady=5)
+
+        self.lbl_campaign_file = ctk.CTkLabel(frame_campaign, text="Aucun fichier", anchor="w")
+        self.lbl_campaign_file.grid(row=0, column=1, padx=10, pady=5, sticky="ew")
+
+        ctk.CTkLabel(frame_campaign, text="Threads:").grid(row=0, column=2, padx=(10, 2), pady=5)
+        self.entry_campaign_workers = ctk.CTkEntry(frame_campaign, width=40)
+        self.entry_campaign_workers.insert(0, "4")
+        self.entry_campaign_workers.grid(row=0, column=3, padx=(2, 10), pady=5)
+
+        self.btn_campaign = ctk.CTkButton(frame_campaign, text="🚀 Lancer la campagne", command=self.start_campaign)
+        self.btn_campaign.grid(row=1, column=0, padx=10, pady=5)
+
+        self.lbl_campaign_progress = ctk.CTkLabel(frame_campaign, text="", anchor="w")
+        self.lbl_campaign_progress.grid(row=1, column=1, columnspan=3, padx=10, pady=5, sticky="ew")
+
+        self.checkbox_campaign_async = ctk.CTkCheckBox(frame_campaign, text="Moteur asynchrone (asyncio, 'Threads' = connexions simultanées)")
+        self.checkbox_campaign_async.grid(row=2, column=0, columnspan=4, padx=10, pady=5, sticky="w")
+
         # Logs Area
         self.textbox_log = ctk.CTkTextbox(self.tab_send, height=150)
-        self.textbox_log.grid(row=7, column=0, columnspan=2, padx=20, pady=(10, 0), sticky="nsew")
+        self.textbox_log.grid(row=8, column=0, columnspan=2, padx=20, pady=(10, 0), sticky="nsew")
 
     def setup_settings_tab(self):
         self.tab_settings.grid_columnconfigure(1, weight=1)
@@ -137,18 +272,46 @@ class App(ctk.CTk):
         self.entry_imap = ctk.CTkEntry(self.tab_settings, placeholder_text="imap.gmail.com")
         self.entry_imap.grid(row=3, column=1, padx=10, pady=5, sticky="ew")
 
+        # Folders checked for replies (comma separated)
+        ctk.CTkLabel(self.tab_settings, text="Dossiers IMAP (réponses):").grid(row=4, column=0, padx=10, pady=5, sticky="w")
+        self.entry_imap_folders = ctk.CTkEntry(self.tab_settings, placeholder_text="INBOX, [Gmail]/Spam")
+        self.entry_imap_folders.insert(0, "INBOX")
+        self.entry_imap_folders.grid(row=4, column=1, padx=10, pady=5, sticky="ew")
+
         # Credentials (Shared)
-        ctk.CTkLabel(self.tab_settings, text="Email User:").grid(row=4, column=0, padx=10, pady=5, sticky="w")
+        ctk.CTkLabel(self.tab_settings, text="Email User:").grid(row=5, column=0, padx=10, pady=5, sticky="w")
         self.entry_user = ctk.CTkEntry(self.tab_settings)
-        self.entry_user.grid(row=4, column=1, padx=10, pady=5, sticky="ew")
+        self.entry_user.grid(row=5, column=1, padx=10, pady=5, sticky="ew")
 
-        ctk.CTkLabel(self.tab_settings, text="Mot de passe (App Password):").grid(row=5, column=0, padx=10, pady=5, sticky="w")
+        ctk.CTkLabel(self.tab_settings, text="Mot de passe (App Password):").grid(row=6, column=0, padx=10, pady=5, sticky="w")
         self.entry_pass = ctk.CTkEntry(self.tab_settings, show="*")
-        self.entry_pass.grid(row=5, column=1, padx=10, pady=5, sticky="ew")
+        self.entry_pass.grid(row=6, column=1, padx=10, pady=5, sticky="ew")
         
+        # Sending Limits (0 = unlimited)
+        frame_limits = ctk.CTkFrame(self.tab_settings, fg_color="transparent")
+        frame_limits.grid(row=7, column=0, columnspan=2, pady=(10, 0), sticky="ew")
+
+        ctk.CTkLabel(frame_limits, text="Limites d'envoi (0 = illimité) — Msgs/min:").pack(side="left", padx=(10, 5))
+        self.entry_rate_minute = ctk.CTkEntry(frame_limits, width=50)
+        self.entry_rate_minute.insert(0, "0")
+        self.entry_rate_minute.pack(side="left", padx=5)
+
+        ctk.CTkLabel(frame_limits, text="Msgs/jour:").pack(side="left", padx=5)
+        self.entry_rate_day = ctk.CTkEntry(frame_limits, width=60)
+        self.entry_rate_day.insert(0, "0")
+        self.entry_rate_day.pack(side="left", padx=5)
+
+        ctk.CTkLabel(frame_limits, text="Rafale:").pack(side="left", padx=5)
+        self.entry_rate_burst = ctk.CTkEntry(frame_limits, width=40)
+        self.entry_rate_burst.insert(0, "1")
+        self.entry_rate_burst.pack(side="left", padx=5)
+
+        self.lbl_quota = ctk.CTkLabel(self.tab_settings, text="Quota restant aujourd'hui : illimité")
+        self.lbl_quota.grid(row=8, column=0, columnspan=2, padx=10, pady=5, sticky="w")
+
         # Save Profile Section
         frame_save = ctk.CTkFrame(self.tab_settings, fg_color="transparent")
-        frame_save.grid(row=6, column=0, columnspan=2, pady=20, sticky="ew")
+        frame_save.grid(row=9, column=0, columnspan=2, pady=20, sticky="ew")
         frame_save.grid_columnconfigure(1, weight=1)
         
         ctk.CTkLabel(frame_save, text="Nom d'enregistrement:").grid(row=0, column=0, padx=10, pady=5)
@@ -223,46 +386,175 @@ class App(ctk.CTk):
         lbl_keywords = ctk.CTkLabel(frame_config, text="Mots-clés / Rayon :")
         lbl_keywords.grid(row=0, column=2, padx=10, pady=10, sticky="w")
         
-        self.entry_scraping_keywords = ctk.CTkEntry(frame_config, placeholder_text="Ex: recherche groupe bar", width=180)
+        self.entry_scraping_keywords = ctk.CTkEntry(frame_config, placeholder_text="Ex: recherche groupe bar ; scène ouverte", width=220)
         self.entry_scraping_keywords.grid(row=0, column=3, padx=10, pady=10, sticky="w")
         
         self.btn_start_scraping = ctk.CTkButton(frame_config, text="🔍 Démarrer Scraping Google", command=self.perform_scraping_thread)
         self.btn_start_scraping.grid(row=0, column=4, padx=20, pady=10)
         
+        # Repeated searches are answered from the cache unless this is checked
+        self.check_force_refresh = ctk.CTkCheckBox(frame_config, text="Forcer l'actualisation")
+        self.check_force_refresh.grid(row=0, column=5, padx=10, pady=10, sticky="w")
+        
+        lbl_max_results = ctk.CTkLabel(frame_config, text="Résultats max / requête :")
+        lbl_max_results.grid(row=1, column=0, padx=10, pady=(0, 10), sticky="w")
+        
+        self.entry_scraping_max = ctk.CTkEntry(frame_config, width=80)
+        self.entry_scraping_max.insert(0, str(DEFAULT_MAX_RESULTS))
+        self.entry_scraping_max.grid(row=1, column=1, padx=10, pady=(0, 10), sticky="w")
+        
+        self.lbl_scraping_count = ctk.CTkLabel(frame_config, text="0 résultat")
+        self.lbl_scraping_count.grid(row=1, column=2, columnspan=2, padx=10, pady=(0, 10), sticky="w")
+        
+        self.btn_cancel_scraping = ctk.CTkButton(frame_config, text="⏹ Arrêter", fg_color="#C0392B", hover_color="#922B21",
+                                                 state="disabled", command=self.cancel_scraping)
+        self.btn_cancel_scraping.grid(row=1, column=4, padx=20, pady=(0, 10))
+        self.scraping_cancel = threading.Event()
+        self.scraping_results = []
+        
+        # Crawls the results for email addresses and writes a recipient file
+        self.btn_extract_contacts = ctk.CTkButton(frame_config, text="📧 Extraire les contacts", state="disabled",
+                                                  command=self.extract_contacts)
+        self.btn_extract_contacts.grid(row=1, column=5, padx=10, pady=(0, 10), sticky="w")
+        self.crawl_cancel = None
+        
+        # Leads found by earlier searches are kept in leads.db
+        self.check_hide_seen = ctk.CTkCheckBox(frame_config, text="Masquer les annonces déjà vues")
+        self.check_hide_seen.grid(row=2, column=0, columnspan=3, padx=10, pady=(0, 10), sticky="w")
+        self.check_hide_seen.select()
+        
         # Results View
         self.scroll_scraping_results = ctk.CTkScrollableFrame(self.tab_scraping, label_text="Annonces / Opportunités (Google)")
         self.scroll_scraping_results.grid(row=1, column=0, sticky="nsew", padx=10, pady=10)
 
     def perform_scraping_thread(self):
         self.btn_start_scraping.configure(state="disabled", text="Recherche...")
-        threading.Thread(target=self.perform_scraping, daemon=True).start()
+        self.btn_extract_contacts.configure(state="disabled")
+        self.btn_cancel_scraping.configure(state="normal")
+        self.scraping_cancel = threading.Event()
+        threading.Thread(target=self.perform_scraping, args=(self.scraping_cancel,), daemon=True).start()
+
+    def cancel_scraping(self):
+        self.scraping_cancel.set()
+        self.btn_cancel_scraping.configure(state="disabled")
+        self.log("Scraping: arrêt demandé.")
+
+    def end_scraping(self):
+        self.btn_start_scraping.configure(state="normal", text="🔍 Démarrer Scraping Google")
+        self.btn_cancel_scraping.configure(state="disabled")
+        self.btn_extract_contacts.configure(state="normal" if self.scraping_results else "disabled")
+
+    def extract_contacts(self):
+        if self.crawl_cancel is not None:
+            # A crawl is running: the button acts as a stop button
+            self.crawl_cancel.set()
+            self.btn_extract_contacts.configure(state="disabled", text="Arrêt en cours...")
+            return
 
-    def perform_scraping(self):
-        city = self.entry_scraping_city.get().strip()
-        keywords = self.entry_scraping_keywords.get().strip()
-        
-        if not city and not keywords:
+        filepath = filedialog.asksaveasfilename(title="Fichier de destinataires", defaultextension=".csv",
+                                                initialfile="destinataires.csv", filetypes=[("CSV", "*.csv")])
+        if not filepath:
+            return
+        self.crawl_cancel = threading.Event()
+        self.btn_extract_contacts.configure(text="⏹ Arrêter l'extraction")
+        self.btn_start_scraping.configure(state="disabled")
+        results = list(self.scraping_results)
+        threading.Thread(target=self.perform_contact_extraction, args=(results, filepath, self.crawl_cancel),
+                         daemon=True).start()
+
+    def perform_contact_extraction(self, results, filepath, cancel_event):
+        self.log(f"Extraction des contacts de {len(results)} site(s)...")
+        sites_done = [0]
+
+        def on_site_done(result, contacts):
+            sites_done[0] += 1
+            if contacts:
+                self.log(f"{result['url']} : {', '.join(c['email'] for c in contacts)}")
+            self.after(0, lambda done=sites_done[0]: self.lbl_scraping_count.configure(
+                text=f"Contacts : {done}/{len(results)} site(s)"))
+
+        contacts = self.contact_crawler.crawl(results, on_site_done=on_site_done, cancel_event=cancel_event)
+        self.lead_store.add_contacts(contacts)
+        try:
+            count = self.contact_crawler.write_recipients(contacts, filepath)
+            self.log(f"{count} adresse(s) enregistrée(s) dans {os.path.basename(filepath)}"
+                     + (" (extraction interrompue)" if cancel_event.is_set() else ""))
+            if count:
+                # Ready for the bulk campaign of the sending tab
+                self.campaign_file = filepath
+                self.after(0, lambda: self.lbl_campaign_file.configure(text=os.path.basename(filepath)))
+        except OSError as e:
+            self.log(f"Erreur lors de l'écriture de {filepath} : {e}")
+
+        def done():
+            self.crawl_cancel = None
+            self.btn_extract_contacts.configure(state="normal", text="📧 Extraire les contacts")
+            self.btn_start_scraping.configure(state="normal")
+        self.after(0, done)
+
+    def perform_scraping(self, cancel_event):
+        # Several cities separated by commas, several keyword sets by semicolons
+        cities = [c.strip() for c in self.entry_scraping_city.get().split(",") if c.strip()]
+        keyword_sets = [k.strip() for k in self.entry_scraping_keywords.get().split(";") if k.strip()]
+        
+        if not cities and not keyword_sets:
             self.log("Scraping: Veuillez entrer une ville ou des mots-clés.")
-            self.after(0, lambda: self.btn_start_scraping.configure(state="normal", text="🔍 Démarrer Scraping Google"))
+            self.after(0, self.end_scraping)
             return
+
+        try:
+            max_results = max(1, int(self.entry_scraping_max.get().strip()))
+        except ValueError:
+            max_results = DEFAULT_MAX_RESULTS
             
-        self.log(f"Lancement de la recherche d'opportunités pour : {city} {keywords}")
-        
-        results = self.scraper_manager.search_gigs(city, keywords, num_results=15)
-        
-        self.after(0, lambda: self.display_scraping_results(results))
-        self.after(0, lambda: self.btn_start_scraping.configure(state="normal", text="🔍 Démarrer Scraping Google"))
+        self.log(f"Lancement de la recherche d'opportunités pour : {', '.join(cities) or '-'} / {' ; '.join(keyword_sets) or '-'}")
+        self.after(0, lambda: self.display_scraping_results([]))
+        self.after(0, lambda: self.lbl_scraping_count.configure(text="0 résultat"))
+        self.scraping_results = []
+
+        # The same page often comes back for several cities / keyword sets
+        seen_urls = set()
+        hide_seen = bool(self.check_hide_seen.get())
+        skipped = 0
+        batches = self.scraper_manager.iter_many(cities, keyword_sets, max_results=max_results,
+                                                 force_refresh=bool(self.check_force_refresh.get()),
+                                                 cancel_event=cancel_event)
+        for city, keywords, results in batches:
+            new_results = [r for r in results if canonical_url(r['url']) not in seen_urls]
+            seen_urls.update(canonical_url(r['url']) for r in new_results)
+            if hide_seen:
+                unseen = self.lead_store.filter_new(new_results)
+                skipped += len(new_results) - len(unseen)
+            else:
+                unseen = new_results
+            self.lead_store.add_results(new_results, " ".join(filter(None, (keywords, city))))
+            if unseen:
+                self.scraping_results.extend(unseen)
+                total = len(self.scraping_results)
+                self.after(0, lambda batch=unseen: self.append_scraping_results(batch))
+                self.after(0, lambda total=total: self.lbl_scraping_count.configure(text=f"{total} résultat(s)"))
+
+        summary = f"{len(self.scraping_results)} résultat(s)" + (f", {skipped} déjà vu(s) masqué(s)" if skipped else "")
+        if cancel_event.is_set():
+            self.log(f"Scraping interrompu : {summary}.")
+        else:
+            self.log(f"Scraping terminé : {summary}.")
+        if not self.scraping_results:
+            self.after(0, self.show_no_scraping_results)
+        self.after(0, self.end_scraping)
         
     def display_scraping_results(self, results):
         # Clear previous results
         for widget in self.scroll_scraping_results.winfo_children():
             widget.destroy()
             
-        if not results:
-            lbl = ctk.CTkLabel(self.scroll_scraping_results, text="Aucun résultat trouvé sur Google.", text_color="orange")
-            lbl.pack(pady=20)
-            return
-            
+        self.append_scraping_results(results)
+
+    def show_no_scraping_results(self):
+        lbl = ctk.CTkLabel(self.scroll_scraping_results, text="Aucun résultat trouvé sur Google.", text_color="orange")
+        lbl.pack(pady=20)
+
+    def append_scraping_results(self, results):
         for idx, res in enumerate(results):
             frame_res = ctk.CTkFrame(self.scroll_scraping_results)
             frame_res.pack(fill="x", padx=10, pady=5)
@@ -526,7 +818,11 @@ class App(ctk.CTk):
 
     def on_tab_change(self):
         if self.tab_view.get() == "Historique & Suivi":
-            self.check_replies_thread()
+            # The IDLE watcher already keeps the history up to date
+            if self.reply_watcher is not None and self.reply_watcher.is_running():
+                self.load_history_view()
+            else:
+                self.check_replies_thread()
 
     def on_search_change(self, event):
         self.current_page = 1
@@ -579,9 +875,7 @@ class App(ctk.CTk):
             self.log("Erreur: Modèle introuvable ou vide.")
             return
 
-        final_content = template_content
-        for var_name, var_value in variables_data.items():
-            final_content = final_content.replace(f"{{{var_name}}}", var_value)
+        final_content = self.template_manager.compile_template(template_name, template_content).render(variables_data)
             
         if not send_immediately:
             self.history_manager.add_entry(email, variables_str, subject, tracking_id, "Brouillon", final_content)
@@ -599,19 +893,125 @@ class App(ctk.CTk):
             self.log("Erreur: Veuillez configurer le SMTP (Onglet Configuration Email).")
             return
 
-        success, msg = self.mail_sender.send_email(
-            smtp_server, smtp_port, user, pwd,
-            email, subject, final_content
-        )
-        
-        status = "Envoyé" if success else "Échec"
-        self.history_manager.add_entry(email, variables_str, subject, tracking_id, status, final_content)
-        
+        self.apply_rate_limits()
+        smtp_settings = {"smtp_server": smtp_server, "smtp_port": smtp_port, "username": user, "password": pwd}
+        threading.Thread(target=self.send_queued_mail,
+                         args=(email, variables_str, subject, final_content, smtp_settings, tracking_id),
+                         daemon=True).start()
+
+    def send_queued_mail(self, email, variables_str, subject, final_content, smtp_settings, tracking_id):
+        # The message goes through the outbox so that a crash or a transient
+        # SMTP error does not lose it; history is written once the outcome is final.
+        success, msg, final = self.campaign_manager.send_single(email, variables_str, subject, final_content,
+                                                                smtp_settings, tracking_id)
         if success:
             self.log(f"Succès: Email envoyé à {email}.")
-            self.load_history_view()
-        else:
+        elif final:
             self.log(f"Erreur SMTP: {msg}")
+        else:
+            self.log(f"Erreur temporaire ({msg}): l'email pour {email} reste en file et sera renvoyé automatiquement.")
+        self.after(0, self.refresh_quota_label)
+        self.after(0, self.load_history_view)
+
+    def choose_campaign_file(self):
+        filepath = filedialog.askopenfilename(title="Fichier de destinataires",
+                                              filetypes=[("CSV / JSONL", "*.csv *.jsonl *.ndjson"), ("Tous", "*.*")])
+        if filepath:
+            self.campaign_file = filepath
+            self.lbl_campaign_file.configure(text=os.path.basename(filepath))
+
+    def start_campaign(self):
+        if self.campaign_stop_event is not None:
+            # A campaign is running: the button acts as a stop button
+            self.campaign_stop_event.set()
+            self.btn_campaign.configure(state="disabled", text="Arrêt en cours...")
+            return
+
+        if not self.campaign_file:
+            self.log("Erreur: Choisissez un fichier de destinataires (CSV ou JSONL).")
+            return
+        if self.checkbox_send.get() != 1:
+            self.log("Erreur: Cochez 'Confirmer l'envoi' pour lancer une campagne.")
+            return
+
+        template_name = self.combo_send_template.get()
+        if not template_name:
+            self.log("Erreur: Veuillez sélectionner un modèle.")
+            return
+
+        smtp_settings = {
+            "smtp_server": self.entry_smtp_server.get().strip(),
+            "smtp_port": self.entry_smtp_port.get().strip(),
+            "username": self.entry_user.get().strip(),
+            "password": self.entry_pass.get().strip()
+        }
+        if not all(smtp_settings.values()):
+            self.log("Erreur: Veuillez configurer le SMTP (Onglet Configuration Email).")
+            return
+        self.apply_rate_limits()
+
+        try:
+            workers = max(1, int(self.entry_campaign_workers.get().strip()))
+        except ValueError:
+            workers = 4
+
+        try:
+            variables = self.template_manager.get_template_variables(template_name)
+            recipients = self.campaign_manager.load_recipients(self.campaign_file, variables)
+        except Exception as e:
+            self.log(f"Erreur lecture du fichier de destinataires: {e}")
+            return
+
+        if not recipients:
+            self.log("Erreur: Aucun destinataire valide (colonne 'email') dans le fichier.")
+            return
+
+        subject = self.entry_subject.get().strip()
+        engine = "async" if self.checkbox_campaign_async.get() == 1 else "threads"
+        self.campaign_stop_event = threading.Event()
+        self.btn_campaign.configure(text="⏹ Arrêter la campagne")
+        self.log(f"Campagne lancée: {len(recipients)} destinataire(s), {workers} thread(s).")
+        threading.Thread(target=self.run_campaign,
+                         args=(recipients, template_name, subject, smtp_settings, workers, engine),
+                         daemon=True).start()
+
+    def run_campaign(self, recipients, template_name, subject, smtp_settings, workers, engine):
+        def on_progress(stats):
+            if not stats["last_success"]:
+                if stats["last_final"]:
+                    text = f"Échec pour {stats['last_email']}: {stats['last_message']}"
+                else:
+                    text = f"Erreur temporaire pour {stats['last_email']} ({stats['last_message']}), nouvel essai programmé."
+                self.after(0, lambda t=text: self.log(t))
+            self.after(0, lambda s=stats: self.update_campaign_progress(s))
+
+        try:
+            stats = self.campaign_manager.run_campaign(recipients, template_name, subject, smtp_settings,
+                                                       workers=workers, on_progress=on_progress,
+                                                       stop_event=self.campaign_stop_event, engine=engine)
+            summary = (f"Campagne terminée: {stats['sent']} envoyé(s), {stats['failed']} échec(s), "
+                       f"{stats['retrying']} en attente de nouvel essai, {stats['cancelled']} annulé(s) "
+                       f"en {stats['elapsed']:.1f}s ({stats['rate']:.2f} msgs/s).")
+        except Exception as e:
+            summary = f"Erreur campagne: {e}"
+
+        self.after(0, lambda: self.finish_campaign(summary))
+
+    def update_campaign_progress(self, stats):
+        self.refresh_quota_label()
+        done = stats["sent"] + stats["failed"] + stats["retrying"]
+        self.lbl_campaign_progress.configure(
+            text=f"{done}/{stats['total']} — ✅ {stats['sent']}  ❌ {stats['failed']}  🔁 {stats['retrying']} — {stats['rate']:.2f} msgs/s")
+
+    def finish_campaign(self, summary):
+        self.campaign_stop_event = None
+        self.btn_campaign.configure(state="normal", text="🚀 Lancer la campagne")
+        self.refresh_quota_label()
+        self.log(summary)
+        linked = self.lead_store.link_history(self.history_manager)
+        if linked:
+            self.log(f"{linked} envoi(s) rattaché(s) aux annonces d'origine.")
+        self.load_history_view()
 
     def save_settings(self):
         profile_name = self.entry_profile_name.get().strip()
@@ -625,9 +1025,14 @@ class App(ctk.CTk):
             self.log("Erreur: Donnez un nom pour enregistrer ce profil.")
             return
 
-        self.profile_manager.save_profile(profile_name, smtp_var, port_var, imap_var, user_var, pass_var)
+        per_minute, per_day, burst = self.read_rate_limit_entries()
+        self.profile_manager.save_profile(profile_name, smtp_var, port_var, imap_var, user_var, pass_var,
+                                          per_minute, per_day, burst, self.read_imap_folders())
+        self.apply_profile_rate_limits()
+        self.apply_rate_limits()
         self.combo_profiles.configure(values=self.profile_manager.get_profile_names())
         self.combo_profiles.set(profile_name)
+        self.restart_reply_watcher()
         self.log(f"Profil '{profile_name}' enregistré avec succès.")
 
     def load_profile(self, profile_name):
@@ -641,6 +1046,9 @@ class App(ctk.CTk):
             
             self.entry_imap.delete(0, 'end')
             self.entry_imap.insert(0, profile.get("imap_server", ""))
+
+            self.entry_imap_folders.delete(0, 'end')
+            self.entry_imap_folders.insert(0, ", ".join(self.profile_manager.get_imap_folders(profile_name)))
             
             self.entry_user.delete(0, 'end')
             self.entry_user.insert(0, profile.get("username", ""))
@@ -648,34 +1056,94 @@ class App(ctk.CTk):
             self.entry_pass.delete(0, 'end')
             self.entry_pass.insert(0, profile.get("password", ""))
             
+            per_minute, per_day, burst = self.profile_manager.get_rate_limits(profile_name)
+            for entry, value in ((self.entry_rate_minute, per_minute), (self.entry_rate_day, per_day), (self.entry_rate_burst, burst)):
+                entry.delete(0, 'end')
+                entry.insert(0, str(value))
+
             self.entry_profile_name.delete(0, 'end')
             self.entry_profile_name.insert(0, profile_name)
+            self.apply_rate_limits()
+            self.restart_reply_watcher()
             self.log(f"Profil '{profile_name}' chargé.")
 
+    def read_imap_folders(self):
+        folders = [f.strip() for f in self.entry_imap_folders.get().split(",") if f.strip()]
+        return folders or ["INBOX"]
+
+    def read_rate_limit_entries(self):
+        values = []
+        for entry, default in ((self.entry_rate_minute, 0), (self.entry_rate_day, 0), (self.entry_rate_burst, 1)):
+            try:
+                values.append(max(0, int(entry.get().strip())))
+            except ValueError:
+                values.append(default)
+        return tuple(values)
+
+    def apply_profile_rate_limits(self):
+        """Applies the saved sending limits of every profile, not only the one being edited."""
+        for name in self.profile_manager.get_profile_names():
+            profile = self.profile_manager.get_profile(name)
+            if profile and profile.get("username"):
+                self.rate_limiter.set_limits(profile["username"], *self.profile_manager.get_rate_limits(name))
+
+    def apply_rate_limits(self):
+        user = self.entry_user.get().strip()
+        if not user:
+            return
+        per_minute, per_day, burst = self.read_rate_limit_entries()
+        self.rate_limiter.set_limits(user, per_minute, per_day, burst)
+        self.refresh_quota_label()
+
+    def refresh_quota_label(self):
+        user = self.entry_user.get().strip()
+        remaining = self.rate_limiter.remaining_today(user) if user else None
+        text = "illimité" if remaining is None else f"{remaining} message(s)"
+        self.lbl_quota.configure(text=f"Quota restant aujourd'hui : {text}")
+
     def check_replies_thread(self):
         threading.Thread(target=self.check_replies, daemon=True).start()
 
+    def reply_accounts(self):
+        """IMAP accounts to check: every saved profile, plus the settings currently typed in."""
+        accounts = {}
+        for name in self.profile_manager.get_profile_names():
+            profile = self.profile_manager.get_profile(name)
+            if profile and profile.get("imap_server") and profile.get("username") and profile.get("password"):
+                accounts[(profile["imap_server"], profile["username"])] = {
+                    "imap_server": profile["imap_server"],
+                    "username": profile["username"],
+                    "password": profile["password"],
+                    "folders": self.profile_manager.get_imap_folders(name)
+                }
+        host = self.entry_imap.get().strip()
+        user = self.entry_user.get().strip()
+        pwd = self.entry_pass.get().strip()
+        if host and user and pwd:
+            accounts[(host, user)] = {"imap_server": host, "username": user, "password": pwd,
+                                      "folders": self.read_imap_folders()}
+        return list(accounts.values())
+
     def check_replies(self):
-        host = self.entry_imap.get()
-        user = self.entry_user.get()
-        pwd = self.entry_pass.get()
+        accounts = self.reply_accounts()
 
-        if not host or not user or not pwd:
+        if not accounts:
             self.log("Information: Configurez l'IMAP dans les paramètres pour vérifier les réponses automatiquement.")
             # We still load the view even if we can't check IMAP
             self.after(0, self.load_history_view)
             return
 
-        self.log("Connexion IMAP en cours pour vérifier les réponses...")
-        checker = ReplyChecker(host, user, pwd)
-        history = self.history_manager.get_history()
-        
-        replies_found = checker.check_replies(history)
-        
-        count = 0
-        for reply in replies_found:
-            if self.history_manager.add_reply(reply["uuid"], reply):
-                count += 1
+        self.log(f"Connexion IMAP en cours pour vérifier les réponses ({len(accounts)} compte(s))...")
+
+        def on_account_done(result):
+            if result["error"]:
+                self.log(f"IMAP {result['username']} : erreur ({result['error']}) après {result['elapsed']:.1f}s")
+                return
+            folders = ", ".join(f"{name} {info['elapsed']:.1f}s" + (" (erreur)" if info.get("error") else "")
+                                for name, info in result["folders"].items())
+            self.log(f"IMAP {result['username']} : {len(result['replies'])} réponse(s) en {result['elapsed']:.1f}s [{folders}]")
+
+        count, _ = self.reply_scheduler.check_all(accounts, on_account_done)
         
         self.log(f"Vérification terminée. {count} nouvelle(s) réponse(s) détectée(s).")
         
@@ -687,7 +1155,6 @@ class App(ctk.CTk):
         for widget in self.scroll_history.winfo_children():
             widget.destroy()
 
-        history = self.history_manager.get_history()
         search_query = self.entry_search.get().strip().lower()
         active_filter = self.filter_var.get()
         
@@ -696,45 +1163,20 @@ class App(ctk.CTk):
         else:
             self.scroll_history.configure(label_text="Historique d'Envois")
 
-        if search_query:
-            history = [entry for entry in history if search_query in entry.get('email', '').lower()]
-            
-        if active_filter == "Envoyés":
-            history = [e for e in history if e.get("status") in ("Envoyé", "Sent")]
-        elif active_filter == "Échecs":
-            history = [e for e in history if e.get("status") == "Échec"]
-        elif active_filter == "Brouillons":
-            history = [e for e in history if e.get("status") == "Brouillon"]
-            
-        if active_filter in ("Non consultées", "Consultées"):
-            # Extract all replies flat list
-            replies_list = []
-            for entry in self.history_manager.get_history():
-                for r in entry.get("replies", []):
-                    # Attach parent uuid to the reply dictionary so we can trace back deletions
-                    r["_parent_uuid"] = entry.get("uuid")
-                    if active_filter == "Consultées" and r.get("read"):
-                        replies_list.append(r)
-                    elif active_filter == "Non consultées" and not r.get("read"):
-                        replies_list.append(r)
-            
-            if search_query:
-                replies_list = [r for r in replies_list if search_query in r.get("email", "").lower() or search_query in r.get("subject", "").lower()]
+        # Only the requested page is read from storage; replies are flattened
+        # and sorted newest first for the "Consultées" / "Non consultées" tabs
+        paged_items, total_items = self.history_manager.query_history(
+            active_filter, search_query, (self.current_page - 1) * self.items_per_page, self.items_per_page)
+        total_pages = max(1, (total_items + self.items_per_page - 1) // self.items_per_page)
+        if self.current_page > total_pages:
+            self.current_page = total_pages
+            paged_items, total_items = self.history_manager.query_history(
+                active_filter, search_query, (self.current_page - 1) * self.items_per_page, self.items_per_page)
 
-            # Sort replies by date newest first
-            replies_list.sort(key=lambda x: x.get("date", ""), reverse=True)
-            
-            # Pagination
-            total_items = len(replies_list)
-            total_pages = max(1, (total_items + self.items_per_page - 1) // self.items_per_page)
-            if self.current_page > total_pages: self.current_page = total_pages
-            
-            start_idx = (self.current_page - 1) * self.items_per_page
-            end_idx = start_idx + self.items_per_page
-            
-            paged_replies = replies_list[start_idx:end_idx]
-            
-            self.lbl_page_info.configure(text=f"Page {self.current_page} / {total_pages}")
+        self.lbl_page_info.configure(text=f"Page {self.current_page} / {total_pages}")
+
+        if active_filter in ("Non consultées", "Consultées"):
+            paged_replies = paged_items
             
             headers = ["Date", "Heure", "Expéditeur", "Sujet", "Statut", "Contenu", "Actions"]
             for i, h in enumerate(headers):
@@ -772,22 +1214,15 @@ class App(ctk.CTk):
                 btn_del = ctk.CTkButton(self.scroll_history, text="🗑", width=30, fg_color="#c0392b", hover_color="#922b21",
                                         command=lambda u=parent_u: self.confirm_delete_entry(u))
                 btn_del.grid(row=row, column=6, padx=5, pady=2)
+
+            if active_filter == "Non consultées" and paged_replies:
+                keys = [(reply.get('_parent_uuid'), reply.get('date')) for reply in paged_replies]
+                btn_read_page = ctk.CTkButton(self.scroll_history, text="✔ Marquer cette page comme lue",
+                                              command=lambda k=keys: self.mark_replies_read(k))
+                btn_read_page.grid(row=len(paged_replies) + 1, column=0, columnspan=len(headers), pady=10)
             return
 
-        # Pagination
-        total_items = len(history)
-        total_pages = max(1, (total_items + self.items_per_page - 1) // self.items_per_page)
-        if self.current_page > total_pages: self.current_page = total_pages
-        
-        start_idx = (self.current_page - 1) * self.items_per_page
-        end_idx = start_idx + self.items_per_page
-        
-        # history is already reversed in logic, but wait, the original code used reversed(history).
-        # We need to reverse it and then slice.
-        history_reversed = list(reversed(history))
-        paged_history = history_reversed[start_idx:end_idx]
-        
-        self.lbl_page_info.configure(text=f"Page {self.current_page} / {total_pages}")
+        paged_history = paged_items
 
         # Header for normal history
         headers = ["Date", "Heure", "Email", "Sujet", "Statut", "Répondu?", "Contenu", "Actions"]
@@ -816,7 +1251,7 @@ class App(ctk.CTk):
             ctk.CTkLabel(self.scroll_history, text=entry['status']).grid(row=row, column=4, padx=5, pady=2)
 
             # Replied Label (Auto detected)
-            if entry.get('status') in ("Brouillon", "Échec"):
+            if entry.get('status') in ("Brouillon", "Échec", "Annulé"):
                 is_replied = "-"
             else:
                 is_replied = "✅" if entry.get('replied') else "❌"
@@ -886,21 +1321,24 @@ class App(ctk.CTk):
         cleaned = re.sub(r'\n\s*\n', '\n\n', cleaned)
         return cleaned.strip()
 
+    def mark_replies_read(self, keys):
+        # One transaction for the whole page
+        count = self.history_manager.mark_replies_read(keys)
+        self.log(f"{count} réponse(s) marquée(s) comme lue(s).")
+        self.load_history_view()
+
     def open_reply(self, parent_uuid, reply_date, content):
         self.history_manager.mark_reply_read(parent_uuid, reply_date)
         
         # Trouver l'email d'origine pour obtenir le destinataire et le sujet
-        history = self.history_manager.get_history()
-        parent_entry = None
-        for entry in history:
-            if entry.get("uuid") == parent_uuid:
-                parent_entry = entry
-                break
-                
-        self.show_email_content_dialog(content, history_entry=parent_entry)
+        parent_entry = self.history_manager.get_entry(parent_uuid)
+        reply = next((r for r in parent_entry.get("replies", []) if r.get("date") == reply_date), None) if parent_entry else None
+
+        self.show_email_content_dialog(content, history_entry=parent_entry,
+                                       attachments=reply.get("attachments") if reply else None)
         self.load_history_view()
 
-    def show_email_content_dialog(self, content, history_entry=None):
+    def show_email_content_dialog(self, content, history_entry=None, attachments=None):
         dialog = ctk.CTkToplevel(self)
         dialog.title("Contenu de l'email")
         dialog.geometry("600x500")
@@ -913,6 +1351,10 @@ class App(ctk.CTk):
         
         # Clean HTML if any (for old entries or messy replies)
         clean_content = self.clean_html_for_display(content)
+        if attachments:
+            # Attachments live in the spool directory, only their paths are in the history
+            lines = [f"• {a['filename']} ({a['size'] / 1024:.0f} Ko) : {os.path.abspath(a['path'])}" for a in attachments]
+            clean_content += "\n\n--- Pièces jointes ---\n" + "\n".join(lines)
         
         textbox = ctk.CTkTextbox(dialog, font=ctk.CTkFont(family="Consolas", size=12))
         textbox.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
@@ -978,26 +1420,38 @@ class App(ctk.CTk):
             
             self.log(f"Envoi de la réponse à {history_entry.get('email')}...")
             btn_send.configure(state="disabled", text="Envoi...")
-            self.update()
-            
+
+            # The rate limiter may wait for a free token: never block the window
+            message_id = make_message_id(user)
+            threading.Thread(target=deliver_reply, args=(smtp_server, smtp_port, user, pwd, html_content, message_id),
+                             daemon=True).start()
+
+        def deliver_reply(smtp_server, smtp_port, user, pwd, html_content, message_id):
             success, msg = self.mail_sender.send_email(
                 smtp_server, smtp_port, user, pwd,
-                history_entry.get('email'), reply_subject, html_content
+                history_entry.get('email'), reply_subject, html_content, message_id
             )
-            
+            self.after(0, reply_done, success, msg, html_content, message_id)
+
+        def reply_done(success, msg, html_content, message_id):
+            self.refresh_quota_label()
+            dialog_open = reply_dialog.winfo_exists()
             if success:
                 self.log(f"Succès: Réponse envoyée à {history_entry.get('email')}.")
                 # Also log it in history as a new sent email for tracking
                 tracking_id = str(uuid.uuid4())
-                self.history_manager.add_entry(history_entry.get('email'), "Réponse directe", reply_subject, tracking_id, "Envoyé", html_content)
+                self.history_manager.add_entry(history_entry.get('email'), "Réponse directe", reply_subject, tracking_id, "Envoyé", html_content, message_id)
                 self.load_history_view()
-                messagebox.showinfo("Succès", "Réponse envoyée avec succès.", parent=reply_dialog)
-                reply_dialog.destroy()
-                parent_dialog.destroy()
+                if dialog_open:
+                    messagebox.showinfo("Succès", "Réponse envoyée avec succès.", parent=reply_dialog)
+                    reply_dialog.destroy()
+                if parent_dialog.winfo_exists():
+                    parent_dialog.destroy()
             else:
                 self.log(f"Erreur SMTP lors de la réponse: {msg}")
-                messagebox.showerror("Erreur", f"L'envoi a échoué :\n{msg}", parent=reply_dialog)
-                btn_send.configure(state="normal", text="Envoyer")
+                if dialog_open:
+                    messagebox.showerror("Erreur", f"L'envoi a échoué :\n{msg}", parent=reply_dialog)
+                    btn_send.configure(state="normal", text="Envoyer")
                 
         btn_send = ctk.CTkButton(frame_buttons, text="Envoyer", command=send_reply)
         btn_send.grid(row=0, column=0, padx=5)
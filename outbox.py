@@ -0,0 +1,332 @@
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from mail_handler import QuotaExceededError, SendInterruptedError, make_message_id
+
+class Outbox:
+    """
+    Persistent SQLite queue of rendered messages waiting to be sent.
+
+    Rows go pending -> claimed -> sending -> sent / failed. A claimed row is
+    held by a worker that may still be waiting for its rate limit; it only
+    becomes "sending" right before the SMTP transaction (mark_sending). A
+    transient error puts the row back to pending with an exponential
+    backoff (next_attempt); a spent daily quota defers it to the quota reset
+    without counting an attempt. Rows found in "sending" at startup were
+    interrupted mid-send: they are never retried, so that no message can go
+    out twice. Rows found in "claimed" were never attempted and go back to
+    pending.
+    """
+
+    def __init__(self, filepath="outbox.db", max_attempts=5, base_delay=30, max_delay=3600):
+        self.filepath = filepath
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = logging.getLogger(__name__)
+        # Batches a campaign is draining itself, left alone by other drains
+        self._held_batches = set()
+        self._held_lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filepath, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    uuid TEXT NOT NULL,
+                    batch TEXT,
+                    email TEXT NOT NULL,
+                    variable TEXT,
+                    subject TEXT,
+                    content TEXT,
+                    smtp_server TEXT,
+                    smtp_port TEXT,
+                    username TEXT,
+                    message_id TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created TEXT
+                )
+            """)
+            columns = [r["name"] for r in conn.execute("PRAGMA table_info(outbox)")]
+            if "message_id" not in columns:
+                # Outboxes created before Message-IDs were assigned up front
+                conn.execute("ALTER TABLE outbox ADD COLUMN message_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_batch ON outbox (batch, status)")
+        finally:
+            conn.close()
+
+    def enqueue_many(self, messages, smtp_settings, batch=None):
+        """
+        Adds rendered messages to the queue.
+
+        Args:
+            messages (list): dicts with email, variable, subject, content and
+                optionally uuid and message_id (generated when missing, and
+                kept across retries).
+            smtp_settings (dict): smtp_server, smtp_port, username (the
+                password is never stored).
+            batch (str): Optional batch id, used to cancel a campaign.
+
+        Returns:
+            list: The uuids of the queued messages.
+        """
+        now = datetime.now().isoformat()
+        rows = []
+        for m in messages:
+            rows.append((m.get("uuid") or str(uuid.uuid4()), batch, m["email"], m.get("variable", ""),
+                         m.get("subject", ""), m.get("content", ""), smtp_settings["smtp_server"],
+                         str(smtp_settings["smtp_port"]), smtp_settings["username"],
+                         m.get("message_id") or make_message_id(smtp_settings["username"]), now))
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany("""
+                INSERT INTO outbox (uuid, batch, email, variable, subject, content, smtp_server, smtp_port, username, message_id, created)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return [r[0] for r in rows]
+
+    def enqueue(self, email, variable, subject, content, smtp_settings, uuid_str=None, batch=None):
+        return self.enqueue_many([{"email": email, "variable": variable, "subject": subject,
+                                   "content": content, "uuid": uuid_str}], smtp_settings, batch)[0]
+
+    def hold_batch(self, batch):
+        """Reserves a batch to the caller: claims without a batch skip it until release_batch()."""
+        with self._held_lock:
+            self._held_batches.add(batch)
+
+    def release_batch(self, batch):
+        with self._held_lock:
+            self._held_batches.discard(batch)
+
+    def claim(self, limit=1, usernames=None, batch=None):
+        """
+        Atomically moves up to `limit` due rows to "claimed" and returns them.
+        Without `batch`, rows of held batches are skipped.
+        """
+        query = "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt <= ?"
+        params = [time.time()]
+        if batch is not None:
+            query += " AND batch = ?"
+            params.append(batch)
+        else:
+            with self._held_lock:
+                held = list(self._held_batches)
+            if held:
+                query += f" AND (batch IS NULL OR batch NOT IN ({','.join('?' * len(held))}))"
+                params.extend(held)
+        if usernames is not None:
+            if not usernames:
+                return []
+            query += f" AND username IN ({','.join('?' * len(usernames))})"
+            params.extend(usernames)
+        query += " ORDER BY next_attempt, id LIMIT ?"
+        params.append(limit)
+
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = [dict(r) for r in conn.execute(query, params)]
+            conn.executemany("UPDATE outbox SET status = 'claimed' WHERE id = ?", [(r["id"],) for r in rows])
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return rows
+
+    def mark_sending(self, row):
+        """
+        Flags a claimed row as handed to the SMTP server. Call it right before
+        the transaction: from then on a crash leaves the outcome unknown.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE outbox SET status = 'sending' WHERE id = ? AND status = 'claimed'", (row["id"],))
+        finally:
+            conn.close()
+
+    def mark_sent(self, row):
+        self._update(row, "sent", None)
+
+    def mark_failed(self, row, error):
+        self._update(row, "failed", error)
+
+    def mark_retry(self, row):
+        """
+        Schedules a new attempt after a transient error.
+
+        Returns False (and leaves the row untouched) once max_attempts is
+        reached: the caller must then mark it as failed.
+        """
+        if row["attempts"] >= self.max_attempts:
+            return False
+        delay = min(self.max_delay, self.base_delay * (2 ** (row["attempts"] - 1)))
+        delay *= random.uniform(0.8, 1.2)
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE outbox SET status = 'pending', attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                         (row["attempts"], time.time() + delay, row.get("last_error"), row["id"]))
+        finally:
+            conn.close()
+        return True
+
+    def defer(self, row, until):
+        """
+        Puts a row that was not attempted (daily quota spent, or stopped
+        before sending) back to pending until `until` (epoch seconds),
+        without counting an attempt.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE outbox SET status = 'pending', next_attempt = ?, last_error = ? WHERE id = ?",
+                         (until, row.get("last_error"), row["id"]))
+        finally:
+            conn.close()
+
+    def settle(self, row, error, is_transient):
+        """
+        Records the outcome of a delivery attempt.
+
+        Returns:
+            bool: True when the outcome is final (sent, or failed for good),
+            False when the message was rescheduled.
+        """
+        if isinstance(error, QuotaExceededError) and error.retry_at:
+            row["last_error"] = str(error)
+            self.defer(row, error.retry_at)
+            self.logger.info(f"Daily quota spent, {row['email']} deferred to {datetime.fromtimestamp(error.retry_at)}")
+            return False
+        if isinstance(error, SendInterruptedError):
+            # Stopped while waiting for the rate limit: due again right away
+            row["last_error"] = str(error)
+            self.defer(row, time.time())
+            return False
+        row["attempts"] += 1
+        if error is None:
+            self.mark_sent(row)
+            return True
+        row["last_error"] = str(error)
+        if is_transient(error) and self.mark_retry(row):
+            self.logger.warning(f"Transient error for {row['email']} (attempt {row['attempts']}): {error}")
+            return False
+        self.mark_failed(row, str(error))
+        return True
+
+    def _update(self, row, status, error):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE outbox SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                         (status, row["attempts"], error, row["id"]))
+        finally:
+            conn.close()
+
+    def recover_interrupted(self):
+        """
+        Returns the rows left in "sending" by a crash, marked as failed.
+
+        Whether the server accepted them is unknown, so they are not retried.
+        Rows left in "claimed" never reached the server: they go back to
+        pending.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = [dict(r) for r in conn.execute("SELECT * FROM outbox WHERE status = 'sending'")]
+            conn.execute("UPDATE outbox SET status = 'failed', last_error = 'Envoi interrompu' WHERE status = 'sending'")
+            conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'claimed'")
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return rows
+
+    def cancel_batch(self, batch):
+        """
+        Drops the messages of a batch that have not been sent yet, including
+        those waiting for a retry.
+
+        Returns:
+            list: The dropped rows, for the caller to record.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = [dict(r) for r in conn.execute("SELECT * FROM outbox WHERE batch = ? AND status = 'pending'", (batch,))]
+            conn.execute("DELETE FROM outbox WHERE batch = ? AND status = 'pending'", (batch,))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return rows
+
+    def pending_accounts(self):
+        """Returns the distinct usernames that still have messages to send."""
+        conn = self._connect()
+        try:
+            return [r[0] for r in conn.execute("SELECT DISTINCT username FROM outbox WHERE status = 'pending'")]
+        finally:
+            conn.close()
+
+    def purge_done(self):
+        """Deletes sent and failed rows (their outcome is kept in the history)."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed')")
+        finally:
+            conn.close()
+
+    def drain(self, deliver, is_transient, workers=4, on_result=None, stop_event=None, usernames=None, batch=None):
+        """
+        Sends every due message with `workers` threads, then returns.
+
+        Args:
+            deliver (callable): deliver(row) sends the message, raising on
+                error. It calls mark_sending(row) right before the SMTP
+                transaction, once any rate-limit wait is over.
+            is_transient (callable): is_transient(exc) tells retryable errors apart.
+            workers (int): Number of sending threads.
+            on_result (callable): on_result(row, success, message, final); final
+                is False when the message was put back for a later retry.
+            stop_event (threading.Event): Stops claiming new messages when set.
+            usernames (list): Only drain messages of these accounts.
+            batch (str): Only drain messages of this batch.
+        """
+        def worker():
+            while stop_event is None or not stop_event.is_set():
+                rows = self.claim(1, usernames, batch)
+                if not rows:
+                    return
+                row = rows[0]
+                try:
+                    deliver(row)
+                    error = None
+                except Exception as e:
+                    error = e
+                final = self.settle(row, error, is_transient)
+                if on_result:
+                    if error is None:
+                        on_result(row, True, "Email envoyé avec succès", final)
+                    else:
+                        on_result(row, False, str(error), final)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, int(workers)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
@@ -18,14 +18,21 @@ class ProfileManager:
         except (json.JSONDecodeError, FileNotFoundError):
             return {}
 
-    def save_profile(self, profile_name, smtp_server, smtp_port, imap_server, username, password):
+    def save_profile(self, profile_name, smtp_server, smtp_port, imap_server, username, password,
+                     rate_per_minute=0, rate_per_day=0, burst=1, imap_folders=None):
         profiles = self.load_profiles()
         profiles[profile_name] = {
             "smtp_server": smtp_server,
             "smtp_port": smtp_port,
             "imap_server": imap_server,
             "username": username,
-            "password": password
+            "password": password,
+            # Sending limits (0 = unlimited)
+            "rate_per_minute": rate_per_minute,
+            "rate_per_day": rate_per_day,
+            "burst": burst,
+            # Folders checked for replies
+            "imap_folders": imap_folders or ["INBOX"]
         }
         with open(self.filepath, 'w') as f:
             json.dump(profiles, f, indent=4)
@@ -34,5 +41,15 @@ class ProfileManager:
         profiles = self.load_profiles()
         return profiles.get(profile_name)
 
+    def get_rate_limits(self, profile_name):
+        profile = self.get_profile(profile_name) or {}
+        return (profile.get("rate_per_minute", 0),
+                profile.get("rate_per_day", 0),
+                profile.get("burst", 1))
+
+    def get_imap_folders(self, profile_name):
+        profile = self.get_profile(profile_name) or {}
+        return profile.get("imap_folders") or ["INBOX"]
+
     def get_profile_names(self):
         return list(self.load_profiles().keys())
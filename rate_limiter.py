@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """Takes one token. Returns 0 on success, else the seconds to wait."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Per-account sending limits: a token bucket for msgs/minute (with burst)
+    and a daily quota whose counter is persisted across restarts.
+
+    A limit of 0 (or None) means unlimited. The counters are written to
+    disk on every change, so that a crash cannot lose sends already made
+    and let the daily cap be exceeded after a restart.
+    """
+
+    def __init__(self, filepath="quotas.json"):
+        self.filepath = filepath
+        self._limits = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._usage = self._load()
+        self._unsaved = 0
+
+    def _load(self):
+        try:
+            with open(self.filepath, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return {}
+
+    def _save(self, usage):
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(usage, f, indent=4)
+        os.replace(tmp_path, self.filepath)
+
+    def _flush(self):
+        """Writes the daily counters to disk if they changed since the last write."""
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved:
+                    return
+                usage = {key: dict(value) for key, value in self._usage.items()}
+                self._unsaved = 0
+            # Written outside the lock: sends are not held up by the file I/O
+            self._save(usage)
+
+    def set_limits(self, key, per_minute=0, per_day=0, burst=1):
+        per_minute = int(per_minute or 0)
+        per_day = int(per_day or 0)
+        burst = int(burst or 1)
+        with self._lock:
+            limits = (per_minute, per_day, burst)
+            if self._limits.get(key) == limits:
+                return
+            self._limits[key] = limits
+            if per_minute > 0:
+                self._buckets[key] = TokenBucket(per_minute, burst)
+            else:
+                self._buckets.pop(key, None)
+
+    def _today_usage(self, key):
+        today = date.today().isoformat()
+        usage = self._usage.get(key)
+        if not usage or usage.get("day") != today:
+            usage = {"day": today, "sent": 0}
+            self._usage[key] = usage
+        return usage
+
+    def next_reset(self):
+        """Returns when the daily quotas start over (epoch seconds, next local midnight)."""
+        return datetime.combine(date.today() + timedelta(days=1), datetime.min.time()).timestamp()
+
+    def remaining_today(self, key):
+        """Returns the messages still allowed today, or None when unlimited."""
+        with self._lock:
+            per_day = self._limits.get(key, (0, 0, 1))[1]
+            if per_day <= 0:
+                return None
+            return max(0, per_day - self._today_usage(key)["sent"])
+
+    def try_acquire(self, key):
+        """
+        Reserves one send for `key` without blocking.
+
+        Returns:
+            tuple: (True, 0) when the send may go now, (False, seconds) when
+            the per-minute bucket is empty, (False, None) when the daily
+            quota is exhausted.
+        """
+        with self._lock:
+            per_minute, per_day, burst = self._limits.get(key, (0, 0, 1))
+            usage = self._today_usage(key)
+            if per_day > 0 and usage["sent"] >= per_day:
+                return False, None
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                wait = bucket.try_take()
+                if wait > 0:
+                    return False, wait
+            usage["sent"] += 1
+            self._unsaved += 1
+        self._flush()
+        return True, 0
+
+    def refund(self, key):
+        """Gives back a send reserved by try_acquire() that never reached the server."""
+        with self._lock:
+            usage = self._today_usage(key)
+            if usage["sent"] <= 0:
+                return
+            usage["sent"] -= 1
+            self._unsaved += 1
+        self._flush()
+
+    def acquire(self, key, stop_event=None):
+        """
+        Blocks until a send is allowed. Returns False if the daily quota is
+        reached or `stop_event` gets set while waiting.
+        """
+        while True:
+            ok, wait = self.try_acquire(key)
+            if ok:
+                return True
+            if wait is None:
+                return False
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
@@ -1,74 +1,741 @@
+import base64
+import binascii
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import imaplib
+import itertools
 import email
+import hashlib
+import multiprocessing
 from email.header import decode_header
 from datetime import datetime, timedelta
+import json
 import logging
+import os
+import re
+import select
+import shutil
+import threading
+import time
+
+# Several checkers (accounts / folders) may update the sync state file at once
+_state_lock = threading.Lock()
+
+# Senders OR-ed in a single SEARCH; above MAX_SEARCH_SENDERS one date-only
+# search is made and senders are matched locally
+SEARCH_CHUNK_SIZE = 50
+MAX_SEARCH_SENDERS = 500
+FETCH_BATCH_SIZE = 100
+
+IMAP_TIMEOUT = 60
+
+# Syncs that retry a message which could not be read before giving up on it
+FAILED_UID_RETRIES = 3
+
+# Headers read to discover replies, before any body is downloaded
+HEADER_FIELDS = "(FROM DATE SUBJECT MESSAGE-ID IN-REPLY-TO REFERENCES CONTENT-TYPE)"
+MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+# Delivery status notifications come from the MTA, not from the recipient
+BOUNCE_SEARCH = 'OR OR FROM "mailer-daemon" FROM "postmaster" HEADER Content-Type "report"'
+
+# Untagged responses announcing new mail while in IDLE
+IDLE_NEW_MAIL_RE = re.compile(rb"\* \d+ (EXISTS|RECENT)", re.IGNORECASE)
+
+# Replies above MAX_MESSAGE_SIZE are not downloaded whole: only the first
+# PREVIEW_BYTES of their text part are fetched, and attachments are streamed
+# to the spool directory SPOOL_CHUNK_SIZE bytes at a time
+MAX_MESSAGE_SIZE = 5 * 1024 * 1024
+PREVIEW_BYTES = 64 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# Replies are parsed in worker processes (MIME decoding and HTML-to-text are
+# CPU-bound) once a sync downloads at least PARSE_POOL_MIN_MESSAGES of them;
+# below that, starting the pool costs more than it saves
+PARSE_POOL_MIN_MESSAGES = 20
+
+_IMAP_TOKEN_RE = re.compile(rb'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+')
+
+_IMAP_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def _imap_date(value):
+    # strftime("%b") follows the locale, IMAP wants English month names
+    return f"{value.day:02d}-{_IMAP_MONTHS[value.month - 1]}-{value.year}"
+
+def _imap_quote(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+def _imap_mailbox(folder):
+    """Encodes a folder name for SELECT / STATUS (modified UTF-7, quoted)."""
+    encoded, run = "", ""
+    for ch in folder + "\0":
+        if ch != "\0" and not 0x20 <= ord(ch) <= 0x7e:
+            run += ch
+            continue
+        if run:
+            b64 = base64.b64encode(run.encode("utf-16-be")).decode().rstrip("=").replace("/", ",")
+            encoded += f"&{b64}-"
+            run = ""
+        if ch != "\0":
+            encoded += "&-" if ch == "&" else ch
+    return '"' + _imap_quote(encoded) + '"'
+
+def _parse_imap_list(data):
+    """Parses an IMAP parenthesized list (e.g. a FETCH response) into nested lists of str / None."""
+    stack = [[]]
+    for match in _IMAP_TOKEN_RE.finditer(data):
+        token = match.group()
+        if token == b"(":
+            stack.append([])
+        elif token == b")":
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        elif token.startswith(b'"'):
+            stack[-1].append(re.sub(rb'\\(.)', rb'\1', token[1:-1]).decode("utf-8", errors="replace"))
+        elif token.upper() == b"NIL":
+            stack[-1].append(None)
+        else:
+            stack[-1].append(token.decode("utf-8", errors="replace"))
+    return stack[0]
+
+def _join_literals(msg_data):
+    """Flattens a FETCH response, turning {n} literals into quoted strings."""
+    data = b""
+    for part in msg_data:
+        if isinstance(part, tuple):
+            literal = part[1].replace(b"\\", b"\\\\").replace(b'"', b'\\"')
+            data += re.sub(rb"\{\d+\}$", b"", part[0]) + b'"' + literal + b'"'
+        elif part:
+            data += part
+    return data
+
+def _body_parts(structure, section=""):
+    """Yields (section, part) for each leaf of a parsed BODYSTRUCTURE."""
+    if structure and isinstance(structure[0], list):
+        # multipart: the child bodies come first, then the subtype
+        for i, child in enumerate(itertools.takewhile(lambda item: isinstance(item, list), structure)):
+            yield from _body_parts(child, f"{section}.{i + 1}" if section else str(i + 1))
+        return
+
+    ctype, subtype = (structure[0] or "").lower(), (structure[1] or "").lower()
+    params = structure[2] or []
+    params = {str(params[i]).lower(): params[i + 1] for i in range(0, len(params) - 1, 2)}
+    # Extension data follows the basic fields (7), the line count of text
+    # parts and the envelope/body/lines of message/rfc822 parts
+    disposition_index = 9 if ctype == "text" else 11 if (ctype, subtype) == ("message", "rfc822") else 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    disposition_type, disposition_params = None, {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = (disposition[0] or "").lower()
+        dparams = disposition[1] if len(disposition) > 1 and isinstance(disposition[1], list) else []
+        disposition_params = {str(dparams[i]).lower(): dparams[i + 1] for i in range(0, len(dparams) - 1, 2)}
+    yield section or "1", {
+        "type": f"{ctype}/{subtype}",
+        "charset": params.get("charset") or "utf-8",
+        "encoding": (structure[5] or "7bit").lower(),
+        "size": int(structure[6]) if str(structure[6]).isdigit() else 0,
+        "disposition": disposition_type,
+        "filename": disposition_params.get("filename") or params.get("name"),
+    }
+
+def _decode_transfer(data, encoding):
+    """Decodes a (possibly truncated) Content-Transfer-Encoding payload."""
+    if encoding == "base64":
+        data = re.sub(rb"\s+", b"", data)
+        return base64.b64decode(data[:len(data) - len(data) % 4])
+    if encoding == "quoted-printable":
+        return binascii.a2b_qp(data)
+    return data
+
+class _StreamDecoder:
+    """Decodes a transfer-encoded section fed in arbitrary chunks."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._pending = b""
+
+    def feed(self, chunk):
+        if self.encoding == "base64":
+            data = self._pending + re.sub(rb"\s+", b"", chunk)
+            cut = len(data) - len(data) % 4
+            self._pending = data[cut:]
+            return base64.b64decode(data[:cut])
+        if self.encoding == "quoted-printable":
+            # A soft line break or =XX escape may be split across chunks
+            data = self._pending + chunk
+            cut = data.rfind(b"\n") + 1
+            self._pending = data[cut:]
+            return binascii.a2b_qp(data[:cut])
+        return chunk
+
+    def flush(self):
+        data, self._pending = self._pending, b""
+        return _decode_transfer(data, self.encoding) if data else b""
+
+def _status_blocks(text):
+    """Splits a message/delivery-status body into its header blocks (lower-cased field names)."""
+    blocks = []
+    for chunk in re.split(r"\r?\n\s*\r?\n", text):
+        if chunk.strip():
+            blocks.append({k.lower(): v for k, v in email.message_from_string(chunk.strip() + "\n").items()})
+    return blocks
+
+def _safe_filename(name, default):
+    name = os.path.basename((name or "").replace("\\", "/"))
+    name = re.sub(r'[^\w.\- ]', "_", name).strip(" .")
+    return name or default
+
+def _decode_header_value(value):
+    decoded = ""
+    if value:
+        for part, encoding in decode_header(value):
+            if isinstance(part, bytes):
+                decoded += part.decode(encoding or "utf-8", errors="ignore")
+            else:
+                decoded += str(part)
+    return decoded
+
+def _html_to_text(body_html):
+    import html
+
+    # Basic HTML to text conversion for readability
+    text = html.unescape(body_html)
+    # Replace common block tags with newlines
+    text = re.sub(r'<(br|p|div|h[1-6]|tr|li|blockquote)[^>]*>', '\n', text, flags=re.IGNORECASE)
+    # Remove <style> and <script> blocks completely
+    text = re.sub(r'<(script|style)[^>]*>.*?</\1>', '', text, flags=re.IGNORECASE | re.DOTALL)
+    # Remove all remaining HTML tags
+    text = re.sub(r'<[^>]+>', '', text)
+    # Remove extra blank lines and spaces
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    return text.strip()
+
+def _email_body(msg):
+    body_plain = None
+    body_html = None
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            cdispo = str(part.get('Content-Disposition'))
+
+            # skip any text/plain (txt) attachments
+            if ctype == 'text/plain' and 'attachment' not in cdispo:
+                body_plain = part.get_payload(decode=True).decode('utf-8', errors='ignore')
+            elif ctype == 'text/html' and 'attachment' not in cdispo:
+                body_html = part.get_payload(decode=True).decode('utf-8', errors='ignore')
+    else:
+        ctype = msg.get_content_type()
+        payload = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
+        if ctype == 'text/plain':
+            body_plain = payload
+        elif ctype == 'text/html':
+            body_html = payload
+        else:
+            body_plain = payload
+
+    if body_plain:
+        return body_plain.strip()
+    elif body_html:
+        return _html_to_text(body_html)
+
+    return "Contenu non lisible."
+
+def _clear_spool_dir(directory):
+    # A message fetched again replaces the files of its previous fetch
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def _unique_path(directory, filename):
+    base, ext = os.path.splitext(filename)
+    path, n = os.path.join(directory, filename), 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{base}-{n}{ext}")
+        n += 1
+    return path
+
+def _spool_attachments(msg, directory):
+    attachments = []
+    cleared = False
+    for i, part in enumerate(msg.walk()):
+        if part.is_multipart():
+            continue
+        filename = part.get_filename()
+        if part.get_content_disposition() != "attachment" and not (
+                filename and part.get_content_maintype() != "text"):
+            continue
+        payload = part.get_payload(decode=True) or b""
+        if not cleared:
+            cleared = _clear_spool_dir(directory)
+        name = _safe_filename(_decode_header_value(filename), f"piece-jointe-{i}")
+        path = _unique_path(directory, name)
+        with open(path, 'wb') as f:
+            f.write(payload)
+        attachments.append({"filename": name, "path": path, "size": len(payload)})
+    return attachments
+
+def parse_reply(raw, spool_dir):
+    """
+    Parses a downloaded reply: body text plus attachments written to the
+    spool. Module-level so that it can run in a worker process.
+
+    Args:
+        raw (bytes): The RFC822 message.
+        spool_dir (str): The directory of this message's attachments (see
+            ReplyChecker.message_spool_dir()), emptied first.
+
+    Returns:
+        tuple: (content, attachments)
+    """
+    msg = email.message_from_bytes(raw)
+    return _email_body(msg), _spool_attachments(msg, spool_dir)
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool(max_workers=None):
+    """Returns the process pool shared by all checkers, started on first use."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # "spawn": forking the multi-threaded (Tk) application is unsafe
+            _parse_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+def _discard_parse_pool(pool):
+    """Forgets a broken pool so that the next sync starts a new one."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is pool:
+            _parse_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
 
 class ReplyChecker:
-    def __init__(self, imap_server, email_user, email_pass):
+    def __init__(self, imap_server, email_user, email_pass, state_filepath="imap_state.json",
+                 max_message_size=MAX_MESSAGE_SIZE, spool_dir="attachments", on_bounces=None, parse_workers=None):
         self.imap_server = imap_server
         self.email_user = email_user
         self.email_pass = email_pass
+        self.state_filepath = state_filepath
+        self.max_message_size = max_message_size
+        self.spool_dir = spool_dir
+        # on_bounces(bounces) receives the hard bounces found by sync_folder()
+        self.on_bounces = on_bounces
+        # Size of the parsing process pool (None = one per CPU), 0 to parse in-process
+        self.parse_workers = parse_workers
         self.logger = logging.getLogger(__name__)
 
+    def _state_key(self, folder):
+        return f"{self.email_user}@{self.imap_server}/{folder}"
+
+    def _load_state(self):
+        try:
+            with open(self.state_filepath, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return {}
+
+    def load_checkpoint(self, folder):
+        """
+        Returns {"uidvalidity": int, "last_uid": int, "failed_uids": {uid:
+        failed syncs}} for the folder, or None.
+        """
+        with _state_lock:
+            checkpoint = self._load_state().get(self._state_key(folder))
+        if checkpoint is not None:
+            # JSON object keys are strings
+            checkpoint["failed_uids"] = {int(uid): tries for uid, tries in checkpoint.get("failed_uids", {}).items()}
+        return checkpoint
+
+    def save_checkpoint(self, folder, uidvalidity, last_uid, failed_uids=None):
+        with _state_lock:
+            state = self._load_state()
+            state[self._state_key(folder)] = {"uidvalidity": uidvalidity, "last_uid": last_uid,
+                                              "failed_uids": {str(uid): tries for uid, tries in (failed_uids or {}).items()}}
+            tmp_path = self.state_filepath + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=4)
+            os.replace(tmp_path, self.state_filepath)
+
+    def _mailbox_status(self, mail, folder):
+        """Returns (UIDVALIDITY, UIDNEXT) of the folder, None when unknown."""
+        status, data = mail.status(_imap_mailbox(folder), "(UIDVALIDITY UIDNEXT)")
+        if status != "OK" or not data or not data[0]:
+            return None, None
+        raw = data[0] if isinstance(data[0], bytes) else str(data[0]).encode()
+        validity = re.search(rb"UIDVALIDITY (\d+)", raw)
+        uidnext = re.search(rb"UIDNEXT (\d+)", raw)
+        return (int(validity.group(1)) if validity else None,
+                int(uidnext.group(1)) if uidnext else None)
+
+    def decode_subject(self, value):
+        return _decode_header_value(value)
+
+    def html_to_text(self, body_html):
+        return _html_to_text(body_html)
+
     def get_email_body(self, msg):
-        import re
-        import html
-        
-        body_plain = None
-        body_html = None
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                ctype = part.get_content_type()
-                cdispo = str(part.get('Content-Disposition'))
-
-                # skip any text/plain (txt) attachments
-                if ctype == 'text/plain' and 'attachment' not in cdispo:
-                    body_plain = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                elif ctype == 'text/html' and 'attachment' not in cdispo:
-                    body_html = part.get_payload(decode=True).decode('utf-8', errors='ignore')
+        return _email_body(msg)
+
+    def _sender_index(self, history_entries):
+        """
+        Maps each lower-cased recipient address to its sent entries, newest
+        first, so that a reply is attached to the latest email sent before it.
+        """
+        index = {}
+        for entry in history_entries:
+            if entry.get("status") != "Envoyé":
+                continue
+            recipient_email = entry.get("email")
+            sent_date_str = entry.get("date")
+            if not recipient_email or not sent_date_str:
+                continue
+            try:
+                sent_date = datetime.fromisoformat(sent_date_str)
+            except ValueError:
+                continue
+            index.setdefault(recipient_email.strip().lower(), []).append((sent_date, entry))
+        for sent in index.values():
+            sent.sort(key=lambda item: item[0], reverse=True)
+        return index
+
+    def _message_id_index(self, history_entries):
+        """Maps the Message-ID of each sent entry to the entry."""
+        return {entry["message_id"]: entry for entry in history_entries if entry.get("message_id")}
+
+    def _thread_parent(self, headers, by_message_id):
+        """
+        Returns the history entry the message answers, from its In-Reply-To
+        header, else from the most recent References id we sent, or None.
+        """
+        for msg_id in MESSAGE_ID_RE.findall(headers.get("In-Reply-To") or ""):
+            if msg_id in by_message_id:
+                return by_message_id[msg_id]
+        for msg_id in reversed(MESSAGE_ID_RE.findall(headers.get("References") or "")):
+            if msg_id in by_message_id:
+                return by_message_id[msg_id]
+        return None
+
+    def _search_uids(self, mail, first_uid, since, senders):
+        """
+        Returns the UIDs (>= first_uid) of the messages received SINCE `since`
+        from any of `senders`, with one SEARCH per chunk of senders, plus the
+        bounce notifications. Past MAX_SEARCH_SENDERS a single date-only
+        search is cheaper; the caller matches senders locally anyway.
+        """
+        base = f"UID {first_uid}:* SINCE {_imap_date(since)}"
+        if len(senders) > MAX_SEARCH_SENDERS:
+            searches = [base]
         else:
-            ctype = msg.get_content_type()
-            payload = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
-            if ctype == 'text/plain':
-                body_plain = payload
-            elif ctype == 'text/html':
-                body_html = payload
-            else:
-                body_plain = payload
-
-        if body_plain:
-            return body_plain.strip()
-        elif body_html:
-            # Basic HTML to text conversion for readability
-            text = html.unescape(body_html)
-            # Replace common block tags with newlines
-            text = re.sub(r'<(br|p|div|h[1-6]|tr|li|blockquote)[^>]*>', '\n', text, flags=re.IGNORECASE)
-            # Remove <style> and <script> blocks completely
-            text = re.sub(r'<(script|style)[^>]*>.*?</\1>', '', text, flags=re.IGNORECASE | re.DOTALL)
-            # Remove all remaining HTML tags
-            text = re.sub(r'<[^>]+>', '', text)
-            # Remove extra blank lines and spaces
-            text = re.sub(r'\n\s*\n', '\n\n', text)
-            return text.strip()
-            
-        return "Contenu non lisible."
+            searches = [base + " " + "OR " * (len(chunk) - 1) + " ".join(f'FROM "{_imap_quote(s)}"' for s in chunk)
+                        for chunk in (senders[i:i + SEARCH_CHUNK_SIZE] for i in range(0, len(senders), SEARCH_CHUNK_SIZE))]
+            searches.append(f"{base} {BOUNCE_SEARCH}")
 
-    def check_replies(self, history_entries):
+        uids = set()
+        for criteria in searches:
+            status, data = mail.uid("SEARCH", None, criteria)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"SEARCH failed: {data}")
+            # "N:*" always matches the last message, even when its UID is below N
+            uids.update(int(uid) for uid in data[0].split() if int(uid) >= first_uid)
+        return sorted(uids)
+
+    def _fetch(self, mail, uids, items):
         """
-        Checks for replies in the INBOX for the given history entries.
-        Returns a list of dicts with reply details.
+        Runs UID FETCH for `items`, FETCH_BATCH_SIZE UIDs per round-trip.
+        Yields (uid, size, data) for each message; size is None unless
+        RFC822.SIZE was requested.
         """
-        replies_found = []
-        
+        for i in range(0, len(uids), FETCH_BATCH_SIZE):
+            uid_set = ",".join(str(uid) for uid in uids[i:i + FETCH_BATCH_SIZE])
+            status, msg_data = mail.uid("FETCH", uid_set, items)
+            if status != "OK":
+                raise imaplib.IMAP4.error(f"FETCH failed: {msg_data}")
+            for i, response_part in enumerate(msg_data):
+                if not isinstance(response_part, tuple):
+                    continue
+                # Items may also follow the literal (Exchange: "... BODY[] {n}", then " UID 123)")
+                trailer = msg_data[i + 1] if i + 1 < len(msg_data) and isinstance(msg_data[i + 1], bytes) else b""
+                items_data = response_part[0] + b" " + trailer
+                uid = re.search(rb"\bUID (\d+)", items_data)
+                size = re.search(rb"\bRFC822\.SIZE (\d+)", items_data)
+                yield (int(uid.group(1)) if uid else None,
+                       int(size.group(1)) if size else None,
+                       response_part[1])
+
+    def fetch_headers(self, mail, uids):
+        """Yields (uid, size, headers) without downloading nor flagging the bodies."""
+        for uid, size, data in self._fetch(mail, uids, f"(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS {HEADER_FIELDS}])"):
+            yield uid, size, email.message_from_bytes(data)
+
+    def fetch_messages(self, mail, uids):
+        """Downloads the full messages. Returns {uid: email.message.Message}."""
+        return {uid: email.message_from_bytes(data) for uid, data in self.fetch_raw(mail, uids)}
+
+    def fetch_raw(self, mail, uids):
+        """Yields (uid, raw RFC822 bytes) as each FETCH batch arrives."""
+        for uid, _, data in self._fetch(mail, uids, "(UID RFC822)"):
+            yield uid, data
+
+    def parse_replies(self, fetched, count, folder="inbox", uidvalidity=None):
+        """
+        Parses downloaded replies with parse_reply().
+
+        From PARSE_POOL_MIN_MESSAGES replies on, each message is handed to
+        the worker processes as soon as its FETCH batch arrives, so parsing
+        overlaps with the download of the next batches instead of waiting
+        for it on the same core.
+
+        Args:
+            fetched (iterable): (uid, raw bytes) pairs, e.g. from fetch_raw().
+            count (int): Number of messages expected from `fetched`.
+            folder (str): Folder the messages come from.
+            uidvalidity (int): UIDVALIDITY of that folder.
+
+        Returns:
+            dict: {uid: (content, attachments)}, or {uid: Exception} for a
+            message that could not be parsed.
+        """
+        results = {}
+        pool = None
+        if self.parse_workers != 0 and count >= PARSE_POOL_MIN_MESSAGES:
+            try:
+                pool = _get_parse_pool(self.parse_workers)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Parsing process pool unavailable, parsing in-process: {e}")
+
+        pending = []
+        for uid, raw in fetched:
+            spool_dir = self.message_spool_dir(folder, uidvalidity, uid)
+            if pool is not None:
+                try:
+                    pending.append((uid, raw, pool.submit(parse_reply, raw, spool_dir)))
+                    continue
+                except (BrokenProcessPool, RuntimeError) as e:
+                    self.logger.warning(f"Parsing process pool failed, parsing in-process: {e}")
+                    _discard_parse_pool(pool)
+                    pool = None
+            try:
+                results[uid] = parse_reply(raw, spool_dir)
+            except Exception as e:
+                results[uid] = e
+
+        for uid, raw, future in pending:
+            try:
+                results[uid] = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (killed, out of memory): redo the message here
+                if pool is not None:
+                    self.logger.warning(f"Parsing process pool failed, parsing in-process: {e}")
+                    _discard_parse_pool(pool)
+                    pool = None
+                try:
+                    results[uid] = parse_reply(raw, self.message_spool_dir(folder, uidvalidity, uid))
+                except Exception as e:
+                    results[uid] = e
+            except Exception as e:
+                results[uid] = e
+        return results
+
+    def connect(self, folder="inbox", timeout=IMAP_TIMEOUT):
+        """Opens an authenticated IMAP connection with `folder` selected (none when None)."""
+        mail = imaplib.IMAP4_SSL(self.imap_server, timeout=timeout)
         try:
-            mail = imaplib.IMAP4_SSL(self.imap_server)
             mail.login(self.email_user, self.email_pass)
-            mail.select("inbox")
-        except Exception as e:
-            self.logger.error(f"IMAP Connection Error: {e}")
+            if folder is not None:
+                self.select_folder(mail, folder)
+        except Exception:
+            try:
+                mail.logout()
+            except Exception:
+                pass
+            raise
+        return mail
+
+    def message_spool_dir(self, folder, uidvalidity, uid):
+        """
+        Returns the directory holding the attachments of one message. It is
+        keyed on the account, folder, UIDVALIDITY and UID, so that fetching
+        the same message again replaces its files instead of adding copies.
+        """
+        key = f"{self.email_user}\0{folder}\0{uidvalidity}\0{uid}"
+        return os.path.join(self.spool_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _unique_path(self, directory, filename):
+        return _unique_path(directory, filename)
+
+    def fetch_bodystructure(self, mail, uid):
+        status, msg_data = mail.uid("FETCH", str(uid), "(BODYSTRUCTURE)")
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"FETCH BODYSTRUCTURE failed: {msg_data}")
+        response = _parse_imap_list(_join_literals(msg_data))
+        for item in response:
+            if isinstance(item, list) and "BODYSTRUCTURE" in item:
+                return item[item.index("BODYSTRUCTURE") + 1]
+        raise imaplib.IMAP4.error(f"No BODYSTRUCTURE for UID {uid}")
+
+    def fetch_section(self, mail, uid, section, offset, length):
+        """Fetches `length` raw bytes of a body section from `offset`, without setting \\Seen."""
+        for _, _, data in self._fetch(mail, [uid], f"(UID BODY.PEEK[{section}]<{offset}.{length}>)"):
+            return data
+        # An empty range comes back as "" instead of a literal
+        return b""
+
+    def _spool_section(self, mail, uid, section, part, directory, default_name):
+        """Streams one attachment to disk, SPOOL_CHUNK_SIZE bytes per FETCH."""
+        name = _safe_filename(self.decode_subject(part["filename"]), default_name)
+        path = self._unique_path(directory, name)
+        decoder = _StreamDecoder(part["encoding"])
+        offset = 0
+        with open(path, 'wb') as f:
+            while True:
+                chunk = self.fetch_section(mail, uid, section, offset, SPOOL_CHUNK_SIZE)
+                f.write(decoder.feed(chunk))
+                offset += len(chunk)
+                if len(chunk) < SPOOL_CHUNK_SIZE:
+                    break
+            f.write(decoder.flush())
+        return {"filename": name, "path": path, "size": os.path.getsize(path)}
+
+    def fetch_large_reply(self, mail, uid, size, directory):
+        """
+        Reads a reply above max_message_size without downloading it whole:
+        a preview of its first text part and its attachments streamed to
+        `directory` (see message_spool_dir()).
+
+        Returns:
+            tuple: (content, attachments)
+        """
+        parts = list(_body_parts(self.fetch_bodystructure(mail, uid)))
+        inline_text = [(section, part) for section, part in parts
+                       if part["type"] in ("text/plain", "text/html") and part["disposition"] != "attachment"]
+        text_part = next((p for p in inline_text if p[1]["type"] == "text/plain"), None) or next(iter(inline_text), None)
+
+        content = "Contenu non lisible."
+        if text_part:
+            section, part = text_part
+            raw = self.fetch_section(mail, uid, section, 0, PREVIEW_BYTES)
+            text = _decode_transfer(raw, part["encoding"]).decode(part["charset"], errors="ignore")
+            content = self.html_to_text(text) if part["type"] == "text/html" else text.strip()
+            if part["size"] > PREVIEW_BYTES:
+                content += "\n\n[…] Aperçu tronqué"
+        content += f"\n\n(Message volumineux : {size / (1024 * 1024):.1f} Mo, non téléchargé en entier.)"
+
+        attachments = []
+        for i, (section, part) in enumerate(parts):
+            if (section, part) in inline_text:
+                continue
+            if not attachments:
+                _clear_spool_dir(directory)
+            attachments.append(self._spool_section(mail, uid, section, part, directory, f"piece-jointe-{i}"))
+        return content, attachments
+
+    def read_dsn(self, msg):
+        """
+        Returns (status blocks, original headers) of a multipart/report
+        message; the original headers come from its message/rfc822 or
+        text/rfc822-headers part, or are None.
+        """
+        blocks, original = [], None
+        for part in msg.walk():
+            ctype = part.get_content_type()
+            if ctype == "message/delivery-status" and not blocks:
+                blocks = [{k.lower(): v for k, v in block.items()} for block in part.get_payload()]
+            elif ctype == "message/rfc822" and original is None:
+                payload = part.get_payload()
+                original = payload[0] if payload else None
+            elif ctype == "text/rfc822-headers" and original is None:
+                original = email.message_from_bytes(part.get_payload(decode=True) or b"")
+        return blocks, original
+
+    def fetch_large_dsn(self, mail, uid):
+        """Same as read_dsn() for a report above max_message_size, without downloading it whole."""
+        blocks, original = [], None
+        for section, part in _body_parts(self.fetch_bodystructure(mail, uid)):
+            if part["type"] == "message/delivery-status" and not blocks:
+                raw = _decode_transfer(self.fetch_section(mail, uid, section, 0, PREVIEW_BYTES), part["encoding"])
+                blocks = _status_blocks(raw.decode("utf-8", errors="replace"))
+            elif part["type"] == "message/rfc822" and original is None:
+                original = email.message_from_bytes(self.fetch_section(mail, uid, f"{section}.HEADER", 0, PREVIEW_BYTES))
+            elif part["type"] == "text/rfc822-headers" and original is None:
+                raw = _decode_transfer(self.fetch_section(mail, uid, section, 0, PREVIEW_BYTES), part["encoding"])
+                original = email.message_from_bytes(raw)
+        return blocks, original
+
+    def hard_bounces(self, blocks, original, by_message_id, senders, date_iso):
+        """
+        Returns the permanent failures (Action: failed, Status: 5.x.x) of a
+        DSN as bounce dicts, matched to the history entry of the original
+        email through its Message-ID, else to the latest email sent to the
+        failed address.
+        """
+        original_id = (original.get("Message-ID") or "").strip() if original is not None else ""
+        parent = by_message_id.get(original_id)
+        bounces = []
+        for block in blocks:
+            recipient = block.get("final-recipient") or block.get("original-recipient")
+            status = (block.get("status") or "").strip()
+            if not recipient or (block.get("action") or "").strip().lower() != "failed" or not status.startswith("5"):
+                continue
+            address = recipient.split(";", 1)[-1].strip().strip("<>").lower()
+            entry = parent if parent is not None and (parent.get("email") or "").strip().lower() == address else None
+            if entry is None and senders.get(address):
+                entry = senders[address][0][1]
+            bounces.append({
+                "uuid": entry.get("uuid") if entry else None,
+                "email": address,
+                "status": status,
+                "diagnostic": " ".join((block.get("diagnostic-code") or "").split()),
+                "date": date_iso
+            })
+        return bounces
+
+    def select_folder(self, mail, folder):
+        status, data = mail.select(_imap_mailbox(folder))
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"SELECT {folder} failed: {data}")
+
+    def sync_folder(self, mail, history_entries, folder="inbox"):
+        """
+        Returns the new replies in `folder`, which must be selected on `mail`.
+
+        Only messages newer than the last checkpoint (UID + UIDVALIDITY,
+        persisted per account and folder) are searched and downloaded. A
+        full rescan happens on the first run or when UIDVALIDITY changes.
+        A message that cannot be read does not hold the checkpoint back: its
+        UID is kept in the checkpoint and retried alone by the next
+        FAILED_UID_RETRIES syncs.
+        All recipients are looked up with one batched SEARCH and the results
+        are matched to entries locally, so the number of round-trips depends
+        on the new mail, not on the size of the history. A reply is matched
+        to the email it answers through In-Reply-To / References when that
+        email's Message-ID is known, by sender and date otherwise.
+        """
+        replies_found = []
+
+        senders = self._sender_index(history_entries)
+        by_message_id = self._message_id_index(history_entries)
+        if not senders:
             return []
+
+        uidvalidity, uidnext = self._mailbox_status(mail, folder)
+
+        checkpoint = self.load_checkpoint(folder)
+        if checkpoint and uidvalidity is not None and checkpoint.get("uidvalidity") == uidvalidity:
+            first_uid = checkpoint.get("last_uid", 0) + 1
+            retry_uids = checkpoint["failed_uids"]
+        else:
+            if checkpoint:
+                self.logger.info(f"UIDVALIDITY changed for {folder}: full rescan")
+            first_uid = 1
+            retry_uids = {}
+        # Errors on the whole folder (SEARCH, FETCH) keep the checkpoint
+        # where it is; errors on one message only retry that message
+        had_errors = False
+        failed_uids = set()
+        highest_uid = first_uid - 1
             
         # Build a global set of existing replies to prevent the same reply
         # from being attached to multiple history entries for the same recipient.
@@ -80,84 +747,270 @@ class ReplyChecker:
                 
         # We also need to keep track of replies we just found in this run
         new_replies_keys = set()
-        
-        # Sort or process in reverse so we try connecting the reply to the most recent sent email first
-        for entry in reversed(history_entries):
-            # We skip drafts/failures. We don't skip if already replied, 
-            # because there might be multiple replies or a newer one, 
-            # though for simplicity we only checked unreplied previously.
-            # Let's check all Sent emails to catch late replies or multiple replies 
-            # (assuming we track which ones we already downloaded, but for now we'll just get the latest).
-            if entry.get("status") != "Envoyé":
-                continue
 
-            recipient_email = entry.get("email")
-            sent_date_str = entry.get("date")
-            
-            if not recipient_email or not sent_date_str:
-                continue
+        # SINCE only has a day granularity (in the server's timezone): keep a day of margin
+        oldest_sent = min(sent[-1][0] for sent in senders.values()) - timedelta(days=1)
 
-            try:
-                sent_date = datetime.fromisoformat(sent_date_str)
-            except ValueError:
-                continue
+        try:
+            uids = self._search_uids(mail, first_uid, oldest_sent, sorted(senders))
+            if uids:
+                highest_uid = uids[-1]
+            # Below first_uid: they matched the search when they failed
+            uids = sorted(retry_uids) + uids
 
-            try:
-                status, messages = mail.search(None, f'(FROM "{recipient_email}")')
-                if status != "OK":
-                    continue
-                
-                msg_ids = messages[0].split()
-                if not msg_ids:
+            # Discovery only reads a few headers; bodies are downloaded
+            # afterwards, for the replies that are actually new
+            candidates = []
+            reports = []
+            for uid, size, headers in self.fetch_headers(mail, uids):
+                try:
+                    if not headers["Date"]:
+                        continue
+                    date_tuple = email.utils.parsedate_tz(headers["Date"])
+                    if not date_tuple:
+                        continue
+                    msg_date = datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
+                    msg_date_iso = msg_date.isoformat()
+
+                    # Bounces may quote our Message-ID: never take them for replies
+                    if headers.get_content_type() == "multipart/report":
+                        reports.append((uid, size, msg_date_iso))
+                        continue
+
+                    # Exact match through the thread headers; fall back to
+                    # the most recent email sent to the sender before the reply
+                    entry = self._thread_parent(headers, by_message_id)
+                    if entry is None:
+                        sender = email.utils.parseaddr(headers.get("From", ""))[1].lower()
+                        entry = next((e for sent_date, e in senders.get(sender, ()) if msg_date > sent_date), None)
+                    if entry is None:
+                        continue
+                    recipient_email = entry.get("email")
+                    reply_key = (recipient_email, msg_date_iso)
+                    if reply_key in global_existing_replies or reply_key in new_replies_keys:
+                        continue
+                    new_replies_keys.add(reply_key)
+
+                    candidates.append((uid, {
+                        "uuid": entry.get("uuid"),
+                        "date": msg_date_iso,
+                        "email": recipient_email,
+                        "subject": self.decode_subject(headers["Subject"]),
+                        "message_id": (headers["Message-ID"] or "").strip() or None,
+                        "size": size
+                    }))
+                except Exception as e:
+                    self.logger.error(f"Error reading headers of UID {uid}: {e}")
+                    failed_uids.add(uid)
+
+            # Newest replies first, like the per-recipient loop used to do
+            candidates.sort(key=lambda item: item[0], reverse=True)
+            small = [uid for uid, reply in candidates if not reply["size"] or reply["size"] <= self.max_message_size]
+            parsed = self.parse_replies(self.fetch_raw(mail, small), len(small), folder, uidvalidity)
+            for uid, reply_dict in candidates:
+                try:
+                    if uid in parsed:
+                        if isinstance(parsed[uid], Exception):
+                            raise parsed[uid]
+                        reply_dict["content"], attachments = parsed[uid]
+                    elif uid in small:
+                        self.logger.error(f"UID {uid} disappeared before its body was downloaded")
+                        failed_uids.add(uid)
+                        continue
+                    else:
+                        reply_dict["content"], attachments = self.fetch_large_reply(
+                            mail, uid, reply_dict["size"], self.message_spool_dir(folder, uidvalidity, uid))
+                        reply_dict["truncated"] = True
+                except Exception as e:
+                    self.logger.error(f"Error downloading UID {uid}: {e}")
+                    failed_uids.add(uid)
                     continue
-                
-                # We need to find replies that we haven't already saved.
-                # The history entry might have a list of 'replies'.
-                
-                for msg_id in reversed(msg_ids):
-                    res, msg_data = mail.fetch(msg_id, "(RFC822)")
-                    for response_part in msg_data:
-                        if isinstance(response_part, tuple):
-                            msg = email.message_from_bytes(response_part[1])
-                            
-                            if msg["Date"]:
-                                date_tuple = email.utils.parsedate_tz(msg["Date"])
-                                if date_tuple:
-                                    msg_date = datetime.fromtimestamp(email.utils.mktime_tz(date_tuple))
-                                    msg_date_iso = msg_date.isoformat()
-                                    
-                                    reply_key = (recipient_email, msg_date_iso)
-                                    
-                                    if msg_date > sent_date and reply_key not in global_existing_replies and reply_key not in new_replies_keys:
-                                        # Decode Subject
-                                        subject = ""
-                                        if msg["Subject"]:
-                                            for part_subj, part_enc in decode_header(msg["Subject"]):
-                                                if isinstance(part_subj, bytes):
-                                                    subject += part_subj.decode(part_enc or "utf-8", errors="ignore")
-                                                else:
-                                                    subject += str(part_subj)
-                                        
-                                        body = self.get_email_body(msg)
-                                        
-                                        reply_dict = {
-                                            "uuid": entry.get("uuid"),
-                                            "date": msg_date_iso,
-                                            "email": recipient_email,
-                                            "subject": subject,
-                                            "content": body
-                                        }
-                                        replies_found.append(reply_dict)
-                                        new_replies_keys.add(reply_key)
-                                        # We append it, but we continue processing other msg_ids to get ALL new replies
+                if attachments:
+                    reply_dict["attachments"] = attachments
+                replies_found.append(reply_dict)
+
+            bounces = []
+            small = [uid for uid, size, _ in reports if not size or size <= self.max_message_size]
+            messages = self.fetch_messages(mail, small)
+            for uid, size, date_iso in reports:
+                try:
+                    if uid in messages:
+                        blocks, original = self.read_dsn(messages[uid])
+                    elif uid in small:
+                        self.logger.error(f"UID {uid} disappeared before its body was downloaded")
+                        failed_uids.add(uid)
+                        continue
+                    else:
+                        blocks, original = self.fetch_large_dsn(mail, uid)
+                    bounces.extend(self.hard_bounces(blocks, original, by_message_id, senders, date_iso))
+                except Exception as e:
+                    self.logger.error(f"Error reading delivery report UID {uid}: {e}")
+                    failed_uids.add(uid)
+            if bounces and self.on_bounces:
+                self.on_bounces(bounces)
+        except Exception as e:
+            self.logger.error(f"Error checking replies in {folder}: {e}")
+            had_errors = True
+
+        # Advance the checkpoint unless the folder itself failed, so nothing is skipped
+        if not had_errors and uidvalidity is not None:
+            # UIDNEXT may be stale next to the UIDs the SEARCH just returned
+            last_uid = max(uidnext - 1 if uidnext else 0, highest_uid, first_uid - 1)
+            failed = {}
+            for uid in failed_uids - {None}:
+                tries = retry_uids.get(uid, 0) + 1
+                if tries < FAILED_UID_RETRIES:
+                    failed[uid] = tries
+                else:
+                    self.logger.warning(f"UID {uid} in {folder} still unreadable after {tries} syncs, skipped")
+            self.save_checkpoint(folder, uidvalidity, last_uid, failed)
+
+        return replies_found
+
+
+class ReplyWatcher:
+    """
+    Background thread holding one IMAP connection in IDLE.
+
+    New replies are pushed to `on_replies(replies)` (called from the watcher
+    thread) as soon as the server announces new mail. IDLE is renewed, with
+    a sync, every `idle_timeout` seconds (servers drop it after 30 minutes)
+    and the connection is reopened with a growing delay after a failure.
+    Servers without IDLE are polled every `poll_interval` seconds instead.
+    """
+
+    def __init__(self, checker, get_history, on_replies, folder="inbox",
+                 idle_timeout=29 * 60, poll_interval=60, max_reconnect_delay=300):
+        self.checker = checker
+        self.get_history = get_history
+        self.on_replies = on_replies
+        self.folder = folder
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.max_reconnect_delay = max_reconnect_delay
+        self.logger = logging.getLogger(__name__)
+        self._stop_event = threading.Event()
+        self._thread = None
+        # Message count of the folder, from the last EXISTS response
+        self._exists = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Asks the thread to leave IDLE and log out (within about a second)."""
+        self._stop_event.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        delay = 5
+        while not self._stop_event.is_set():
+            mail = None
+            try:
+                mail = self.checker.connect(self.folder)
+                self.logger.info(f"Watching {self.checker.email_user}/{self.folder} for replies")
+                delay = 5
+                self._exists = None
+                # Catch up on what arrived while we were not connected
+                self._sync(mail)
+                while not self._stop_event.is_set():
+                    if "IDLE" in mail.capabilities:
+                        self._idle(mail)
+                    else:
+                        self._stop_event.wait(self.poll_interval)
+                    if not self._stop_event.is_set():
+                        # Even after a timed-out IDLE: the sync only searches
+                        # above the checkpoint, and it catches mail whose
+                        # announcement was missed
+                        self._sync(mail)
             except Exception as e:
-                self.logger.error(f"Error checking {recipient_email}: {e}")
+                self.logger.warning(f"IMAP watcher disconnected ({e}), retrying in {delay}s")
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+            finally:
+                if mail is not None:
+                    try:
+                        mail.logout()
+                    except Exception:
+                        pass
+
+    def _sync(self, mail):
+        """Syncs the folder, and again while the server reports new messages meanwhile."""
+        self._mailbox_grew(mail)
+        while not self._stop_event.is_set():
+            replies = self.checker.sync_folder(mail, self.get_history(), self.folder)
+            if replies:
+                self.on_replies(replies)
+            # A reply that landed during the sync may be past its SEARCH
+            if not self._mailbox_grew(mail):
+                return
+
+    def _mailbox_grew(self, mail):
+        """
+        Pops the EXISTS / RECENT responses imaplib collected during the last
+        commands. Returns True when EXISTS went above the last known count.
+        """
+        mail.untagged_responses.pop("RECENT", None)
+        counts = [int(count) for count in mail.untagged_responses.pop("EXISTS", None) or []]
+        grew = self._exists is not None and any(count > self._exists for count in counts)
+        if counts:
+            self._exists = counts[-1]
+        return grew
+
+    def _idle(self, mail):
+        """
+        Runs one IDLE command (RFC 2177) until the server reports a new
+        message, idle_timeout elapses or stop() is called.
+
+        Returns:
+            bool: True when new mail was announced.
+        """
+        tag = mail._new_tag()
+        mail.send(tag + b" IDLE\r\n")
+        new_mail = False
+        line = mail.readline()
+        while line.startswith(b"* "):
+            # Mail that arrived just before IDLE started
+            new_mail = new_mail or bool(IDLE_NEW_MAIL_RE.match(line))
+            line = mail.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.error(f"IDLE refused: {line!r}")
+
+        sock = mail.socket()
+        deadline = time.monotonic() + self.idle_timeout
+        done = new_mail
+        while not done and not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Short waits so that stop() is honoured quickly; TLS may
+            # already hold decrypted bytes that select() cannot see
+            pending = sock.pending() if hasattr(sock, "pending") else 0
+            if not pending and not select.select([sock], [], [], min(remaining, 1.0))[0]:
                 continue
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if line.startswith(b"* BYE"):
+                raise imaplib.IMAP4.abort(line.decode(errors="replace").strip())
+            new_mail = bool(IDLE_NEW_MAIL_RE.match(line))
+            # Any untagged data ends this IDLE: more lines of the same packet
+            # may sit in imaplib's read buffer, out of select()'s sight, and
+            # are read below while waiting for the tagged response
+            done = True
 
-        try:
-            mail.close()
-            mail.logout()
-        except:
-            pass
-            
-        return replies_found
+        mail.send(b"DONE\r\n")
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed after IDLE")
+            if IDLE_NEW_MAIL_RE.match(line):
+                new_mail = True
+            if line.startswith(tag):
+                if not line[len(tag):].strip().upper().startswith(b"OK"):
+                    raise imaplib.IMAP4.error(f"IDLE failed: {line!r}")
+                return new_mail
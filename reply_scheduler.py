@@ -0,0 +1,100 @@
+import imaplib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from reply_checker import ReplyChecker
+
+class ReplyCheckScheduler:
+    """
+    Checks the replies of several IMAP accounts in parallel.
+
+    Each account is handled by one thread of a small pool and uses a single
+    connection for all of its folders. The replies found in every account
+    are merged and written to the history in one batch.
+    """
+
+    def __init__(self, history_manager, max_workers=4, on_bounces=None):
+        self.history_manager = history_manager
+        self.max_workers = max_workers
+        self.on_bounces = on_bounces
+        self.logger = logging.getLogger(__name__)
+
+    def _check_account(self, account, history_entries):
+        folders = account.get("folders") or ["INBOX"]
+        result = {
+            "username": account["username"],
+            "imap_server": account["imap_server"],
+            "replies": [],
+            "folders": {},
+            "elapsed": 0.0,
+            "error": None
+        }
+        start = time.monotonic()
+        checker = ReplyChecker(account["imap_server"], account["username"], account["password"],
+                               on_bounces=self.on_bounces)
+        mail = None
+        try:
+            mail = checker.connect(None)
+            for folder in folders:
+                folder_start = time.monotonic()
+                try:
+                    # Inside the try: a missing folder only fails itself
+                    checker.select_folder(mail, folder)
+                    replies = checker.sync_folder(mail, history_entries, folder)
+                    result["replies"].extend(replies)
+                    result["folders"][folder] = {"replies": len(replies), "elapsed": time.monotonic() - folder_start}
+                except imaplib.IMAP4.abort:
+                    raise
+                except Exception as e:
+                    # e.g. a folder that does not exist on this account
+                    self.logger.error(f"{account['username']}: cannot check {folder}: {e}")
+                    result["folders"][folder] = {"replies": 0, "elapsed": time.monotonic() - folder_start, "error": str(e)}
+        except Exception as e:
+            self.logger.error(f"{account['username']}: IMAP error: {e}")
+            result["error"] = str(e)
+        finally:
+            if mail is not None:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+        result["elapsed"] = time.monotonic() - start
+        return result
+
+    def check_all(self, accounts, on_account_done=None):
+        """
+        Checks every account and stores the new replies.
+
+        Args:
+            accounts (list): dicts with imap_server, username, password and
+                folders (defaults to INBOX).
+            on_account_done (callable): Called with each account's result
+                as soon as it is done (from the calling thread).
+
+        Returns:
+            tuple: (number of replies added, list of per-account results with
+            username, imap_server, replies, folders {name: {replies,
+            elapsed, and error when that folder failed}}, elapsed and error).
+        """
+        if not accounts:
+            return 0, []
+        # Read once for every account, without the email bodies
+        history_entries = self.history_manager.get_sync_entries()
+        results = []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(accounts))) as pool:
+            futures = [pool.submit(self._check_account, account, history_entries) for account in accounts]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if on_account_done:
+                    on_account_done(result)
+
+        # A reply may show up in several folders (e.g. INBOX and "All Mail")
+        merged, seen = [], set()
+        for result in results:
+            for reply in result["replies"]:
+                key = (reply.get("uuid"), reply.get("date"))
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(reply)
+        return self.history_manager.add_replies(merged), results
@@ -1,73 +1,280 @@
 import logging
+import queue
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from html_backend import HtmlBackend
+
+# DuckDuckGo HTML version is much more lenient for basic scraping than Google
+SEARCH_URL = "https://html.duckduckgo.com/html/"
+DEFAULT_KEYWORDS = '("cherche groupe" OR "recherche groupe" OR "appel à artistes" OR "programmation musicale")'
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8"
+}
+REQUEST_TIMEOUT = 10
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+# Results collected per query when following the "next" pages
+DEFAULT_MAX_RESULTS = 300
+# Pause between two result pages of one query, to avoid being throttled
+PAGE_DELAY = 1.0
 
 class ScraperManager:
-    def __init__(self):
+    def __init__(self, search_url=SEARCH_URL, max_workers=6, per_host_limit=2, cache=None, page_delay=PAGE_DELAY,
+                 html_backend="auto"):
         self.logger = logging.getLogger(__name__)
+        self.search_url = search_url
+        # Optional ScraperCache of the result pages
+        self.cache = cache
+        self.page_delay = page_delay
+        # selectolax / lxml when installed, html.parser otherwise
+        self.html = HtmlBackend(html_backend)
+        self.max_workers = max_workers
+        # Simultaneous requests allowed to one host, whatever the pool size
+        self.per_host_limit = per_host_limit
+        # One session for every request: keep-alive connections are reused
+        # instead of a TCP + TLS handshake per search
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
 
-    def search_gigs(self, city, additional_keywords="", num_results=15):
+    def fetch(self, url, data=None, **kwargs):
         """
-        Scrapes Google for gig opportunities based on city and keywords.
+        GET (POST when `data` is given) through the shared session, waiting
+        for a free slot on the host.
         """
-        self.logger.info(f"Démarrage du scraping pour la ville: {city}")
-        
-        query_parts = []
-        if additional_keywords:
-            query_parts.append(additional_keywords)
-        else:
-            query_parts.append('("cherche groupe" OR "recherche groupe" OR "appel à artistes" OR "programmation musicale")')
-            
-        query_parts.append('concert')
+        with self._host_slot(url):
+            if data is not None:
+                response = self.session.post(url, data=data, timeout=REQUEST_TIMEOUT, **kwargs)
+            else:
+                response = self.session.get(url, timeout=REQUEST_TIMEOUT, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def fetch_page(self, url, max_bytes, timeout=REQUEST_TIMEOUT):
+        """
+        Downloads an HTML page, reading at most `max_bytes` of it.
+
+        Returns:
+            tuple: (final URL after redirects, text), text being None when
+            the URL is not an HTML page.
+        """
+        with self._host_slot(url):
+            with self.session.get(url, timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                if "html" not in response.headers.get("Content-Type", "text/html").lower():
+                    return response.url, None
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data += chunk
+                    if len(data) >= max_bytes:
+                        del data[max_bytes:]
+                        break
+                # requests assumes ISO-8859-1 without a charset header, most pages declare it in a <meta>
+                encoding = response.encoding if "charset" in response.headers.get("Content-Type", "").lower() else None
+                if not encoding:
+                    meta = META_CHARSET_RE.search(bytes(data[:4096]))
+                    encoding = meta.group(1).decode("ascii") if meta else "utf-8"
+                try:
+                    return response.url, data.decode(encoding, errors="replace")
+                except LookupError:
+                    return response.url, data.decode("utf-8", errors="replace")
+
+    def build_query(self, city, additional_keywords=""):
+        query_parts = [additional_keywords or DEFAULT_KEYWORDS, 'concert']
         if city:
             query_parts.append(city)
-            
-        query = " ".join(query_parts)
+        return " ".join(query_parts)
+
+    def parse_results(self, html, num_results=15):
+        """
+        Extracts {"title", "url", "description"} dicts from a results page
+        (HTML, or a document already parsed by self.html).
+        """
+        results = []
+        document = self.html.parse(html) if isinstance(html, str) else html
+
+        for result_block in document.select('div.result'):
+
+            title_a = result_block.select_one('a.result__url')
+            if title_a:
+                link = title_a.get('href')
+
+                # DuckDuckGo wraps links in a tiny redirect sometimes, we can try to clean it
+                if link and 'uddg=' in link:
+                    parsed = urllib.parse.urlparse(link)
+                    params = urllib.parse.parse_qs(parsed.query)
+                    if 'uddg' in params:
+                        link = params['uddg'][0]
+
+                title_h2 = result_block.select_one('h2.result__title')
+                title_text = title_h2.text(strip=True) if title_h2 else "Titre non disponible"
+
+                snippet_a = result_block.select_one('a.result__snippet')
+                snippet_text = snippet_a.text(strip=True) if snippet_a else "Description non disponible."
+
+                results.append({
+                    "title": title_text,
+                    "url": link,
+                    "description": snippet_text
+                })
+
+                if len(results) >= num_results:
+                    break
+        return results
+
+    def parse_next_page(self, html, offset=0):
+        """
+        Returns the fields of the form leading to the results after `offset`
+        (DuckDuckGo pages with a POST form carrying the next offset in "s"),
+        or None on the last page.
+        """
+        document = self.html.parse(html) if isinstance(html, str) else html
+        next_form, next_offset = None, None
+        for form in document.select("div.nav-link form"):
+            fields = {field.get("name"): field.get("value", "") for field in form.select("input") if field.get("name")}
+            try:
+                form_offset = int(fields.get("s", ""))
+            except ValueError:
+                continue
+            # The "previous" form points back, the "next" one after offset
+            if form_offset > offset and (next_offset is None or form_offset < next_offset):
+                next_form, next_offset = fields, form_offset
+        return next_form
+
+    def fetch_results_page(self, query, form=None, force_refresh=False):
+        """
+        Returns (html, from_cache) for the first results page, or for the
+        page `form` (from parse_next_page()) leads to. A page the cache
+        holds a fresh copy of is not downloaded again.
+        """
+        offset = int(form.get("s", 0)) if form else 0
+        key = self.cache.make_key(query, offset) if self.cache is not None else None
+        if key is not None and not force_refresh:
+            html = self.cache.get(key)
+            if html is not None:
+                self.logger.info(f"Résultats en cache pour : {query} ({offset})")
+                return html, True
+        if form:
+            html = self.fetch(self.search_url, data=form).text
+        else:
+            html = self.fetch(f"{self.search_url}?q={requests.utils.quote(query)}").text
+        if key is not None:
+            self.cache.put(key, html)
+        return html, False
+
+    def iter_gigs(self, city, additional_keywords="", max_results=DEFAULT_MAX_RESULTS, force_refresh=False,
+                  cancel_event=None):
+        """
+        Scrapes the result pages one after the other, following the "next"
+        page until max_results, the last page or cancel_event is set.
+
+        Yields:
+            list: The new results of each page ({"title", "url",
+            "description"} dicts, URLs already yielded are skipped).
+        """
+        self.logger.info(f"Démarrage du scraping pour la ville: {city}")
+
+        query = self.build_query(city, additional_keywords)
         self.logger.info(f"Requête Google: {query}")
-        
+
+        seen_urls = set()
+        count = 0
+        form = None
+        offset = 0
+        while count < max_results and not (cancel_event and cancel_event.is_set()):
+            try:
+                html, from_cache = self.fetch_results_page(query, form, force_refresh)
+                document = self.html.parse(html)
+                page = self.parse_results(document, max_results)
+                form = self.parse_next_page(document, offset)
+            except Exception as e:
+                self.logger.error(f"Erreur lors du scraping : {e}")
+                return
+
+            batch = [r for r in page if r["url"] not in seen_urls][:max_results - count]
+            seen_urls.update(r["url"] for r in batch)
+            count += len(batch)
+            if batch:
+                yield batch
+            # A page without anything new would only lead to more of the same
+            if not form or not batch:
+                return
+            offset = int(form.get("s", 0))
+            if not from_cache:
+                # wait() returns as soon as the scraping is cancelled
+                if cancel_event is not None:
+                    cancel_event.wait(self.page_delay)
+                else:
+                    time.sleep(self.page_delay)
+
+    def search_gigs(self, city, additional_keywords="", num_results=15, force_refresh=False):
+        """
+        Scrapes Google for gig opportunities based on city and keywords.
+
+        With a cache, a query already run within its TTL is answered from
+        disk unless force_refresh is set.
+        """
         results = []
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8"
-            }
-            # DuckDuckGo HTML version is much more lenient for basic scraping than Google
-            url = f"https://html.duckduckgo.com/html/?q={requests.utils.quote(query)}"
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            soup = BeautifulSoup(response.text, "html.parser")
-            
-            for result_block in soup.find_all('div', class_='result'):
-                
-                title_a = result_block.find('a', class_='result__url')
-                if title_a:
-                    link = title_a.get('href')
-                    
-                    # DuckDuckGo wraps links in a tiny redirect sometimes, we can try to clean it
-                    if link and 'uddg=' in link:
-                        import urllib.parse
-                        parsed = urllib.parse.urlparse(link)
-                        params = urllib.parse.parse_qs(parsed.query)
-                        if 'uddg' in params:
-                            link = params['uddg'][0]
-
-                    title_h2 = result_block.find('h2', class_='result__title')
-                    title_text = title_h2.get_text(strip=True) if title_h2 else "Titre non disponible"
-                    
-                    snippet_a = result_block.find('a', class_='result__snippet')
-                    snippet_text = snippet_a.get_text(strip=True) if snippet_a else "Description non disponible."
-                    
-                    results.append({
-                        "title": title_text,
-                        "url": link,
-                        "description": snippet_text
-                    })
-                    
-                    if len(results) >= num_results:
-                        break
-                            
-        except Exception as e:
-            self.logger.error(f"Erreur lors du scraping : {e}")
-            
+        for batch in self.iter_gigs(city, additional_keywords, num_results, force_refresh):
+            results.extend(batch)
         return results
+
+    def iter_many(self, cities, keyword_sets, max_results=DEFAULT_MAX_RESULTS, force_refresh=False,
+                  cancel_event=None):
+        """
+        Runs iter_gigs() for every city × keyword set concurrently.
+
+        Args:
+            cities (list): Cities (an empty string searches without city).
+            keyword_sets (list): Keyword strings ("" = default keywords).
+            max_results (int): Maximum results per query.
+            force_refresh (bool): Ignore the cached pages.
+            cancel_event (threading.Event): Stops every query once set.
+
+        Yields:
+            tuple: (city, keywords, results) for each page, as soon as any
+            query gets it.
+        """
+        queries = [(city, keywords) for city in (cities or [""]) for keywords in (keyword_sets or [""])]
+        stop = cancel_event or threading.Event()
+        batches = queue.Queue()
+        query_done = object()
+
+        def run(city, keywords):
+            try:
+                for batch in self.iter_gigs(city, keywords, max_results, force_refresh, stop):
+                    batches.put((city, keywords, batch))
+            finally:
+                batches.put(query_done)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(queries))) as pool:
+            for city, keywords in queries:
+                pool.submit(run, city, keywords)
+            remaining = len(queries)
+            try:
+                while remaining:
+                    item = batches.get()
+                    if item is query_done:
+                        remaining -= 1
+                    else:
+                        yield item
+            except GeneratorExit:
+                # The caller stopped reading: let the workers finish early
+                stop.set()
+                raise
@@ -0,0 +1,88 @@
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+class ScraperCache:
+    """
+    On-disk cache of search result pages.
+
+    Pages are stored zlib-compressed in SQLite, keyed by the normalized query
+    and the result offset, so that re-running a search (or going back to a
+    page already seen) does not hit the search engine again. Entries older
+    than `ttl` seconds are ignored and purged; past `max_bytes` of
+    compressed data the least recently used pages are evicted.
+    """
+
+    def __init__(self, filepath="scraper_cache.db", ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.filepath = filepath
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                html BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages(accessed)")
+
+    @staticmethod
+    def make_key(query, offset=0):
+        """Same key for queries that only differ by case or spacing."""
+        return f"{' '.join(query.lower().split())}#{offset}"
+
+    def get(self, key):
+        """Returns the cached HTML, or None when missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT html, created FROM pages WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE pages SET accessed = ? WHERE key = ?", (now, key))
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key, html):
+        data = zlib.compress(html.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("INSERT OR REPLACE INTO pages (key, html, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                               (key, data, len(data), now, now))
+            self._conn.execute("DELETE FROM pages WHERE created < ?", (now - self.ttl,))
+            self._evict()
+            self._conn.execute("COMMIT")
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM pages ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self.logger.info(f"Scraper cache: {evicted} page(s) evicted")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM pages")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
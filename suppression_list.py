@@ -0,0 +1,63 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+class SuppressionList:
+    """
+    Addresses that must never be sent to again (hard bounces).
+
+    Persisted in SQLite and mirrored in an in-memory set, so that checking a
+    recipient before a send is a constant-time lookup even with hundreds of
+    thousands of addresses. Addresses are compared case-insensitively.
+    """
+
+    def __init__(self, filepath="suppressions.db"):
+        self.filepath = filepath
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS suppressions (
+                email TEXT PRIMARY KEY,
+                reason TEXT,
+                date TEXT
+            )
+        """)
+        self._emails = {row[0] for row in self._conn.execute("SELECT email FROM suppressions")}
+
+    @staticmethod
+    def normalize(email):
+        return (email or "").strip().lower()
+
+    def __contains__(self, email):
+        return self.normalize(email) in self._emails
+
+    def __len__(self):
+        return len(self._emails)
+
+    def add_many(self, items):
+        """
+        Suppresses addresses.
+
+        Args:
+            items (list): (email, reason) pairs.
+
+        Returns:
+            int: Number of addresses that were not suppressed yet.
+        """
+        now = datetime.now().isoformat()
+        rows = {}
+        for email, reason in items:
+            email = self.normalize(email)
+            if email:
+                rows[email] = (email, reason, now)
+        with self._lock:
+            new = [row for email, row in rows.items() if email not in self._emails]
+            if new:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT OR IGNORE INTO suppressions (email, reason, date) VALUES (?, ?, ?)", new)
+                self._conn.execute("COMMIT")
+                self._emails.update(row[0] for row in new)
+        return len(new)
@@ -1,11 +1,64 @@
+import copy
+import hashlib
 import json
 import os
+import re
+
+# {name} placeholders; CSS blocks like "{ color: red; }" contain spaces and are left alone
+PLACEHOLDER_RE = re.compile(r'\{([^{}\s]+)\}')
+
+class CompiledTemplate:
+    """
+    A template split once into literal / placeholder segments.
+
+    render() fills every placeholder in a single pass, so values containing
+    "{...}" are inserted verbatim and never re-scanned. Placeholders without
+    a value are kept as-is, like the former str.replace loop did.
+    """
+
+    def __init__(self, content):
+        # re.split with a capturing group alternates literal, name, literal, ...
+        self.segments = PLACEHOLDER_RE.split(content)
+        self.variables = self.segments[1::2]
+
+    def render(self, values):
+        parts = self.segments[:]
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            value = values.get(name)
+            parts[i] = value if value is not None else "{" + name + "}"
+        return "".join(parts)
+
 
 class TemplateManager:
     def __init__(self, filepath="templates.json"):
         self.filepath = filepath
+        self._compiled = {}  # name -> (content hash, CompiledTemplate)
+        # In-memory copy of templates.json, valid while the file's (mtime, size) is unchanged
+        self._cache = None
+        self._cache_signature = None
         self._ensure_file_exists()
 
+    def _file_signature(self):
+        try:
+            st = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _write(self, templates):
+        """Atomically replaces templates.json and refreshes the cache."""
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(templates, f, indent=4)
+        os.replace(tmp_path, self.filepath)
+        self._cache = templates
+        self._cache_signature = self._file_signature()
+
+    def _editable_templates(self):
+        # Writers work on a copy so that a failed write leaves the cache intact
+        return copy.deepcopy(self.load_templates())
+
     def _ensure_file_exists(self):
         if not os.path.exists(self.filepath):
             # Check if old template file exists for migration
@@ -25,6 +78,14 @@ class TemplateManager:
                 json.dump(initial_data, f, indent=4)
 
     def load_templates(self):
+        """
+        Returns the templates, re-reading templates.json only when its
+        mtime or size changed since the last read.
+        """
+        signature = self._file_signature()
+        if self._cache is not None and signature == self._cache_signature:
+            return self._cache
+
         try:
             with open(self.filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
@@ -40,8 +101,10 @@ class TemplateManager:
                     migrated = True
                     
             if migrated:
-                with open(self.filepath, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=4)
+                self._write(data)
+            else:
+                self._cache = data
+                self._cache_signature = signature
                     
             return data
             
@@ -54,7 +117,7 @@ class TemplateManager:
             }
 
     def save_template(self, name, content, variables=None):
-        templates = self.load_templates()
+        templates = self._editable_templates()
         if variables is None:
             if name in templates:
                 variables = templates[name].get("variables", [])
@@ -65,8 +128,7 @@ class TemplateManager:
             "content": content,
             "variables": variables
         }
-        with open(self.filepath, 'w', encoding='utf-8') as f:
-            json.dump(templates, f, indent=4)
+        self._write(templates)
 
     def get_template_content(self, name):
         templates = self.load_templates()
@@ -74,64 +136,77 @@ class TemplateManager:
             return templates[name].get("content", "")
         return None
         
+    def compile_template(self, name, content=None):
+        """
+        Returns the CompiledTemplate for `name`, compiling it only when its
+        content changed since the last call.
+        """
+        if content is None:
+            content = self.get_template_content(name)
+            if content is None:
+                return None
+        digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        cached = self._compiled.get(name)
+        if cached and cached[0] == digest:
+            return cached[1]
+        compiled = CompiledTemplate(content)
+        self._compiled[name] = (digest, compiled)
+        return compiled
+
     def get_template_variables(self, name):
         templates = self.load_templates()
         if name in templates:
-            return templates[name].get("variables", [])
+            # Copy: callers must not be able to alter the cached template
+            return list(templates[name].get("variables", []))
         return []
 
     def get_template_names(self):
         return list(self.load_templates().keys())
         
     def delete_template(self, name):
-        templates = self.load_templates()
+        templates = self._editable_templates()
         if name in templates:
             del templates[name]
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(templates, f, indent=4)
+            self._write(templates)
                 
     def rename_template(self, old_name, new_name):
-        templates = self.load_templates()
+        templates = self._editable_templates()
         if old_name in templates and new_name and new_name not in templates:
             content = templates.pop(old_name)
             templates[new_name] = content
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                json.dump(templates, f, indent=4)
+            self._write(templates)
             return True
         return False
 
     def add_variable(self, template_name, var_name):
-        templates = self.load_templates()
+        templates = self._editable_templates()
         if template_name in templates:
             obj = templates[template_name]
             if "variables" not in obj:
                 obj["variables"] = []
             if var_name and var_name not in obj["variables"]:
                 obj["variables"].append(var_name)
-                with open(self.filepath, 'w', encoding='utf-8') as f:
-                    json.dump(templates, f, indent=4)
+                self._write(templates)
                 return True
         return False
 
     def remove_variable(self, template_name, var_name):
-        templates = self.load_templates()
+        templates = self._editable_templates()
         if template_name in templates:
             obj = templates[template_name]
             if "variables" in obj and var_name in obj["variables"]:
                 obj["variables"].remove(var_name)
-                with open(self.filepath, 'w', encoding='utf-8') as f:
-                    json.dump(templates, f, indent=4)
+                self._write(templates)
                 return True
         return False
 
     def rename_variable(self, template_name, old_var, new_var):
-        templates = self.load_templates()
+        templates = self._editable_templates()
         if template_name in templates:
             obj = templates[template_name]
             if "variables" in obj and old_var in obj["variables"] and new_var:
                 idx = obj["variables"].index(old_var)
                 obj["variables"][idx] = new_var
-                with open(self.filepath, 'w', encoding='utf-8') as f:
-                    json.dump(templates, f, indent=4)
+                self._write(templates)
                 return True
         return False
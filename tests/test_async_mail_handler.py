@@ -0,0 +1,198 @@
+import asyncio
+import socket
+import threading
+
+import pytest
+
+controller = pytest.importorskip("aiosmtpd.controller")
+
+from async_mail_handler import AsyncMailSender
+from campaign_manager import CampaignManager
+from history_manager import HistoryManager
+from mail_handler import MailSender, is_transient_error
+from outbox import Outbox
+from template_manager import TemplateManager
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RecordingHandler:
+    """Accepts every message (slowly), refuses recipients at refused.example."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.received = []
+        self.in_flight = 0
+        self.peak = 0
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith("@refused.example"):
+            return "550 5.1.1 User unknown"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(session)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        self.received.extend(envelope.rcpt_tos)
+        return "250 Message accepted"
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(handler):
+        server = controller.Controller(handler, hostname="127.0.0.1", port=_free_port())
+        server.start()
+        servers.append(server)
+        return server.port
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def test_send_many_success(smtp_server):
+    handler = RecordingHandler()
+    port = smtp_server(handler)
+    sender = AsyncMailSender(max_concurrency=2, timeout=5, start_tls=False)
+
+    results = sender.send_batch("127.0.0.1", port, "me@local.test", "",
+                                [(f"user{i}@local.test", "Sujet", "<p>Bonjour</p>") for i in range(3)])
+
+    assert results == [(True, "Email envoyé avec succès")] * 3
+    assert sorted(handler.received) == [f"user{i}@local.test" for i in range(3)]
+
+
+def test_send_many_permanent_error(smtp_server):
+    handler = RecordingHandler()
+    port = smtp_server(handler)
+    sender = AsyncMailSender(max_concurrency=2, timeout=5, start_tls=False)
+    errors = {}
+
+    results = sender.send_batch("127.0.0.1", port, "me@local.test", "",
+                                [("ok@local.test", "Sujet", "<p>1</p>"), ("nobody@refused.example", "Sujet", "<p>2</p>")],
+                                on_error=lambda index, error: errors.setdefault(index, error))
+
+    assert results[0] == (True, "Email envoyé avec succès")
+    assert results[1][0] is False
+    assert "550" in results[1][1]
+    assert list(errors) == [1]
+    assert not is_transient_error(errors[1])
+    assert handler.received == ["ok@local.test"]
+
+
+def test_send_many_concurrency_cap(smtp_server):
+    handler = RecordingHandler(delay=0.05)
+    port = smtp_server(handler)
+    sender = AsyncMailSender(max_concurrency=3, timeout=5, start_tls=False)
+    done = []
+
+    results = sender.send_batch("127.0.0.1", port, "me@local.test", "",
+                                [(f"user{i}@local.test", "Sujet", "<p>Bonjour</p>") for i in range(12)],
+                                on_result=lambda index, success, msg: done.append(index))
+
+    assert all(success for success, _ in results)
+    assert sorted(done) == list(range(12))
+    assert len(handler.received) == 12
+    assert 1 < handler.peak <= 3
+
+
+class FlakyHandler(RecordingHandler):
+    """Answers 421 to the first MAIL FROM or to the first DATA."""
+
+    def __init__(self, stage):
+        super().__init__()
+        self.stage = stage
+        self.data_calls = 0
+        self.refused = False
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        if self.stage == "MAIL" and not self.refused:
+            self.refused = True
+            return "421 4.3.2 Service not available"
+        envelope.mail_from = address
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.data_calls += 1
+        if self.stage == "DATA" and self.data_calls == 1:
+            return "421 4.3.2 Closing connection"
+        return await super().handle_DATA(server, session, envelope)
+
+
+def test_send_retries_a_refused_mail_from_on_a_new_connection(smtp_server):
+    handler = FlakyHandler("MAIL")
+    port = smtp_server(handler)
+    sender = AsyncMailSender(max_concurrency=1, timeout=5, start_tls=False)
+
+    results = sender.send_batch("127.0.0.1", port, "me@local.test", "", [("a@local.test", "Sujet", "<p>1</p>")])
+
+    assert results == [(True, "Email envoyé avec succès")]
+    assert handler.received == ["a@local.test"]
+
+
+def test_send_does_not_resend_after_data(smtp_server):
+    handler = FlakyHandler("DATA")
+    port = smtp_server(handler)
+    sender = AsyncMailSender(max_concurrency=1, timeout=5, start_tls=False)
+    errors = {}
+
+    results = sender.send_batch("127.0.0.1", port, "me@local.test", "", [("a@local.test", "Sujet", "<p>1</p>")],
+                                on_error=lambda index, error: errors.setdefault(index, error))
+
+    assert results[0][0] is False
+    assert handler.data_calls == 1
+    assert is_transient_error(errors[0])
+
+
+@pytest.fixture
+def campaign(tmp_path):
+    templates = TemplateManager(str(tmp_path / "templates.json"))
+    templates.save_template("offre", "<p>Bonjour {nom}</p>", ["nom"])
+    sender = AsyncMailSender(timeout=5, start_tls=False)
+    return CampaignManager(MailSender(), HistoryManager(str(tmp_path / "history.db")), templates,
+                           async_sender=sender, outbox=Outbox(str(tmp_path / "outbox.db")))
+
+
+def test_async_campaign_reuses_one_connection_per_worker(smtp_server, campaign):
+    handler = RecordingHandler()
+    port = smtp_server(handler)
+    recipients = [{"email": f"user{i}@local.test", "variables": {"nom": str(i)}} for i in range(40)]
+    settings = {"smtp_server": "127.0.0.1", "smtp_port": port, "username": "me@local.test", "password": ""}
+
+    stats = campaign.run_campaign(recipients, "offre", "Sujet", settings, workers=4, engine="async")
+
+    assert stats["sent"] == 40
+    assert sorted(handler.received) == sorted(r["email"] for r in recipients)
+    assert len(handler.sessions) <= 4
+
+
+def test_async_campaign_stops_between_claims(smtp_server, campaign):
+    port = smtp_server(RecordingHandler(delay=0.02))
+    recipients = [{"email": f"user{i}@local.test", "variables": {"nom": str(i)}} for i in range(30)]
+    settings = {"smtp_server": "127.0.0.1", "smtp_port": port, "username": "me@local.test", "password": ""}
+    stop = threading.Event()
+
+    def on_progress(stats):
+        if stats["sent"] >= 5:
+            stop.set()
+
+    stats = campaign.run_campaign(recipients, "offre", "Sujet", settings, workers=2, on_progress=on_progress,
+                                  stop_event=stop, engine="async")
+
+    assert 5 <= stats["sent"] < 30
+    assert stats["sent"] + stats["cancelled"] == 30
+    statuses = [entry["status"] for entry in campaign.history_manager.get_history()]
+    assert statuses.count("Annulé") == stats["cancelled"]
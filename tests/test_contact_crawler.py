@@ -0,0 +1,120 @@
+import csv
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from contact_crawler import ContactCrawler
+from scraper import ScraperManager
+
+
+class FixtureSite(ThreadingHTTPServer):
+    """Serves {path: (content type, body)} and records the paths requested."""
+    daemon_threads = True
+
+    def __init__(self, pages):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.pages = pages
+        self.requested = []
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requested.append(self.path)
+        if self.path not in self.server.pages:
+            self.send_error(404)
+            return
+        content_type, body = self.server.pages[self.path]
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def html(body):
+    return "text/html; charset=utf-8", f"<html><body>{body}</body></html>"
+
+
+@pytest.fixture
+def sites():
+    servers = []
+
+    def start(pages):
+        server = FixtureSite(pages)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_crawl_extracts_contacts_and_writes_recipients(sites, tmp_path):
+    other = sites({"/contact": html('<a href="mailto:spy@site-b.fr">spy</a>')})
+    site = sites({
+        "/": html(f"""
+            <a href="mailto:Booking@Site-A.fr?subject=Concert">Booking</a>
+            <img src="logo@2x.png">
+            <a href="/contact">Nous contacter</a>
+            <a href="/contact#formulaire">Formulaire</a>
+            <a href="/a-propos">À propos</a>
+            <a href="/mentions-legales">Mentions légales</a>
+            <a href="/qui-sommes-nous">Qui sommes-nous</a>
+            <a href="{other.base}/contact">Contact du partenaire</a>
+        """),
+        "/contact": html('Écrivez à info [at] site-a (dot) fr <a href="/contact/equipe">Équipe</a>'),
+        "/contact/equipe": html('<a href="mailto:deep@site-a.fr">too deep</a>'),
+        "/a-propos": html("Presse : Presse@Site-A.fr."),
+        "/mentions-legales": html("Exemple : contact@example.com"),
+        "/qui-sommes-nous": html('<a href="mailto:other@site-a.fr">over the limit</a>'),
+        "/plaquette.pdf": ("application/pdf", "%PDF-1.4 pdf@site-a.fr"),
+    })
+    scraper = ScraperManager(page_delay=0, html_backend="html.parser")
+    crawler = ContactCrawler(scraper, max_workers=4, timeout=5, max_contact_pages=3)
+    results = [
+        {"title": "Salle A", "url": site.base + "/"},
+        {"title": "Plaquette", "url": site.base + "/plaquette.pdf"},
+        {"title": "Disparue", "url": site.base + "/absent"},
+        {"title": "Pas un site", "url": "mailto:nobody@site-a.fr"},
+    ]
+    done = {}
+
+    contacts = crawler.crawl(results, on_site_done=lambda result, found: done.setdefault(result["title"], found))
+
+    by_email = {c["email"]: c for c in contacts}
+    assert sorted(by_email) == ["booking@site-a.fr", "info@site-a.fr", "presse@site-a.fr"]
+    assert by_email["booking@site-a.fr"]["source"] == site.base + "/"
+    assert by_email["info@site-a.fr"]["source"] == site.base + "/contact"
+    assert all(c["url"] == site.base + "/" and c["title"] == "Salle A" for c in contacts)
+
+    # Only the first max_contact_pages same-site links of the result page, never deeper nor off-site
+    assert sorted(site.requested) == ["/", "/a-propos", "/absent", "/contact", "/mentions-legales", "/plaquette.pdf"]
+    assert other.requested == []
+    assert sorted(done) == ["Disparue", "Plaquette", "Salle A"]
+    assert done["Plaquette"] == [] and done["Disparue"] == []
+
+    path = tmp_path / "destinataires.csv"
+    assert crawler.write_recipients(contacts, str(path)) == 3
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ["email", "nom", "site", "source"]
+    assert sorted((r["email"], r["nom"], r["site"]) for r in rows) == [
+        (email, "Salle A", site.base + "/") for email in sorted(by_email)]
+
+
+def test_page_size_cap(sites):
+    site = sites({"/": html("x" * 5000 + '<a href="mailto:late@site-a.fr">late</a>')})
+    crawler = ContactCrawler(ScraperManager(html_backend="html.parser"), max_page_bytes=1024)
+
+    assert crawler.crawl([{"title": "Gros", "url": site.base + "/"}]) == []
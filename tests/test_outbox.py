@@ -0,0 +1,132 @@
+import smtplib
+import time
+
+import pytest
+
+from mail_handler import QuotaExceededError, SendInterruptedError, is_transient_error
+from outbox import Outbox
+
+SETTINGS = {"smtp_server": "smtp.local.test", "smtp_port": 587, "username": "me@local.test"}
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return Outbox(str(tmp_path / "outbox.db"), max_attempts=3, base_delay=10, max_delay=15)
+
+
+def enqueue(outbox, count=1, batch=None, prefix="user"):
+    messages = [{"email": f"{prefix}{i}@local.test", "subject": "Sujet", "content": "<p>1</p>"} for i in range(count)]
+    return outbox.enqueue_many(messages, SETTINGS, batch)
+
+
+def rows(outbox):
+    conn = outbox._connect()
+    try:
+        return {r["email"]: dict(r) for r in conn.execute("SELECT * FROM outbox")}
+    finally:
+        conn.close()
+
+
+def make_due(outbox):
+    conn = outbox._connect()
+    try:
+        conn.execute("UPDATE outbox SET next_attempt = 0")
+    finally:
+        conn.close()
+
+
+def test_crash_while_sending_is_failed_not_resent(outbox):
+    enqueue(outbox, 2)
+    sending, claimed = outbox.claim(2)
+    outbox.mark_sending(sending)
+
+    interrupted = outbox.recover_interrupted()
+
+    assert [r["email"] for r in interrupted] == [sending["email"]]
+    state = rows(outbox)
+    assert state[sending["email"]]["status"] == "failed"
+    # Never reached SMTP: sent again, without an attempt counted
+    assert state[claimed["email"]]["status"] == "pending"
+    assert state[claimed["email"]]["attempts"] == 0
+    assert [r["email"] for r in outbox.claim(5)] == [claimed["email"]]
+
+
+def test_transient_errors_back_off_then_fail(outbox):
+    enqueue(outbox)
+    error = smtplib.SMTPResponseException(451, b"Try again later")
+    delays = []
+    for attempt in range(1, 4):
+        make_due(outbox)
+        row = outbox.claim()[0]
+        before = time.time()
+        final = outbox.settle(row, error, is_transient_error)
+        state = rows(outbox)["user0@local.test"]
+        assert state["attempts"] == attempt
+        if attempt < 3:
+            assert not final and state["status"] == "pending"
+            delays.append(state["next_attempt"] - before)
+        else:
+            assert final and state["status"] == "failed"
+
+    # base_delay * 2 ** (attempts - 1), capped at max_delay, with a +/- 20 % jitter
+    assert 8 <= delays[0] <= 12 + 0.5
+    assert 12 <= delays[1] <= 18 + 0.5
+
+
+def test_permanent_error_fails_at_once(outbox):
+    enqueue(outbox)
+    row = outbox.claim()[0]
+
+    assert outbox.settle(row, smtplib.SMTPResponseException(550, b"No such user"), is_transient_error)
+    assert rows(outbox)["user0@local.test"]["status"] == "failed"
+
+
+def test_spent_quota_defers_without_an_attempt(outbox):
+    enqueue(outbox)
+    row = outbox.claim()[0]
+    reset = time.time() + 3600
+
+    assert not outbox.settle(row, QuotaExceededError("Daily quota reached", reset), is_transient_error)
+
+    state = rows(outbox)["user0@local.test"]
+    assert state["status"] == "pending"
+    assert state["attempts"] == 0
+    assert state["next_attempt"] == pytest.approx(reset)
+    assert outbox.claim() == []
+
+
+def test_stop_during_rate_limit_wait_is_not_an_attempt(outbox):
+    enqueue(outbox)
+    row = outbox.claim()[0]
+
+    assert not outbox.settle(row, SendInterruptedError("Stopped"), is_transient_error)
+
+    assert rows(outbox)["user0@local.test"]["attempts"] == 0
+    assert len(outbox.claim()) == 1
+
+
+def test_cancel_batch_only_drops_pending_rows(outbox):
+    enqueue(outbox, 4, batch="campagne")
+    enqueue(outbox, 1, batch="autre", prefix="other")
+    claimed, sending, sent = outbox.claim(3, batch="campagne")
+    outbox.mark_sending(sending)
+    outbox.mark_sent(sent)
+
+    cancelled = outbox.cancel_batch("campagne")
+
+    assert [r["email"] for r in cancelled] == ["user3@local.test"]
+    state = rows(outbox)
+    assert "user3@local.test" not in state
+    assert state[claimed["email"]]["status"] == "claimed"
+    assert state[sending["email"]]["status"] == "sending"
+    assert state[sent["email"]]["status"] == "sent"
+    assert state["other0@local.test"]["status"] == "pending"
+
+
+def test_held_batch_is_left_to_its_owner(outbox):
+    enqueue(outbox, 1, batch="campagne")
+    enqueue(outbox, 1, batch=None, prefix="other")
+    outbox.hold_batch("campagne")
+
+    assert [r["batch"] for r in outbox.claim(5)] == [None]
+    assert [r["batch"] for r in outbox.claim(5, batch="campagne")] == ["campagne"]
@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from mail_handler import MailSender, QuotaExceededError, SendInterruptedError
+from rate_limiter import RateLimiter
+
+
+def _closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    return RateLimiter(str(tmp_path / "quotas.json"))
+
+
+def test_failed_connection_does_not_spend_quota(limiter):
+    limiter.set_limits("me@local.test", per_day=2)
+    sender = MailSender(rate_limiter=limiter)
+    port = _closed_port()
+
+    for _ in range(3):
+        with pytest.raises(OSError):
+            sender.deliver("127.0.0.1", port, "me@local.test", "", "to@local.test", "Sujet", "<p>1</p>")
+
+    assert limiter.remaining_today("me@local.test") == 2
+
+
+def test_spent_quota_raises_with_reset_time(limiter):
+    limiter.set_limits("me@local.test", per_day=1)
+    assert limiter.try_acquire("me@local.test") == (True, 0)
+
+    with pytest.raises(QuotaExceededError) as info:
+        MailSender(rate_limiter=limiter).deliver("127.0.0.1", _closed_port(), "me@local.test", "", "to@local.test",
+                                                 "Sujet", "<p>1</p>")
+    assert info.value.retry_at == limiter.next_reset()
+
+
+def test_stop_ends_the_rate_limit_wait(limiter):
+    limiter.set_limits("me@local.test", per_minute=1, per_day=10)
+    assert limiter.try_acquire("me@local.test") == (True, 0)
+    stop = threading.Event()
+    threading.Timer(0.2, stop.set).start()
+    start = time.monotonic()
+
+    with pytest.raises(SendInterruptedError):
+        MailSender(rate_limiter=limiter).deliver("127.0.0.1", _closed_port(), "me@local.test", "", "to@local.test",
+                                                 "Sujet", "<p>1</p>", stop_event=stop)
+    assert time.monotonic() - start < 5
+    assert limiter.remaining_today("me@local.test") == 9
+
+
+def test_every_send_is_persisted(tmp_path):
+    path = str(tmp_path / "quotas.json")
+    limiter = RateLimiter(path)
+    limiter.set_limits("me@local.test", per_day=3)
+    for _ in range(2):
+        assert limiter.try_acquire("me@local.test") == (True, 0)
+
+    # A new process (e.g. after a crash) sees both sends
+    restarted = RateLimiter(path)
+    restarted.set_limits("me@local.test", per_day=3)
+    assert restarted.remaining_today("me@local.test") == 1
@@ -0,0 +1,296 @@
+import os
+import re
+import socket
+import time
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+import pytest
+
+from history_manager import HistoryManager
+from reply_checker import FAILED_UID_RETRIES, ReplyChecker, ReplyWatcher
+from reply_scheduler import ReplyCheckScheduler
+
+SENT = datetime.now().replace(microsecond=0) - timedelta(days=2)
+
+
+class FakeIMAP:
+    """
+    Stands in for an imaplib connection whose only folder is INBOX:
+    SELECT, STATUS, UID SEARCH (only the "UID n:*" range is honoured, senders are
+    matched by the checker itself) and UID FETCH of headers / full messages.
+    BODYSTRUCTURE is not supported, like on some servers. With
+    uid_after_literal, UID comes after the message data, like on Exchange.
+    stale_uidnext overrides the UIDNEXT that STATUS reports, and
+    after_fetch runs after each UID FETCH.
+    """
+
+    def __init__(self, uidvalidity=1, uid_after_literal=False):
+        self.uidvalidity = uidvalidity
+        self.stale_uidnext = None
+        self.after_fetch = None
+        self.untagged_responses = {}
+        self.uid_after_literal = uid_after_literal
+        self.messages = {}
+        self.fetched = []
+        self.searches = []
+
+    def add(self, uid, raw):
+        self.messages[uid] = raw
+
+    def select(self, mailbox):
+        if mailbox.strip('"').upper() != "INBOX":
+            return "NO", [b"Mailbox does not exist"]
+        return "OK", [str(len(self.messages)).encode()]
+
+    def logout(self):
+        pass
+
+    def status(self, mailbox, items):
+        uidnext = self.stale_uidnext or max(self.messages, default=0) + 1
+        return "OK", [f'"INBOX" (UIDVALIDITY {self.uidvalidity} UIDNEXT {uidnext})'.encode()]
+
+    def uid(self, command, *args):
+        if command == "SEARCH":
+            criteria = args[1]
+            self.searches.append(criteria)
+            first = int(re.match(r"UID (\d+):\*", criteria).group(1))
+            # Like real servers, "n:*" always matches the last message
+            uids = [uid for uid in sorted(self.messages) if uid >= first] or sorted(self.messages)[-1:]
+            return "OK", [" ".join(map(str, uids)).encode()]
+
+        uid_set, items = args
+        if "BODYSTRUCTURE" in items:
+            return "BAD", [b"BODYSTRUCTURE not supported"]
+        data = []
+        for uid in map(int, uid_set.split(",")):
+            raw = self.messages.get(uid)
+            if raw is None:
+                continue
+            if "HEADER.FIELDS" in items:
+                body, section = raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n", b"BODY[HEADER.FIELDS (FROM DATE)]"
+            else:
+                body, section = raw, b"RFC822"
+            self.fetched.append((uid, section))
+            if self.uid_after_literal:
+                data.append((b"%d (RFC822.SIZE %d %s {%d}" % (uid, len(raw), section, len(body)), body))
+                data.append(b" UID %d)" % uid)
+            else:
+                data.append((b"%d (UID %d RFC822.SIZE %d %s {%d}" % (uid, uid, len(raw), section, len(body)), body))
+                data.append(b")")
+        if self.after_fetch:
+            self.after_fetch()
+        return "OK", data
+
+
+def reply(uid, body="Merci pour votre message"):
+    msg = EmailMessage()
+    msg["From"] = "Fan <fan@example.org>"
+    msg["To"] = "me@test.fr"
+    msg["Subject"] = "Re: Concert"
+    msg["Date"] = format_datetime(SENT + timedelta(hours=uid))
+    msg["Message-ID"] = f"<reply{uid}@example.org>"
+    msg["In-Reply-To"] = "<sent1@test.fr>"
+    msg.set_content(body)
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+
+@pytest.fixture
+def history():
+    return [{"uuid": "entry-1", "email": "fan@example.org", "status": "Envoyé", "date": SENT.isoformat(),
+             "message_id": "<sent1@test.fr>", "replies": []}]
+
+
+@pytest.fixture
+def checker(tmp_path):
+    return ReplyChecker("imap.test.fr", "me@test.fr", "secret", state_filepath=str(tmp_path / "state.json"),
+                        spool_dir=str(tmp_path / "spool"), parse_workers=0, max_message_size=4096)
+
+
+def test_first_sync_saves_checkpoint(checker, history):
+    mail = FakeIMAP()
+    mail.add(1, reply(1))
+    mail.add(2, reply(2))
+
+    replies = checker.sync_folder(mail, history)
+
+    assert sorted(r["message_id"] for r in replies) == ["<reply1@example.org>", "<reply2@example.org>"]
+    assert all(r["uuid"] == "entry-1" for r in replies)
+    assert mail.searches[0].startswith("UID 1:*")
+    assert checker.load_checkpoint("inbox") == {"uidvalidity": 1, "last_uid": 2, "failed_uids": {}}
+
+
+def test_second_sync_fetches_nothing(checker, history):
+    mail = FakeIMAP()
+    mail.add(1, reply(1))
+    mail.add(2, reply(2))
+    checker.sync_folder(mail, history)
+    mail.searches.clear()
+    mail.fetched.clear()
+
+    assert checker.sync_folder(mail, history) == []
+    assert mail.searches[0].startswith("UID 3:*")
+    assert mail.fetched == []
+
+
+def test_stale_uidnext_does_not_move_checkpoint_back(checker, history):
+    mail = FakeIMAP()
+    mail.add(1, reply(1))
+    mail.add(2, reply(2))
+    mail.stale_uidnext = 2
+
+    checker.sync_folder(mail, history)
+
+    assert checker.load_checkpoint("inbox")["last_uid"] == 2
+
+
+def test_uid_after_literal(checker, history):
+    mail = FakeIMAP(uid_after_literal=True)
+    mail.add(7, reply(1))
+    mail.add(9, reply(2, "x" * 8000))
+
+    assert [(uid, size) for uid, size, _ in checker.fetch_headers(mail, [7, 9])] == [(7, len(reply(1))),
+                                                                                  (9, len(reply(2, "x" * 8000)))]
+    replies = checker.sync_folder(mail, history)
+
+    assert [r["message_id"] for r in replies] == ["<reply1@example.org>"]
+    assert checker.load_checkpoint("inbox")["failed_uids"] == {9: 1}
+
+
+def test_uidvalidity_change_resets_checkpoint(checker, history):
+    mail = FakeIMAP(uidvalidity=1)
+    mail.add(1, reply(1))
+    checker.sync_folder(mail, history)
+
+    mail.uidvalidity = 2
+    mail.searches.clear()
+    replies = checker.sync_folder(mail, history)
+
+    assert [r["message_id"] for r in replies] == ["<reply1@example.org>"]
+    assert mail.searches[0].startswith("UID 1:*")
+    assert checker.load_checkpoint("inbox")["uidvalidity"] == 2
+
+
+def test_failed_uid_does_not_block_checkpoint(checker, history):
+    mail = FakeIMAP()
+    mail.add(1, reply(1))
+    # Above max_message_size: read through BODYSTRUCTURE, which fails
+    mail.add(2, reply(2, "x" * 8000))
+    mail.add(3, reply(3))
+
+    replies = checker.sync_folder(mail, history)
+
+    assert sorted(r["message_id"] for r in replies) == ["<reply1@example.org>", "<reply3@example.org>"]
+    assert checker.load_checkpoint("inbox") == {"uidvalidity": 1, "last_uid": 3, "failed_uids": {2: 1}}
+
+    # Later syncs only retry the failed UID on top of the new mail
+    mail.add(4, reply(4))
+    mail.fetched.clear()
+    replies = checker.sync_folder(mail, history)
+
+    assert [r["message_id"] for r in replies] == ["<reply4@example.org>"]
+    assert sorted({uid for uid, _ in mail.fetched}) == [2, 4]
+    assert checker.load_checkpoint("inbox") == {"uidvalidity": 1, "last_uid": 4, "failed_uids": {2: 2}}
+
+    for _ in range(FAILED_UID_RETRIES - 2):
+        checker.sync_folder(mail, history)
+    assert checker.load_checkpoint("inbox")["failed_uids"] == {}
+
+
+def test_watcher_resyncs_for_mail_announced_during_a_sync(checker, history):
+    mail = FakeIMAP()
+    mail.add(1, reply(1))
+    # Left by SELECT
+    mail.untagged_responses = {"EXISTS": [b"1"], "RECENT": [b"0"]}
+
+    def new_reply():
+        mail.after_fetch = None
+        mail.add(2, reply(2))
+        mail.untagged_responses.setdefault("EXISTS", []).append(b"2")
+
+    mail.after_fetch = new_reply
+    found = []
+    watcher = ReplyWatcher(checker, lambda: history, found.extend)
+
+    watcher._sync(mail)
+
+    assert [r["message_id"] for r in found] == ["<reply1@example.org>", "<reply2@example.org>"]
+    assert mail.untagged_responses == {}
+
+
+class ScriptedConnection:
+    """Replays server lines to ReplyWatcher._idle()."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.sent = []
+        self.sock, self.peer = socket.socketpair()
+
+    def _new_tag(self):
+        return b"A1"
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def readline(self):
+        return self.lines.pop(0) if self.lines else b""
+
+    def socket(self):
+        return self.sock
+
+
+def test_idle_ends_at_once_on_mail_announced_before_continuation(checker):
+    mail = ScriptedConnection([b"* 3 EXISTS\r\n", b"+ idling\r\n", b"A1 OK IDLE terminated\r\n"])
+    watcher = ReplyWatcher(checker, list, None, idle_timeout=3)
+    start = time.monotonic()
+
+    assert watcher._idle(mail) is True
+    assert time.monotonic() - start < 1
+    assert mail.sent == [b"A1 IDLE\r\n", b"DONE\r\n"]
+    mail.sock.close()
+    mail.peer.close()
+
+
+def test_attachment_spool_is_keyed_on_the_message_and_removed_with_the_entry(checker, history, tmp_path):
+    msg = EmailMessage()
+    msg["From"] = "fan@example.org"
+    msg["Subject"] = "Re: Concert"
+    msg["Date"] = format_datetime(SENT + timedelta(hours=1))
+    msg["In-Reply-To"] = "<sent1@test.fr>"
+    msg.set_content("Voici le devis")
+    msg.add_attachment(b"%PDF-1.4", maintype="application", subtype="pdf", filename="devis.pdf")
+    mail = FakeIMAP()
+    mail.add(1, msg.as_bytes())
+
+    first = checker.sync_folder(mail, history)[0]["attachments"][0]["path"]
+    # Fetched again, e.g. after the checkpoint was lost
+    checker.save_checkpoint("inbox", 1, 0)
+    replies = checker.sync_folder(mail, history)
+    path = replies[0]["attachments"][0]["path"]
+
+    assert path == first
+    assert os.listdir(os.path.dirname(path)) == ["devis.pdf"]
+
+    manager = HistoryManager(str(tmp_path / "history.db"))
+    manager.add_entries([dict(history[0], subject="Concert", variable="", content="")])
+    manager.add_replies(replies)
+    assert manager.delete_entry("entry-1")
+    assert not os.path.exists(os.path.dirname(path))
+
+
+def test_missing_folder_does_not_fail_the_account(history, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mail = FakeIMAP()
+    mail.add(1, reply(1))
+    monkeypatch.setattr(ReplyChecker, "connect", lambda self, folder="inbox": mail)
+    scheduler = ReplyCheckScheduler(HistoryManager(str(tmp_path / "history.db")))
+    account = {"imap_server": "imap.test.fr", "username": "me@test.fr", "password": "secret",
+               "folders": ["Archives", "INBOX"]}
+
+    result = scheduler._check_account(account, history)
+
+    assert result["error"] is None
+    assert "error" in result["folders"]["Archives"]
+    assert result["folders"]["INBOX"]["replies"] == 1
+    assert [r["message_id"] for r in result["replies"]] == ["<reply1@example.org>"]
@@ -0,0 +1,107 @@
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from scraper import ScraperManager
+
+RESULTS_PER_PAGE = 5
+PAGES = 2
+
+
+class FakeSearchServer(ThreadingHTTPServer):
+    """
+    DuckDuckGo HTML stand-in: GET ?q= returns the first page, POST with the
+    "next" form returns the following one. Tracks the requests in flight.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.05):
+        super().__init__(("127.0.0.1", 0), SearchHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+        self.connections = set()
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)["q"][0]
+        self.respond(query, 0)
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+        self.respond(form["q"][0], int(form["s"][0]))
+
+    def respond(self, query, offset):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.requests += 1
+            server.peak = max(server.peak, server.in_flight)
+            server.connections.add(self.client_address)
+        try:
+            time.sleep(server.delay)
+            body = self.page(query, offset).encode("utf-8")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def page(self, query, offset):
+        slug = urllib.parse.quote(query, safe="")
+        results = "".join(
+            f'<div class="result"><h2 class="result__title">{query} {offset + i}</h2>'
+            f'<a class="result__url" href="https://site.example/{slug}/{offset + i}">lien</a>'
+            f'<a class="result__snippet">Annonce {offset + i}</a></div>'
+            for i in range(RESULTS_PER_PAGE))
+        next_offset = offset + RESULTS_PER_PAGE
+        nav = ""
+        if next_offset < RESULTS_PER_PAGE * PAGES:
+            nav = (f'<div class="nav-link"><form method="post"><input type="hidden" name="q" value="{query}">'
+                   f'<input type="hidden" name="s" value="{next_offset}"></form></div>')
+        return f"<html><body>{results}{nav}</body></html>"
+
+
+@pytest.fixture
+def search_server():
+    server = FakeSearchServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_iter_many_respects_per_host_limit(search_server):
+    url = f"http://127.0.0.1:{search_server.server_address[1]}/html/"
+    scraper = ScraperManager(search_url=url, max_workers=6, per_host_limit=2, page_delay=0, html_backend="html.parser")
+    cities = ["Paris", "Lyon", "Nantes", "Lille", "Rennes", "Brest"]
+
+    found = {}
+    for city, keywords, batch in scraper.iter_many(cities, ["groupe"]):
+        found.setdefault(city, []).extend(batch)
+
+    assert search_server.peak == 2
+    assert search_server.requests == len(cities) * PAGES
+    # Every page of every query, each result once
+    assert sorted(found) == sorted(cities)
+    for city, results in found.items():
+        assert len(results) == RESULTS_PER_PAGE * PAGES
+        assert len({r["url"] for r in results}) == len(results)
+        assert all(city in r["title"] for r in results)
+    # Keep-alive connections of the shared session are reused between requests
+    assert len(search_server.connections) < search_server.requests
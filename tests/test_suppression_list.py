@@ -0,0 +1,106 @@
+import socket
+from datetime import timedelta
+from email.utils import format_datetime
+
+import pytest
+
+from async_mail_handler import AsyncMailSender
+from history_manager import HistoryManager
+from mail_handler import MailSender, SuppressedAddressError, is_transient_error
+from reply_checker import ReplyChecker
+from suppression_list import SuppressionList
+from test_reply_checker import SENT, FakeIMAP
+
+DSN = b"""From: Mail Delivery System <MAILER-DAEMON@mx.test.fr>\r
+To: me@test.fr\r
+Subject: Undelivered Mail Returned to Sender\r
+Date: %(date)s\r
+Message-ID: <dsn1@mx.test.fr>\r
+MIME-Version: 1.0\r
+Content-Type: multipart/report; report-type=delivery-status; boundary="BOUNDARY"\r
+\r
+--BOUNDARY\r
+Content-Type: text/plain; charset=us-ascii\r
+\r
+Your message could not be delivered.\r
+--BOUNDARY\r
+Content-Type: message/delivery-status\r
+\r
+Reporting-MTA: dns; mx.test.fr\r
+\r
+Final-Recipient: rfc822; Fan@Example.org\r
+Action: failed\r
+Status: 5.1.1\r
+Diagnostic-Code: smtp; 550 5.1.1 <fan@example.org>:\r
+ User unknown\r
+\r
+Final-Recipient: rfc822; busy@example.org\r
+Action: delayed\r
+Status: 4.2.2\r
+--BOUNDARY\r
+Content-Type: text/rfc822-headers\r
+\r
+From: me@test.fr\r
+To: fan@example.org\r
+Subject: Concert\r
+Message-ID: <sent1@test.fr>\r
+\r
+--BOUNDARY--\r
+"""
+
+
+@pytest.fixture
+def history(tmp_path):
+    manager = HistoryManager(str(tmp_path / "history.db"))
+    manager.add_entries([{"uuid": "entry-1", "email": "fan@example.org", "variable": "", "subject": "Concert",
+                          "status": "Envoyé", "content": "", "date": SENT.isoformat(),
+                          "message_id": "<sent1@test.fr>"}])
+    return manager
+
+
+@pytest.fixture
+def suppressions(tmp_path):
+    return SuppressionList(str(tmp_path / "suppressions.db"))
+
+
+def test_hard_bounce_dsn_suppresses_the_address_and_fails_the_entry(tmp_path, history, suppressions):
+    def on_bounces(bounces):
+        # Same wiring as the application
+        history.mark_bounces(bounces)
+        suppressions.add_many((b["email"], f"{b['status']} {b['diagnostic']}".strip()) for b in bounces)
+
+    checker = ReplyChecker("imap.test.fr", "me@test.fr", "secret", state_filepath=str(tmp_path / "state.json"),
+                           spool_dir=str(tmp_path / "spool"), parse_workers=0, on_bounces=on_bounces)
+    mail = FakeIMAP()
+    mail.add(1, DSN % {b"date": format_datetime(SENT + timedelta(hours=1)).encode()})
+
+    # Never taken for a reply, although it quotes the sent Message-ID
+    assert checker.sync_folder(mail, history.get_sync_entries()) == []
+
+    assert "fan@example.org" in suppressions
+    assert "FAN@example.org" in suppressions
+    assert "busy@example.org" not in suppressions
+    entry = history.get_entry("entry-1")
+    assert entry["status"] == "Échec"
+    assert entry["bounce"]["status"] == "5.1.1"
+    assert entry["bounce"]["diagnostic"] == "smtp; 550 5.1.1 <fan@example.org>: User unknown"
+
+
+def test_deliver_refuses_suppressed_addresses(suppressions):
+    suppressions.add_many([("fan@example.org", "5.1.1")])
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    # Refused before any connection: the port has no server
+    with pytest.raises(SuppressedAddressError) as info:
+        MailSender(suppression_list=suppressions).deliver("127.0.0.1", port, "me@test.fr", "", "Fan@Example.org",
+                                                          "Concert", "<p>Bonjour</p>")
+    assert not is_transient_error(info.value)
+
+    errors = {}
+    results = AsyncMailSender(timeout=5, suppression_list=suppressions).send_batch(
+        "127.0.0.1", port, "me@test.fr", "", [("fan@example.org", "Concert", "<p>Bonjour</p>")],
+        on_error=lambda index, error: errors.setdefault(index, error))
+    assert results[0][0] is False
+    assert isinstance(errors[0], SuppressedAddressError)